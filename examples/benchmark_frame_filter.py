@@ -0,0 +1,83 @@
+import json
+import time
+import random
+import logging
+import statistics
+
+from openbroker.prefilter import FramePreFilter
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROUNDS = 5
+FRAMES = 100_000
+# the account runs many tagged strategies, this client handles one of them
+TAGS = [f'strategy_{i}' for i in range(20)]
+USER_TAG = TAGS[0]
+
+
+def order_update(user_tag: str) -> str:
+    return json.dumps({
+        'order_id': '6d1b8a64-4c8b-4a4e-9a55-0e6b1f3f6a10',
+        'created_at': '2024-01-25T09:15:00.123456+05:30',
+        'updated_at': '2024-01-25T09:15:00.456789+05:30',
+        'user_tag': user_tag,
+        'extra_tags': {'leg': 'CE'},
+        'instrument_id': 'NIFTY24JAN21500CE',
+        'symbol': 'NIFTY',
+        'product_type': 'ProductType.MIS',
+        'side': 'PositionType.Sell',
+        'quantity': 50,
+        'lot_size': 50,
+        'order_info': {'order_type': 'OrderType.Limit', 'price': 101.5},
+        'broker_id': '65b0f3b2e4b0a1c2d3e4f5a6',
+        'user_id': '65b0f3b2e4b0a1c2d3e4f5a7',
+        'broker_order_id': '240125000012345',
+        'status': 'Open',
+        'rejection_code': '',
+        'rejection_reason': '',
+        'trade_time': '',
+        'filled_quantity': 0,
+        'average_price': 0.0,
+    })
+
+
+random.seed(0)
+frames = [order_update(random.choice(TAGS)) for _ in range(FRAMES)]
+
+
+# what the websocket thread does before the update callback drops the frames of other tags
+def decode_all(frame: str):
+    payload = json.loads(frame)
+    if payload.get('user_tag') != USER_TAG:
+        return None
+    return payload
+
+
+frame_filter = FramePreFilter(user_tag=USER_TAG)
+
+
+def prefilter_then_decode(frame: str):
+    if not frame_filter(frame):
+        return None
+    return decode_all(frame)
+
+
+def frames_per_second(process) -> float:
+    rates = []
+    for _ in range(ROUNDS):
+        started_at = time.perf_counter()
+        for frame in frames:
+            process(frame)
+        rates.append(len(frames) / (time.perf_counter() - started_at))
+    return statistics.median(rates)
+
+
+decode_rate = frames_per_second(decode_all)
+filter_rate = frames_per_second(prefilter_then_decode)
+
+logger.info(f"{FRAMES} frames, {len(TAGS)} tags, median of {ROUNDS} rounds")
+logger.info(f"Decode every frame:       {decode_rate:,.0f} frames/s")
+logger.info(f"Pre-filter, then decode:  {filter_rate:,.0f} frames/s ({filter_rate / decode_rate:.1f}x)")
+logger.info(f"Pre-filter counters: {frame_filter.stats}")
@@ -0,0 +1,65 @@
+import sys
+import json
+import time
+import logging
+import statistics
+
+from openbroker.entity import Order
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROUNDS = 5
+
+# recorded order updates, one websocket payload per line, i.e. saved from an order_update_callback:
+#   python benchmark_order_decode.py recorded_updates.jsonl
+# a sample payload is used if no file is provided
+SAMPLE_PAYLOAD = json.dumps({
+    'order_id': '6d1b8a64-4c8b-4a4e-9a55-0e6b1f3f6a10',
+    'created_at': '2024-01-25T09:15:00.123456+05:30',
+    'updated_at': '2024-01-25T09:15:00.456789+05:30',
+    'user_tag': 'straddle',
+    'extra_tags': {'leg': 'CE'},
+    'instrument_id': 'NIFTY24JAN21500CE',
+    'symbol': 'NIFTY',
+    'product_type': 'ProductType.MIS',
+    'side': 'PositionType.Sell',
+    'quantity': 50,
+    'lot_size': 50,
+    'order_info': {'order_type': 'OrderType.Limit', 'price': 101.5},
+    'broker_id': '65b0f3b2e4b0a1c2d3e4f5a6',
+    'user_id': '65b0f3b2e4b0a1c2d3e4f5a7',
+    'broker_order_id': '240125000012345',
+    'status': 'Open',
+    'rejection_code': '',
+    'rejection_reason': '',
+    'trade_time': '',
+    'filled_quantity': 0,
+    'average_price': 0.0,
+})
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        payloads = [line for line in f if line.strip()]
+else:
+    payloads = [SAMPLE_PAYLOAD] * 100_000
+
+
+def updates_per_second(decode) -> float:
+    rates = []
+    for _ in range(ROUNDS):
+        started_at = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        rates.append(len(payloads) / (time.perf_counter() - started_at))
+    return statistics.median(rates)
+
+
+json_rate = updates_per_second(json.loads)
+order_rate = updates_per_second(lambda payload: Order.load(json.loads(payload)))
+
+logger.info(f"{len(payloads)} payloads, median of {ROUNDS} rounds")
+logger.info(f"json.loads only:         {json_rate:,.0f} updates/s")
+logger.info(f"json.loads + Order.load: {order_rate:,.0f} updates/s "
+            f"({1e6 / order_rate - 1e6 / json_rate:.2f}us per update in Order.load)")
@@ -0,0 +1,48 @@
+import time
+import logging
+import statistics
+import configparser
+
+from openbroker.api import OrdersAPI
+from openbroker.session import generate_session
+from openbroker.transport import TransportConfig
+
+
+# read credentials from credentials.ini file
+config = configparser.ConfigParser()
+config.read('credentials.ini')
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROUNDS = 10
+
+user_session = generate_session(
+    config.get("user", "PHONE_NUMBER"),
+    config.get("user", "PASSWORD"),
+    transport=TransportConfig(pool_maxsize=4)
+)
+orders_api = OrdersAPI(user_session=user_session)
+
+
+# the first request to the orders host measures the latency of the first order of the day:
+# a read-only endpoint on the same host is used to avoid placing real orders
+def first_request_latency(warm: bool) -> float:
+    # drop every pooled connection, as after a long idle period
+    user_session.request_session.close()
+
+    if warm:
+        user_session.warm_up()
+
+    started_at = time.perf_counter()
+    orders_api.get_todays_orders()
+    return time.perf_counter() - started_at
+
+
+cold_latencies = [first_request_latency(warm=False) for _ in range(ROUNDS)]
+warm_latencies = [first_request_latency(warm=True) for _ in range(ROUNDS)]
+
+logger.info(f"Cold pool: median {statistics.median(cold_latencies) * 1000:.1f}ms, "
+            f"max {max(cold_latencies) * 1000:.1f}ms")
+logger.info(f"Warm pool: median {statistics.median(warm_latencies) * 1000:.1f}ms, "
+            f"max {max(warm_latencies) * 1000:.1f}ms")
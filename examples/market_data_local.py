@@ -0,0 +1,45 @@
+import time
+import random
+import logging
+
+from openbroker import MarketDataClient
+from openbroker.feed_server import LocalFeedServer
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# runs entirely locally: the prices feed is replaced by a stand-in server publishing random walks
+TOKENS = [f'NIFTY24JAN{strike}CE' for strike in range(21000, 22000, 100)]
+TICKS = 10_000
+READS = 1_000_000
+
+random.seed(0)
+
+with LocalFeedServer() as feed_server:
+    market_data = MarketDataClient(feed_server.url, buffer_size=256)
+    # tokens are usually resolved with ob.instruments.find_instrument(...).token
+    market_data.subscribe(TOKENS)
+    market_data.connect()
+    while len(feed_server.subscriptions) < len(TOKENS):
+        time.sleep(0.01)
+
+    prices = {token: 100. for token in TOKENS}
+    for _ in range(TICKS // len(TOKENS)):
+        for token in TOKENS:
+            prices[token] = round(prices[token] + random.choice((-0.05, 0.05)), 2)
+        feed_server.publish_ticks([{'token': token, 'ltp': price, 'timestamp': time.time()} for token, price in prices.items()])
+
+    token = TOKENS[0]
+    while market_data.buffer(token).count < TICKS // len(TOKENS):
+        time.sleep(0.01)
+
+    started_at = time.perf_counter()
+    for _ in range(READS):
+        market_data.last_price(token)
+    elapsed = time.perf_counter() - started_at
+
+    logger.info(f"{token}: last price {market_data.last_price(token)}, last 5 prices {market_data.buffer(token).prices(5)}")
+    logger.info(f"last_price: {elapsed / READS * 1e9:.0f} ns per read")
+    logger.info(f"Feed health: {market_data.health}")
+    market_data.close()
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import subprocess
+
+from openbroker.relay import OrderUpdateRelay, RelaySubscriber
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# runs entirely locally: the upstream websocket is replaced by frames published on the relay
+FRAMES = 100_000
+TAGS = [f'strategy_{i}' for i in range(4)]
+RELAY_PATH = os.path.join(tempfile.gettempdir(), 'openbroker_relay_example.sock')
+
+
+def order_update(i: int) -> str:
+    return json.dumps({
+        'order_id': f'6d1b8a64-4c8b-4a4e-9a55-{i:012d}',
+        'updated_at': '2024-01-25T09:15:00.456789+05:30',
+        'user_tag': TAGS[i % len(TAGS)],
+        'instrument_id': 'NIFTY24JAN21500CE',
+        'status': 'Open',
+        'filled_quantity': 0,
+        'average_price': 0.0,
+    })
+
+
+def run_subscriber(user_tag: str):
+    # a strategy process: receives only the decoded updates of its tag, without opening a websocket
+    expected = FRAMES // len(TAGS)
+    received = []
+    subscriber = RelaySubscriber(RELAY_PATH, received.append, user_tag=user_tag)
+    subscriber.start()
+    subscriber.wait_connected(5)
+
+    # a subscriber lagging behind is disconnected and misses frames: do not wait for them forever
+    deadline = time.monotonic() + 30
+    while len(received) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    subscriber.stop()
+
+    other_tags = {update['user_tag'] for update in received} - {user_tag}
+    logger.info(f"{user_tag}: received {len(received)}/{expected} updates, other tags: {other_tags or 'none'}")
+
+
+def run_relay():
+    relay = OrderUpdateRelay(RELAY_PATH)
+    relay.start()
+
+    subscribers = [subprocess.Popen([sys.executable, __file__, user_tag]) for user_tag in TAGS]
+    while relay.subscribers < len(TAGS):
+        time.sleep(0.01)
+
+    frames = [order_update(i) for i in range(FRAMES)]
+    started_at = time.perf_counter()
+    for frame in frames:
+        relay.publish(frame)
+    for subscriber in subscribers:
+        subscriber.wait()
+    elapsed = time.perf_counter() - started_at
+
+    relay.stop()
+    logger.info(f"Relayed {FRAMES} frames to {len(TAGS)} processes in {elapsed:.3f}s ({FRAMES / elapsed:,.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_subscriber(sys.argv[1])
+    else:
+        run_relay()
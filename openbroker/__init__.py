@@ -5,3 +5,5 @@ from .instrument import InstrumentsClient
 from .broker import BrokersClient
 
 from .order import OrdersClient
+
+from .feed import MarketDataClient
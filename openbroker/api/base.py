@@ -1,37 +1,194 @@
-from typing import Union, Dict
+from typing import Union, Dict, Iterable, Callable, Tuple
+from urllib.parse import urlsplit
+from dataclasses import replace
+import threading
+import logging
+import time
 import requests
 
-from ..session import UserSession
+from ..session import UserSession, get_public_session
 from ..exceptions import InvalidDataException, RequestFailedException
+from ..ratelimit import RequestScheduler, Priority
+from ..retry import RetryPolicy, RequestStats, NO_RETRY
+
+logger = logging.getLogger(__name__)
 
 
 class BaseAPI:
     def __init__(self, user_session: UserSession = None):
-        # if no user session is provided, create a new unauthenticated session
-        self._session = user_session or UserSession('', '', requests.Session(), {})
-
-    def _request(self, 
-            method: str, 
-            url: str, 
-            data: Union[Dict, None] = None, 
-            params: Union[Dict, None] = None
+        # if no user session is provided, use the shared unauthenticated session
+        self._session = user_session or get_public_session()
+
+        # optional client-side rate limiter, requests are sent right away if not set
+        self.scheduler: Union[RequestScheduler, None] = None
+        # retry policy of each endpoint, failed requests are not retried if the endpoint is not listed
+        self.retry_policies: Dict[str, RetryPolicy] = {}
+
+        self.__stats_lock = threading.Lock()
+        self.__request_stats: Dict[str, RequestStats] = {}
+
+    @property
+    def request_stats(self) -> Dict[str, RequestStats]:
+        """ A snapshot of the request counters (attempts, failures, latency) for each endpoint """
+        with self.__stats_lock:
+            return {endpoint: replace(stats) for endpoint, stats in self.__request_stats.items()}
+
+    def _request(self,
+            method: str,
+            url: str,
+            data: Union[Dict, None] = None,
+            params: Union[Dict, None] = None,
+            endpoint: Union[str, None] = None,
+            broker_ids: Iterable[str] = (),
+            priority: Priority = Priority.Normal
         ) -> Dict:
-        
+
         method = method.upper()
+        endpoint = endpoint or f'{method} {urlsplit(url).path}'
+
+        cache = self._session.response_cache
+        if method == 'GET' and cache is not None and cache.is_cached(endpoint):
+            key = (url, tuple(sorted(params.items())) if params else None)
+            return cache.get(
+                endpoint,
+                key,
+                lambda validators: self.__request_with_retries(
+                    method, url, data, params, endpoint, broker_ids, priority, validators
+                )
+            )
+
+        _, response, _ = self.__request_with_retries(method, url, data, params, endpoint, broker_ids, priority)
+        return response
+
+    def _invalidate_cache(self, endpoint: str, match: Union[Callable[[Tuple], bool], None] = None):
+        """ Drop the cached responses of an endpoint, after a request changing its data """
+        cache = self._session.response_cache
+        if cache is not None:
+            cache.invalidate(endpoint, match)
+
+    def __request_with_retries(
+            self, method, url, data, params, endpoint, broker_ids, priority, validators: Union[Dict, None] = None
+    ) -> Tuple[bool, Dict, Dict]:
+        """ Send the request, retrying according to the endpoint policy. Returns (not modified, response, validators) """
+        policy = self.retry_policies.get(endpoint, NO_RETRY)
+
+        started_at = time.perf_counter()
+        attempt = 0
+        reauthenticated = False
+        while True:
+            attempt += 1
+            auth_token = self._session.auth_token
+            try:
+                response = self.__send(method, url, data, params, endpoint, broker_ids, priority, validators)
+                self.__record(endpoint, attempt, started_at, failed=False)
+                if attempt > 1:
+                    logger.info(f'Request to {endpoint} succeeded after {attempt} attempts '
+                                f'in {time.perf_counter() - started_at:.3f}s')
+                return response
+
+            except RequestFailedException as exc:
+                # the session expired: login again once and resend the request
+                if exc.status_code == 401 and not reauthenticated and self._session.relogin(auth_token):
+                    reauthenticated = True
+                    continue
+
+                # ambiguous failures of non-idempotent endpoints are left to the caller, i.e. the idempotency
+                # key lookup of OrdersClient, even if their status is listed in the policy
+                retry = attempt < policy.max_attempts and (
+                    (exc.status_code in policy.retry_on_status and (policy.idempotent or not exc.ambiguous))
+                    or (policy.idempotent and exc.ambiguous)
+                    or (exc.status_code is None and not exc.ambiguous)
+                )
+                if not retry:
+                    self.__record(endpoint, attempt, started_at, failed=True)
+                    raise
+
+                delay = policy.delay(attempt)
+                logger.warning(f'Request to {endpoint} failed (attempt {attempt}/{policy.max_attempts}), '
+                               f'retrying in {delay:.3f}s: {exc}')
+                time.sleep(delay)
 
-        r = self._session.request_session.request(
-            method=method,
-            url=url,
-            json=data,
-            params=params,
-            timeout=(self._session.connect_timeout, self._session.read_timeout),
-            headers=self._session.request_headers
-        )
+            except Exception:
+                self.__record(endpoint, attempt, started_at, failed=True)
+                raise
+
+    def __send(self, method, url, data, params, endpoint, broker_ids, priority, validators) -> Tuple[bool, Dict, Dict]:
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.acquire(endpoint, broker_ids=broker_ids, priority=priority)
+
+        headers = self._session.request_headers
+        if validators:
+            headers = {**headers, **validators}
+
+        metrics = self._session.metrics
+        sent_at = time.perf_counter() if metrics.enabled else 0.
+
+        try:
+            r = self._session.request_session.request(
+                method=method,
+                url=url,
+                json=data,
+                params=params,
+                timeout=(self._session.connect_timeout, self._session.read_timeout),
+                headers=headers
+            )
+
+        except requests.exceptions.ConnectTimeout as exc:
+            if metrics.enabled:
+                metrics.on_request(endpoint, method, 0, time.perf_counter() - sent_at, 0, 0)
+            # the request never reached the server
+            raise RequestFailedException(f'Connection timed out: {exc}') from exc
+
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as exc:
+            if metrics.enabled:
+                metrics.on_request(endpoint, method, 0, time.perf_counter() - sent_at, 0, 0)
+            # the request may have been processed by the server before the failure
+            raise RequestFailedException(f'Request failed without a response: {exc}', ambiguous=True) from exc
+
+        if metrics.enabled:
+            metrics.on_request(
+                endpoint, method, r.status_code, time.perf_counter() - sent_at, _request_size(r), len(r.content)
+            )
+
+        if r.status_code == 304 and validators:
+            return True, {}, _response_validators(r)
 
         if r.status_code == 200:
             try:
-                return r.json()
+                return False, r.json(), _response_validators(r)
             except ValueError:
                 raise InvalidDataException(str(r.content))
         else:
-            raise RequestFailedException(str(r.content))
+            raise RequestFailedException(str(r.content), status_code=r.status_code, ambiguous=r.status_code >= 500)
+
+    def __record(self, endpoint: str, attempts: int, started_at: float, failed: bool):
+        latency = time.perf_counter() - started_at
+
+        with self.__stats_lock:
+            stats = self.__request_stats.get(endpoint)
+            if stats is None:
+                stats = self.__request_stats[endpoint] = RequestStats()
+
+            stats.requests += 1
+            stats.attempts += attempts
+            stats.failures += failed
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+
+
+def _response_validators(response) -> Dict[str, str]:
+    """ Headers to revalidate a cached response with a conditional request """
+    validators = {}
+    if response.headers.get('ETag'):
+        validators['If-None-Match'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators['If-Modified-Since'] = response.headers['Last-Modified']
+    return validators
+
+
+def _request_size(response) -> int:
+    # requests exposes the sent body as `body`, httpx as `content`
+    request = getattr(response, 'request', None)
+    body = getattr(request, 'body', None) or getattr(request, 'content', None)
+    return len(body) if body else 0
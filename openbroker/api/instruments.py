@@ -12,5 +12,6 @@ class InstrumentsAPI(BaseAPI):
     def get_instruments(self):
         return self._request(
             "GET",
-            f"{Config.feed_base_url}/contracts"
+            f"{Config.feed_base_url}/contracts",
+            endpoint='contracts'
         )
@@ -1,54 +1,107 @@
 
-from typing import List, Set
+from typing import Iterable, List, Set
 import uuid
 
 from .base import BaseAPI
 from ..config import Config
 from ..datatype.order import PlaceOrderRequestParams, ModifyOrderRequestParams
+from ..ratelimit import Priority
 
 
 class OrdersAPI(BaseAPI):
     
-    def place_orders(self, broker_id: str, order_list: List[PlaceOrderRequestParams]):
-        return self._request(
-            "POST",
-            f"{Config.order_base_url}/place",
-            data={
-                'broker_id': broker_id,
-                'orders': [order.dump() for order in order_list]
-            }
-        )
+    def __invalidate_orders(self, order_ids: Iterable = ()):
+        # the order lists change on every mutation, single orders only when targeted
+        self._invalidate_cache('today-orders')
+        self._invalidate_cache('orders-by-user-tag')
+
+        order_ids = {str(order_id) for order_id in order_ids}
+        if order_ids:
+            self._invalidate_cache('order', lambda key: key[0].rsplit('=', 1)[-1] in order_ids)
+
+    def place_orders(
+            self,
+            broker_id: str,
+            order_list: List[PlaceOrderRequestParams],
+            priority: Priority = Priority.Normal
+    ):
+        try:
+            return self._request(
+                "POST",
+                f"{Config.order_base_url}/place",
+                data={
+                    'broker_id': broker_id,
+                    'orders': [order.dump() for order in order_list]
+                },
+                endpoint='place',
+                broker_ids=(broker_id,),
+                priority=priority
+            )
+        finally:
+            self.__invalidate_orders()
     
-    def modify_orders(self, order_list: List[ModifyOrderRequestParams]):
-        return self._request(
-            "PUT",
-            f"{Config.order_base_url}/modify",
-            data={
-                'orders': [order.dump() for order in order_list]
-            }
-        )
+    def modify_orders(
+            self,
+            order_list: List[ModifyOrderRequestParams],
+            broker_ids: Iterable[str] = (),
+            priority: Priority = Priority.Normal
+    ):
+        try:
+            return self._request(
+                "PUT",
+                f"{Config.order_base_url}/modify",
+                data={
+                    'orders': [order.dump() for order in order_list]
+                },
+                endpoint='modify',
+                broker_ids=broker_ids,
+                priority=priority
+            )
+        finally:
+            self.__invalidate_orders(order.order_id for order in order_list)
     
-    def cancel_orders(self, order_ids: Set[uuid.UUID]):
-        return self._request(
-            "POST",
-            f"{Config.order_base_url}/cancel",
-            data=list(order_ids)
-        )
+    def cancel_orders(
+            self,
+            order_ids: Set[uuid.UUID],
+            broker_ids: Iterable[str] = (),
+            priority: Priority = Priority.High
+    ):
+        try:
+            return self._request(
+                "POST",
+                f"{Config.order_base_url}/cancel",
+                data=list(order_ids),
+                endpoint='cancel',
+                broker_ids=broker_ids,
+                priority=priority
+            )
+        finally:
+            self.__invalidate_orders(order_ids)
     
-    def get_todays_orders(self):
+    def get_todays_orders(self, priority: Priority = Priority.Low, fresh: bool = False):
+        if fresh:
+            self._invalidate_cache('today-orders')
         return self._request(
             "GET",
-            f"{Config.order_base_url}/today-orders"
+            f"{Config.order_base_url}/today-orders",
+            endpoint='today-orders',
+            priority=priority
         )
     
     def get_order(self, order_id: uuid.UUID):
         return self._request(
             "GET",
-            f"{Config.order_base_url}/order?order_id={order_id}"
+            f"{Config.order_base_url}/order?order_id={order_id}",
+            endpoint='order',
+            priority=Priority.Low
         )
     
-    def get_order_by_user_tag(self, user_tag: str):
+    def get_order_by_user_tag(self, user_tag: str, priority: Priority = Priority.Low, fresh: bool = False):
+        if fresh:
+            self._invalidate_cache('orders-by-user-tag')
         return self._request(
             "GET",
-            f"{Config.order_base_url}/orders-by-user-tag?user_tag={user_tag}"
+            f"{Config.order_base_url}/orders-by-user-tag?user_tag={user_tag}",
+            endpoint='orders-by-user-tag',
+            priority=priority
         )
@@ -9,7 +9,8 @@ class UsersAPI(BaseAPI):
 
         return self._request(
             "GET",
-            f"{Config.base_url}/brokers"
+            f"{Config.base_url}/brokers",
+            endpoint='brokers'
         )
     
     def get_broker(self, broker_id: str):
@@ -17,5 +18,6 @@ class UsersAPI(BaseAPI):
 
         return self._request(
             "GET",
-            f"{Config.base_url}/broker/{broker_id}"
+            f"{Config.base_url}/broker/{broker_id}",
+            endpoint='broker'
         )
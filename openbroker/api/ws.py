@@ -1,7 +1,9 @@
-from typing import Callable, Union
+from typing import Any, Callable, Optional, Union
+from dataclasses import dataclass
 
 import threading
 import websocket
+from websocket import ABNF
 import logging
 import ssl
 import time
@@ -9,30 +11,159 @@ import time
 import json
 
 from ..session import UserSession
+from ..utils import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# weight of the last sample in the moving averages of RTT and lag
+_EWMA_WEIGHT = 0.1
+
+
+@dataclass
+class WsHealth:
+    """
+    Dataclass representing the liveness of a websocket connection.
+
+    Attributes:
+        connected (bool): The socket is connected.
+        healthy (bool): The socket is connected and a frame or a pong was received within the stall timeout.
+        silence (float): Time (seconds) since the last frame or pong, None if nothing was received.
+        rtt (float): Moving average of the ping round trip time (seconds), None if not measured.
+        last_rtt (float): Last ping round trip time (seconds), None if not measured.
+        lag (float): Moving average of the time (seconds) between the update on the server (`updated_at`)\
+        and its receipt, clock offset included. None if not measured.
+        reconnects (int): Number of connections after the first one.
+        stalls (int): Number of connections dropped by the stall detector.
+    """
+    connected: bool
+    healthy: bool
+    silence: Optional[float]
+    rtt: Optional[float]
+    last_rtt: Optional[float]
+    lag: Optional[float]
+    reconnects: int
+    stalls: int
+
 
 class WebsocketConnection:
 
-    def __init__(self, user_session: UserSession, ws_url: str, callback_func: Callable):
+    def __init__(
+            self,
+            user_session: UserSession,
+            ws_url: str,
+            callback_func: Callable,
+            frame_filter: Optional[Callable[[Union[str, bytes]], bool]] = None,
+            ping_interval: Optional[float] = 10.,
+            stall_timeout: Optional[float] = 30.,
+            connect_callback: Optional[Callable[[], None]] = None,
+            frame_hook: Optional[Callable[[Union[str, bytes]], None]] = None,
+            decode_func: Callable[[Union[str, bytes]], Any] = json.loads
+    ):
+        """
+        Websocket connection listening for updates in a background thread, reconnecting when dropped.
+
+        A ping is sent every `ping_interval` seconds to measure the round trip time. If no frame nor pong is received
+        for `stall_timeout` seconds, the connection is considered half-open and is dropped and opened again.
+
+        :param user_session: the user session
+        :param ws_url: url of the websocket
+        :param callback_func: function called with every decoded update
+        :param frame_filter: [Optional] function called with each raw frame before decoding it,\
+        frames for which it returns False are dropped
+        :param ping_interval: [Optional] interval (seconds) between pings, None to disable the pings
+        :param stall_timeout: [Optional] max time (seconds) without frames before reconnecting, None to disable
+        :param connect_callback: [Optional] function called after each connection, i.e. to fetch the missed updates
+        :param frame_hook: [Optional] function called with each raw frame before the filter, i.e. to relay it
+        :param decode_func: function decoding each raw frame into the update passed to `callback_func`, JSON by default
+        """
         self._session = user_session
         self._url = ws_url
         self._callback = callback_func
-        
+        self._decode = decode_func
+        # called with each raw frame before decoding it, frames for which it returns False are dropped
+        self.frame_filter = frame_filter
+        # called with each raw frame before the filter, i.e. to relay it to other processes
+        self.frame_hook = frame_hook
+        self.ping_interval = ping_interval
+        self.stall_timeout = stall_timeout
+        self._connect_callback = connect_callback
+
         self.__websocket: Union[None, websocket.WebSocket] = None
         self.__ws_ssl = {"cert_reqs": ssl.CERT_NONE}
 
         self.__ws_thread = None
         self.__stop_event = threading.Event()
+        self.__connected_event = threading.Event()
+
+        # liveness state, written by the ws thread only
+        self.__connections = 0
+        self.__stalls = 0
+        self.__last_frame_at: Optional[float] = None
+        self.__ping_payload = b''
+        self.__ping_sent_at: Optional[float] = None
+        self.__ping_count = 0
+        self.__rtt: Optional[float] = None
+        self.__last_rtt: Optional[float] = None
+        self.__lag: Optional[float] = None
 
     @property
     def is_connected(self) -> bool:
         return self.__websocket is not None and self.__websocket.connected
 
+    @property
+    def is_healthy(self) -> bool:
+        """ Connected, and a frame or a pong was received within the stall timeout """
+        if not self.is_connected:
+            return False
+        if self.stall_timeout is None:
+            return True
+        last_frame_at = self.__last_frame_at
+        return last_frame_at is not None and time.perf_counter() - last_frame_at <= self.stall_timeout
+
+    @property
+    def health(self) -> WsHealth:
+        last_frame_at = self.__last_frame_at
+        return WsHealth(
+            connected=self.is_connected,
+            healthy=self.is_healthy,
+            silence=time.perf_counter() - last_frame_at if last_frame_at is not None else None,
+            rtt=self.__rtt,
+            last_rtt=self.__last_rtt,
+            lag=self.__lag,
+            reconnects=max(self.__connections - 1, 0),
+            stalls=self.__stalls
+        )
+
+    def wait_connected(self, timeout: Union[float, None] = None) -> bool:
+        """
+        Block until the websocket handshake is completed.
+
+        :param timeout: max time (seconds) to wait, None to wait indefinitely
+        :return: True if connected, False if the timeout expired
+        """
+        return self.__connected_event.wait(timeout)
+
+    def send(self, message: Union[str, bytes]) -> bool:
+        """
+        Send a frame, i.e. a subscription. Safe to call from any thread.
+
+        :param message: the message to send, sent as a binary frame if bytes
+        :return: True if sent, False if not connected
+        """
+        ws_connection = self.__websocket
+        if ws_connection is None or not ws_connection.connected:
+            return False
+        # noinspection PyBroadException
+        try:
+            ws_connection.send(message, opcode=ABNF.OPCODE_BINARY if isinstance(message, bytes) else ABNF.OPCODE_TEXT)
+        except Exception:
+            logger.warning(f'Failed to send a frame on {self._url}')
+            return False
+        return True
+
     def start(self):
         """ Start the ws thread """
-        
+
         self.__stop_event.clear()
         self.__ws_thread = threading.Thread(target=self.__run_ws, daemon=True)
 
@@ -43,14 +174,15 @@ class WebsocketConnection:
         """ Stop the ws thread """
 
         self.__stop_event.set()
+        self.__connected_event.clear()
 
         if self.is_connected:
             self.__websocket.close()
-        
+
         if self.__ws_thread is not None:
             # wait for the thread to finish
             self.__ws_thread.join()
-        
+
         logger.info(f'Stopped listening for ws updates from {self._url}')
 
     def __run_ws(self):
@@ -58,25 +190,159 @@ class WebsocketConnection:
 
         while not self.__stop_event.is_set():
             message = None
+            auth_token = self._session.auth_token
 
             try:
                 if self.__websocket is None:
-                    self.__websocket: websocket.WebSocket = websocket.create_connection(
-                        self._url,
-                        sslopt=self.__ws_ssl,
-                        cookie=f"access_token_cookie={self._session.auth_token}"
-                    )
+                    self.__connect(auth_token)
+
+                try:
+                    opcode, data = self.__websocket.recv_data(control_frame=True)
+                except websocket.WebSocketTimeoutException:
+                    # nothing received within the ping interval
+                    self.__check_liveness(time.perf_counter())
+                    continue
+
+                now = time.perf_counter()
+                received_at = time.time()
+                self.__last_frame_at = now
+
+                if opcode == ABNF.OPCODE_PONG:
+                    self.__on_pong(data, now)
+                    continue
+                if opcode == ABNF.OPCODE_CLOSE:
+                    raise websocket.WebSocketConnectionClosedException('Connection closed by the server')
+
+                self.__ping_if_due(now)
+                if opcode == ABNF.OPCODE_PING:
+                    continue
 
-                message = self.__websocket.recv()
+                message = data.decode('utf-8') if opcode == ABNF.OPCODE_TEXT else data
                 if not message:
                     continue
-                
-                self._callback(json.loads(message))
+
+                frame_hook = self.frame_hook
+                if frame_hook is not None:
+                    frame_hook(message)
+
+                frame_filter = self.frame_filter
+                if frame_filter is not None and not frame_filter(message):
+                    continue
+
+                metrics = self._session.metrics
+                if not metrics.enabled:
+                    payload = self._decode(message)
+                    self._callback(payload)
+                    self.__update_lag(_update_lag(payload, received_at))
+                    continue
+
+                decode_started_at = time.perf_counter()
+                payload = self._decode(message)
+                callback_started_at = time.perf_counter()
+                self._callback(payload)
+                callback_ended_at = time.perf_counter()
+
+                lag = _update_lag(payload, received_at)
+                self.__update_lag(lag)
+                metrics.on_ws_frame(
+                    self._url,
+                    len(message),
+                    callback_started_at - decode_started_at,
+                    callback_ended_at - callback_started_at,
+                    lag
+                )
+
+            except websocket.WebSocketBadStatusException as exc:
+                logger.warning(f'Websocket handshake rejected for {self._url}: {exc}')
+                if exc.status_code == 401 and self.__relogin(auth_token):
+                    continue
+                time.sleep(1)
 
             except (websocket.WebSocketConnectionClosedException, ssl.SSLZeroReturnError):
                 logger.warning(f'Websocket connection closed for {self._url}')
+                self.__connected_event.clear()
                 self.__websocket = None
 
             except Exception:
                 logger.exception(f"Error in ws listen thread for {self._url}. msg={message}")
                 time.sleep(1)
+
+    def __connect(self, auth_token: str):
+        # wake up from recv periodically to send the pings and detect the stalls
+        intervals = [interval for interval in (self.ping_interval, self.stall_timeout) if interval]
+        self.__websocket: websocket.WebSocket = websocket.create_connection(
+            self._url,
+            timeout=min(intervals) if intervals else None,
+            sslopt=self.__ws_ssl,
+            cookie=f"access_token_cookie={auth_token}"
+        )
+        self.__connections += 1
+        self.__last_frame_at = time.perf_counter()
+        self.__ping_sent_at = None
+        self.__connected_event.set()
+
+        if self._connect_callback is not None:
+            # noinspection PyBroadException
+            try:
+                self._connect_callback()
+            except Exception:
+                logger.exception(f'Error in connect callback for {self._url}')
+
+    def __check_liveness(self, now: float):
+        silence = now - self.__last_frame_at
+        if self.stall_timeout is not None and silence > self.stall_timeout:
+            logger.warning(f'No frames received from {self._url} for {silence:.1f}s, reconnecting')
+            self.__stalls += 1
+            self.__connected_event.clear()
+            stalled_websocket, self.__websocket = self.__websocket, None
+            # noinspection PyBroadException
+            try:
+                stalled_websocket.close(timeout=1)
+            except Exception:
+                pass
+            return
+
+        self.__ping_if_due(now)
+
+    def __ping_if_due(self, now: float):
+        if self.ping_interval is None:
+            return
+        if self.__ping_sent_at is not None and now - self.__ping_sent_at < self.ping_interval:
+            return
+
+        self.__ping_count += 1
+        self.__ping_payload = str(self.__ping_count).encode()
+        self.__ping_sent_at = now
+        self.__websocket.ping(self.__ping_payload)
+
+    def __on_pong(self, payload: bytes, received_at: float):
+        if payload != self.__ping_payload or self.__ping_sent_at is None:
+            return
+
+        rtt = received_at - self.__ping_sent_at
+        self.__last_rtt = rtt
+        self.__rtt = rtt if self.__rtt is None else self.__rtt + _EWMA_WEIGHT * (rtt - self.__rtt)
+
+    def __update_lag(self, lag: Optional[float]):
+        if lag is not None:
+            self.__lag = lag if self.__lag is None else self.__lag + _EWMA_WEIGHT * (lag - self.__lag)
+
+    def __relogin(self, expired_token: str) -> bool:
+        # noinspection PyBroadException
+        try:
+            return self._session.relogin(expired_token)
+        except Exception:
+            logger.exception(f'Failed to login again for {self._url}')
+            return False
+
+
+def _update_lag(payload, received_at: float) -> Union[float, None]:
+    """ Time (seconds) between the update of the object on the server and the receipt of the frame """
+    # noinspection PyBroadException
+    try:
+        updated_at = parse_timestamp(payload.get('updated_at'))
+    except Exception:
+        return None
+    if updated_at is None:
+        return None
+    return received_at - updated_at.timestamp()
@@ -0,0 +1,357 @@
+from typing import Callable, Dict, List, Tuple, Set, Any
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import logging
+import time
+
+from .datatype.order import PlaceOrderRequestParams, ModifyOrderRequestParams
+from .exceptions import InvalidDataException
+
+logger = logging.getLogger(__name__)
+
+# max number of orders accepted by the Orders API in a single call
+MAX_ORDERS_PER_REQUEST = 10
+
+
+@dataclass
+class CoalescerStats:
+    """ Counters exposing the latency/throughput trade-off of the place orders coalescer """
+    calls: int = 0
+    orders: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    full_batches: int = 0
+    total_queue_time: float = 0.
+    max_queue_time: float = 0.
+    total_request_time: float = 0.
+
+    @property
+    def avg_batch_size(self) -> float:
+        """ Average number of orders sent per API call """
+        return self.orders / self.batches if self.batches else 0.
+
+    @property
+    def avg_queue_time(self) -> float:
+        """ Average time (seconds) a call waited for its batch to be sent """
+        return self.total_queue_time / self.calls if self.calls else 0.
+
+    @property
+    def avg_request_time(self) -> float:
+        """ Average duration (seconds) of a batched API call """
+        return self.total_request_time / self.batches if self.batches else 0.
+
+
+class _PendingBatch:
+
+    def __init__(self):
+        self.orders: List[PlaceOrderRequestParams] = []
+        # (offset, count, submit time, future) for every call merged in the batch
+        self.calls: List[Tuple[int, int, float, Future]] = []
+        self.ready = threading.Event()
+
+
+class PlaceOrderCoalescer:
+
+    def __init__(
+            self,
+            send_func: Callable[[str, List[PlaceOrderRequestParams]], List[Dict]],
+            window: float = 0.002,
+            max_batch_size: int = MAX_ORDERS_PER_REQUEST
+    ):
+        """
+        Merge concurrent place requests for the same broker into a single API call.
+
+        The first caller for a broker opens a batch and waits up to `window` seconds for other callers
+        to join it, then sends the whole batch. The batch is sent earlier as soon as it holds `max_batch_size` orders.
+        Every caller blocks until the batch is sent and receives the responses for its own orders only.
+        Requests of more than `max_batch_size` orders cannot be merged and are sent directly.
+
+        :param send_func: function sending a batch of orders for a broker id, returning the raw API response
+        :param window: max time (seconds) to wait for other requests before sending a batch
+        :param max_batch_size: max number of orders sent in a single call
+        """
+        if not 0 < max_batch_size <= MAX_ORDERS_PER_REQUEST:
+            raise ValueError(f'Batch size must be between 1 and {MAX_ORDERS_PER_REQUEST}')
+        if window < 0:
+            raise ValueError('Coalescing window cannot be negative')
+
+        self.__send_func = send_func
+        self.__window = window
+        self.__max_batch_size = max_batch_size
+
+        self.__lock = threading.Lock()
+        self.__pending: Dict[str, _PendingBatch] = {}
+        self.__stats = CoalescerStats()
+
+    @property
+    def stats(self) -> CoalescerStats:
+        """ A snapshot of the coalescer counters """
+        with self.__lock:
+            return replace(self.__stats)
+
+    def submit(self, broker_id: str, order_list: List[PlaceOrderRequestParams]) -> List[Dict]:
+        """
+        Queue the orders in the pending batch of the broker and wait for the batch to be sent.
+
+        :param broker_id: id of the broker the orders are to be placed with
+        :param order_list: list of place orders requests
+        :return: the raw API responses for the submitted orders (sorting is maintained)
+        """
+        assert 0 < len(order_list) <= MAX_ORDERS_PER_REQUEST
+
+        # a request larger than the batch size cannot be merged, it is sent on its own
+        if len(order_list) > self.__max_batch_size:
+            return self.__send_func(broker_id, order_list)
+
+        future = Future()
+        is_leader = False
+
+        with self.__lock:
+            batch = self.__pending.get(broker_id)
+
+            # the open batch cannot fit these orders: release it and start a new one
+            if batch is not None and len(batch.orders) + len(order_list) > self.__max_batch_size:
+                self.__close(broker_id, batch)
+                batch = None
+
+            if batch is None:
+                batch = _PendingBatch()
+                self.__pending[broker_id] = batch
+                is_leader = True
+
+            batch.calls.append((len(batch.orders), len(order_list), time.perf_counter(), future))
+            batch.orders.extend(order_list)
+
+            if len(batch.orders) >= self.__max_batch_size:
+                self.__stats.full_batches += 1
+                self.__close(broker_id, batch)
+
+        if is_leader:
+            batch.ready.wait(self.__window)
+            with self.__lock:
+                self.__close(broker_id, batch)
+            self.__send(broker_id, batch)
+
+        return future.result()
+
+    def __close(self, broker_id: str, batch: _PendingBatch):
+        # must be called with the lock held
+        if self.__pending.get(broker_id) is batch:
+            del self.__pending[broker_id]
+        batch.ready.set()
+
+    def __send(self, broker_id: str, batch: _PendingBatch):
+        sent_at = time.perf_counter()
+        try:
+            response = self.__send_func(broker_id, batch.orders)
+            if len(response) != len(batch.orders):
+                raise ValueError(f'Expected {len(batch.orders)} responses, received {len(response)}')
+
+        except Exception as exc:
+            logger.warning(f'Coalesced place request failed for broker {broker_id}: {exc}')
+            self.__record(batch, sent_at, failed=True)
+            for _, _, _, future in batch.calls:
+                future.set_exception(exc)
+            return
+
+        self.__record(batch, sent_at, failed=False)
+        for offset, count, _, future in batch.calls:
+            future.set_result(response[offset:offset + count])
+
+    def __record(self, batch: _PendingBatch, sent_at: float, failed: bool):
+        request_time = time.perf_counter() - sent_at
+
+        with self.__lock:
+            stats = self.__stats
+            stats.batches += 1
+            stats.calls += len(batch.calls)
+            stats.orders += len(batch.orders)
+            stats.total_request_time += request_time
+            if failed:
+                stats.failed_batches += 1
+
+            for _, _, submitted_at, _ in batch.calls:
+                queue_time = sent_at - submitted_at
+                stats.total_queue_time += queue_time
+                stats.max_queue_time = max(stats.max_queue_time, queue_time)
+
+
+@dataclass
+class ModifyPipelineStats:
+    """ Counters of the modify pipeline """
+    submitted: int = 0
+    coalesced: int = 0
+    sent: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    total_latency: float = 0.
+    max_latency: float = 0.
+
+    @property
+    def avg_batch_size(self) -> float:
+        """ Average number of modifies sent per API call """
+        return self.sent / self.batches if self.batches else 0.
+
+    @property
+    def avg_latency(self) -> float:
+        """ Average time (seconds) from the latest submit of a modify to its response """
+        return self.total_latency / self.sent if self.sent else 0.
+
+
+class _PendingModify:
+
+    def __init__(self, request: ModifyOrderRequestParams):
+        self.request = request
+        self.submitted_at = time.perf_counter()
+        self.future = Future()
+
+
+class ModifyPipeline:
+
+    def __init__(
+            self,
+            send_func: Callable[[List[ModifyOrderRequestParams]], Dict[str, Any]],
+            max_concurrent_batches: int = 2,
+            max_batch_size: int = MAX_ORDERS_PER_REQUEST
+    ):
+        """
+        Latest-wins pipeline for order modifications.
+
+        At most one modify per order is in flight at any time. A modify submitted for an order which already
+        has a pending (not yet sent) modify replaces it, so stale modifies never reach the API.
+        Pending modifies of different orders are sent together in batches of up to `max_batch_size` orders.
+
+        :param send_func: function sending a batch of modifies, returning the responses keyed by order id
+        :param max_concurrent_batches: max number of modify API calls in flight
+        :param max_batch_size: max number of modifies sent in a single call
+        """
+        if not 0 < max_batch_size <= MAX_ORDERS_PER_REQUEST:
+            raise ValueError(f'Batch size must be between 1 and {MAX_ORDERS_PER_REQUEST}')
+        if max_concurrent_batches < 1:
+            raise ValueError('At least one concurrent batch is required')
+
+        self.__send_func = send_func
+        self.__max_concurrent_batches = max_concurrent_batches
+        self.__max_batch_size = max_batch_size
+
+        self.__cond = threading.Condition()
+        self.__pending: "OrderedDict[str, _PendingModify]" = OrderedDict()
+        self.__in_flight: Set[str] = set()
+        self.__in_flight_batches = 0
+        self.__stats = ModifyPipelineStats()
+
+        self.__executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix='modify-pipeline')
+        self.__stop_event = threading.Event()
+        self.__dispatch_thread = threading.Thread(target=self.__dispatch, daemon=True)
+        self.__dispatch_thread.start()
+
+    @property
+    def stats(self) -> ModifyPipelineStats:
+        """ A snapshot of the pipeline counters """
+        with self.__cond:
+            return replace(self.__stats)
+
+    def submit(self, request: ModifyOrderRequestParams) -> Future:
+        """
+        Queue a modify request. If a modify for the same order is still pending, it is replaced by this one
+        and both callers receive the response of this request.
+
+        :param request: the modify request
+        :return: a future resolving to the API response of the modify
+        """
+        order_id = str(request.order_id)
+        with self.__cond:
+            # checked with the lock held: once stopped, the dispatcher may have exited and never send it
+            if self.__stop_event.is_set():
+                raise RuntimeError('Modify pipeline is stopped')
+            self.__stats.submitted += 1
+
+            pending = self.__pending.get(order_id)
+            if pending is not None:
+                # latest wins: keep the queue position, replace the request
+                pending.request = request
+                pending.submitted_at = time.perf_counter()
+                self.__stats.coalesced += 1
+                return pending.future
+
+            pending = _PendingModify(request)
+            self.__pending[order_id] = pending
+            self.__cond.notify_all()
+            return pending.future
+
+    def stop(self):
+        """ Stop dispatching modifies, after sending the ones already pending """
+        with self.__cond:
+            self.__stop_event.set()
+            self.__cond.notify_all()
+        self.__dispatch_thread.join()
+        self.__executor.shutdown(wait=True)
+
+    def __take_batch(self) -> Dict[str, _PendingModify]:
+        # must be called with the lock held
+        batch = {}
+        for order_id, pending in self.__pending.items():
+            if order_id in self.__in_flight:
+                continue
+            batch[order_id] = pending
+            if len(batch) == self.__max_batch_size:
+                break
+
+        for order_id in batch:
+            del self.__pending[order_id]
+            self.__in_flight.add(order_id)
+        return batch
+
+    def __dispatch(self):
+        """ Thread target function """
+
+        while True:
+            with self.__cond:
+                batch = {}
+                while True:
+                    if self.__in_flight_batches < self.__max_concurrent_batches:
+                        batch = self.__take_batch()
+                    if batch or (self.__stop_event.is_set() and not self.__pending):
+                        break
+                    self.__cond.wait()
+
+                if not batch:
+                    return
+                self.__in_flight_batches += 1
+
+            self.__executor.submit(self.__send, batch)
+
+    def __send(self, batch: Dict[str, _PendingModify]):
+        try:
+            response = self.__send_func([pending.request for pending in batch.values()])
+            response = {str(order_id): value for order_id, value in response.items()}
+            failed = False
+        except Exception as exc:
+            logger.warning(f'Modify request failed for orders {list(batch)}: {exc}')
+            response = exc
+            failed = True
+
+        received_at = time.perf_counter()
+        with self.__cond:
+            stats = self.__stats
+            stats.batches += 1
+            stats.sent += len(batch)
+            stats.failed_batches += failed
+            for pending in batch.values():
+                latency = received_at - pending.submitted_at
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+
+            self.__in_flight.difference_update(batch)
+            self.__in_flight_batches -= 1
+            self.__cond.notify_all()
+
+        for order_id, pending in batch.items():
+            if failed:
+                pending.future.set_exception(response)
+            elif order_id not in response:
+                pending.future.set_exception(InvalidDataException(f'Modify response not received for order {order_id}'))
+            else:
+                pending.future.set_result(response[order_id])
@@ -0,0 +1,509 @@
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+import threading
+import logging
+import heapq
+import enum
+import time
+
+from .constant.order import OrderStatus, PositionType, TERMINAL_ORDER_STATUSES
+from .datatype.order import PlaceOrderRequestParams, ModifyOrderRequestParams
+from .datatype.order import MarketOrderParams, LimitOrderParams, StopLossOrderParams
+from .entity.broker import BrokerConnection
+from .entity.order import Order, OrderChangeEvent
+from .order import OrdersClient
+from .ratelimit import Priority
+from .utils import is_older
+
+logger = logging.getLogger(__name__)
+
+_ENTRY = 'entry'
+_STOP_LOSS = 'stop_loss'
+_TARGET = 'target'
+
+
+class BracketStatus(str, enum.Enum):
+    """
+    Enum representing the state of a bracket: Pending (no exit leg placed yet), Active (exit legs placed),
+    Closed (position exited), Canceled (entry not filled) or Failed (exit legs not placed or rejected,
+    position not protected).
+    """
+    Pending = 'Pending'
+    Active = 'Active'
+    Closed = 'Closed'
+    Canceled = 'Canceled'
+    Failed = 'Failed'
+
+
+class BracketExit(str, enum.Enum):
+    """
+    Enum representing the leg that closed a bracket: StopLoss, Target or Time.
+    """
+    StopLoss = 'StopLoss'
+    Target = 'Target'
+    Time = 'Time'
+
+
+@dataclass
+class BracketLegs:
+    """
+    Dataclass representing the exit legs of a bracket, as distances from the entry fill price.
+
+    Attributes:
+        stop_loss (float): Distance of the stop loss trigger from the fill price, None for no stop loss.
+        target (float): Distance of the target limit price from the fill price, None for no target.
+        percent (bool): The distances are percentages of the fill price instead of price points.
+        stop_loss_slippage (float): Distance of the stop loss limit price beyond the trigger price.
+        tick_size (float): Tick size of the instrument, the prices are rounded to it.
+    """
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    percent: bool = False
+    stop_loss_slippage: float = 0.
+    tick_size: float = 0.05
+
+
+class Bracket:
+
+    def __init__(
+            self,
+            broker_connection: BrokerConnection,
+            request: PlaceOrderRequestParams,
+            legs: BracketLegs,
+            exit_at: Optional[float]
+    ):
+        """
+        An entry order with its attached stop loss and target legs, managed by a `BracketManager`.
+        Its state is updated from the websocket thread and can be read from any thread.
+        """
+        self.broker_connection = broker_connection
+        self.request = request
+        self.legs = legs
+        self.exit_at = exit_at
+
+        self.status = BracketStatus.Pending
+        self.exit_reason: Optional[BracketExit] = None
+        self.entry_order_id: Optional[Hashable] = None
+        self.stop_loss_order_id: Optional[Hashable] = None
+        self.target_order_id: Optional[Hashable] = None
+        self.entry_price: Optional[float] = None
+        self.exit_price: Optional[float] = None
+        self.quantity = 0
+        # perf_counter of the entry fill and of the response of the exit legs, to measure the reaction time
+        self.filled_at: Optional[float] = None
+        self.legs_placed_at: Optional[float] = None
+
+        self._lock = threading.RLock()
+        self._done_event = threading.Event()
+        # last update of the entry and of the exit legs, by order id
+        self._orders: Dict[Hashable, Order] = {}
+        # role and placed quantity of the exit legs, by order id
+        self._legs: Dict[Hashable, Tuple[str, int]] = {}
+        self._canceling: set = set()
+        # exit legs converted to market at the exit time
+        self._market: set = set()
+        # roles not placed again after a leg of theirs was rejected or canceled outside of the bracket
+        self._failed_roles: set = set()
+        self._exit_role: Optional[str] = None
+        # API calls of the bracket in flight, the next decision is taken once they are sent
+        self._busy = False
+        self._time_exit = False
+
+    @property
+    def is_done(self) -> bool:
+        return self._done_event.is_set()
+
+    @property
+    def reaction_time(self) -> Optional[float]:
+        """ Time (seconds) from the entry fill update to the response of the exit legs placement """
+        if self.filled_at is None or self.legs_placed_at is None:
+            return None
+        return self.legs_placed_at - self.filled_at
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the bracket is closed, canceled or failed
+
+        :param timeout: max time (seconds) to wait, None to wait indefinitely
+        :return: True if done, False if the timeout expired
+        """
+        return self._done_event.wait(timeout)
+
+    def order_id(self, role: str) -> Optional[Hashable]:
+        """ Order id of the entry, or of the last exit leg placed for the role """
+        return {
+            _ENTRY: self.entry_order_id,
+            _STOP_LOSS: self.stop_loss_order_id,
+            _TARGET: self.target_order_id,
+        }[role]
+
+    def __repr__(self):
+        return (
+            f'Bracket(symbol={self.request.symbol}, status={self.status.value}, entry_price={self.entry_price}, '
+            f'exit_price={self.exit_price}, exit_reason={self.exit_reason.value if self.exit_reason else None})'
+        )
+
+
+class _ExitTimer:
+    """ Single thread running the time exits at their deadline, from a heap of wall clock deadlines """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self.__count = 0
+        self.__stopped = False
+        self.__thread: Optional[threading.Thread] = None
+
+    def schedule(self, at: float, func: Callable[[], None]):
+        with self.__condition:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='openbroker-bracket-timer', daemon=True)
+                self.__thread.start()
+            self.__count += 1
+            heapq.heappush(self.__heap, (at, self.__count, func))
+            self.__condition.notify()
+
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__stopped:
+                    delay = self.__heap[0][0] - time.time() if self.__heap else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self.__condition.wait(delay)
+                if self.__stopped:
+                    return
+                _, _, func = heapq.heappop(self.__heap)
+
+            # noinspection PyBroadException
+            try:
+                func()
+            except Exception:
+                logger.exception('Error in bracket time exit')
+
+
+class BracketManager:
+
+    def __init__(self, orders_client: OrdersClient, max_workers: int = 4):
+        """
+        Client-side bracket orders: the stop loss and target legs are placed as soon as the fill of the entry
+        is received on the websocket, the other leg is canceled when one of them fills (OCO),
+        and the open legs are exited at market at the exit time of the bracket.
+
+        Decisions are taken in the websocket thread on each order update, the API calls are sent by a pool of
+        `max_workers` threads, so that the websocket thread is never blocked.
+        Each fill of the entry is protected as soon as it is received: legs are placed for the quantity filled
+        since the last ones. A fill of a leg reduces the open position, the legs of the other role are then
+        canceled and placed again for the position left, since the quantity of an order cannot be modified.
+
+        :param orders_client: the orders client, with the order updates websocket connected
+        :param max_workers: max number of API calls in flight
+        """
+        self.__orders = orders_client
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='openbroker-bracket')
+        self.__timer = _ExitTimer()
+
+        self.__lock = threading.Lock()
+        # bracket of each order, until the bracket is done
+        self.__orders_by_id: Dict[Hashable, Bracket] = {}
+        self.__subscription = orders_client.subscribe(self.__on_change)
+
+    @property
+    def brackets(self) -> List[Bracket]:
+        """ The brackets not done yet """
+        with self.__lock:
+            return list({id(bracket): bracket for bracket in self.__orders_by_id.values()}.values())
+
+    def close(self):
+        """ Stop managing the brackets, their open orders are left as they are """
+        self.__orders.unsubscribe(self.__subscription)
+        self.__timer.stop()
+        self.__executor.shutdown(wait=True)
+
+    def place(
+            self,
+            broker_connection: BrokerConnection,
+            request: PlaceOrderRequestParams,
+            legs: BracketLegs,
+            exit_at: Optional[float] = None,
+            priority: Priority = Priority.Normal
+    ) -> Bracket:
+        """
+        Place an entry order with attached exit legs
+
+        :param broker_connection: the broker the orders are to be placed with
+        :param request: the place request of the entry
+        :param legs: the stop loss and target of the exits
+        :param exit_at: [Optional] time (epoch seconds) at which the open legs are exited at market,\
+        or the entry is canceled if not filled yet
+        :param priority: priority of the entry request when rate limits are set. Exit legs are placed with high priority.
+        :return: the bracket, with status Failed if the entry was not placed
+        """
+        bracket = Bracket(broker_connection, request, legs, exit_at)
+
+        response, = self.__orders.place_orders(broker_connection, [request], priority)
+        if not response.success or not response.order_id:
+            logger.error(f'Bracket entry not placed for {request.symbol}')
+            self.__finish(bracket, BracketStatus.Failed)
+            return bracket
+
+        bracket.entry_order_id = response.order_id
+        self.__track(bracket, response.order_id)
+
+        if exit_at is not None:
+            self.__timer.schedule(exit_at, lambda: self.__executor.submit(self.__time_exit, bracket))
+        return bracket
+
+    def __track(self, bracket: Bracket, order_id: Hashable):
+        with self.__lock:
+            self.__orders_by_id[order_id] = bracket
+        # the first updates may have been applied before the place response
+        order = self.__orders.cached_order(order_id)
+        if order is not None:
+            self.__on_update(bracket, order)
+
+    def __on_change(self, event: OrderChangeEvent):
+        bracket = self.__orders_by_id.get(event.order_id)
+        if bracket is not None:
+            self.__on_update(bracket, event.order)
+
+    def __on_update(self, bracket: Bracket, order: Order):
+        with bracket._lock:
+            known = bracket._orders.get(order.order_id)
+            # an update with the same time as the known one is still applied if its content changed
+            if known is not None and (is_older(order.updated_at, known.updated_at) or order == known):
+                return
+            bracket._orders[order.order_id] = order
+
+            leg = bracket._legs.get(order.order_id)
+            if leg is not None:
+                role, _ = leg
+                if order.filled_quantity > (known.filled_quantity if known is not None else 0):
+                    bracket._exit_role = role
+                if (order.status in TERMINAL_ORDER_STATUSES and order.status != OrderStatus.Completed
+                        and order.order_id not in bracket._canceling):
+                    logger.error(f'Exit leg {role} of bracket {bracket.entry_order_id} {order.status.value}: '
+                                 f'{order.rejection_reason}')
+                    bracket._failed_roles.add(role)
+
+            self.__step(bracket)
+
+    def __step(self, bracket: Bracket):
+        """ Decide the next API calls of the bracket from the last updates of its orders, with its lock held """
+        if bracket.is_done or bracket._busy:
+            return
+
+        entry = bracket._orders.get(bracket.entry_order_id)
+        if entry is not None and entry.filled_quantity > bracket.quantity:
+            if bracket.filled_at is None:
+                bracket.filled_at = time.perf_counter()
+            bracket.entry_price = entry.average_price
+            bracket.quantity = entry.filled_quantity
+        entry_done = entry is not None and entry.status in TERMINAL_ORDER_STATUSES
+
+        if entry_done and not bracket.quantity:
+            logger.info(f'Bracket entry {entry.order_id} {entry.status.value} without fills')
+            self.__finish(bracket, BracketStatus.Canceled)
+            return
+
+        # quantity left to fill of the legs not terminal, by order id
+        working: Dict[Hashable, Tuple[str, int]] = {}
+        exited, exit_value = 0, 0.
+        for order_id, (role, quantity) in bracket._legs.items():
+            order = bracket._orders.get(order_id)
+            if order is None:
+                working[order_id] = (role, quantity)
+                continue
+            exited += order.filled_quantity
+            exit_value += order.filled_quantity * order.average_price
+            if order.status not in TERMINAL_ORDER_STATUSES:
+                working[order_id] = (role, quantity - order.filled_quantity)
+        if exited:
+            bracket.exit_price = exit_value / exited
+        open_quantity = bracket.quantity - exited
+
+        if entry_done and open_quantity <= 0:
+            if open_quantity < 0:
+                logger.error(f'Exit legs of bracket {bracket.entry_order_id} filled {-open_quantity} over the entry')
+            if bracket._time_exit:
+                bracket.exit_reason = BracketExit.Time
+            else:
+                bracket.exit_reason = BracketExit.StopLoss if bracket._exit_role == _STOP_LOSS else BracketExit.Target
+            cancel_ids = [order_id for order_id in working if order_id not in bracket._canceling]
+            self.__finish(bracket, BracketStatus.Closed)
+            if cancel_ids:
+                self.__executor.submit(self.__cancel, cancel_ids)
+            return
+
+        roles = [
+            role for role, distance in ((_STOP_LOSS, bracket.legs.stop_loss), (_TARGET, bracket.legs.target))
+            if distance is not None and role not in bracket._failed_roles
+        ]
+        if not roles and open_quantity > 0 and not bracket._time_exit:
+            logger.error(f'Position of bracket {bracket.entry_order_id} not protected')
+            self.__finish(bracket, BracketStatus.Failed)
+            return
+
+        # role, quantity and market flag of the legs to place
+        places: List[Tuple[str, int, bool]] = []
+        cancel_ids: List[Hashable] = []
+        modify_ids: List[Hashable] = []
+        if bracket._time_exit:
+            if not entry_done and bracket.entry_order_id not in bracket._canceling:
+                # a partial fill is exited at market once the entry is canceled
+                cancel_ids.append(bracket.entry_order_id)
+            exit_role = roles[0] if roles else _STOP_LOSS
+            exit_quantity = sum(quantity for role, quantity in working.values() if role == exit_role)
+            # the legs of the exit role are converted to market, the other ones are canceled
+            for order_id, (role, _) in working.items():
+                if role == exit_role and exit_quantity <= open_quantity:
+                    if order_id not in bracket._market:
+                        modify_ids.append(order_id)
+                elif order_id not in bracket._canceling:
+                    cancel_ids.append(order_id)
+            # the legs being canceled can still fill, the rest is exited once they are done
+            missing = open_quantity - sum(quantity for _, quantity in working.values())
+            if missing > 0:
+                places.append((exit_role, missing, True))
+        else:
+            for role in roles:
+                role_ids = [order_id for order_id, (leg_role, _) in working.items() if leg_role == role]
+                missing = open_quantity - sum(working[order_id][1] for order_id in role_ids)
+                if missing < 0:
+                    # the other role filled: the legs are placed again for the position left once canceled
+                    cancel_ids.extend(order_id for order_id in role_ids if order_id not in bracket._canceling)
+                elif missing > 0 and not any(order_id in bracket._canceling for order_id in role_ids):
+                    places.append((role, missing, False))
+
+        if not places and not cancel_ids and not modify_ids:
+            return
+        bracket._canceling.update(cancel_ids)
+        bracket._market.update(modify_ids)
+        bracket._busy = True
+        self.__executor.submit(self.__send, bracket, places, cancel_ids, modify_ids)
+
+    def __send(
+            self,
+            bracket: Bracket,
+            places: List[Tuple[str, int, bool]],
+            cancel_ids: List[Hashable],
+            modify_ids: List[Hashable]
+    ):
+        placed = []
+        try:
+            if places:
+                placed = self.__place_legs(bracket, places)
+            if cancel_ids:
+                self.__cancel(cancel_ids)
+            if modify_ids:
+                self.__exit_at_market(bracket, modify_ids)
+        finally:
+            for order_id in placed:
+                self.__track(bracket, order_id)
+            with bracket._lock:
+                bracket._busy = False
+                # the updates received meanwhile
+                self.__step(bracket)
+
+    def __place_legs(self, bracket: Bracket, places: List[Tuple[str, int, bool]]) -> List[Hashable]:
+        requests = self.__leg_requests(bracket, places)
+        try:
+            responses = self.__orders.place_orders(bracket.broker_connection, requests, Priority.High)
+        except Exception:
+            logger.exception(f'Failed to place the exit legs of bracket {bracket.entry_order_id}')
+            responses = [None] * len(requests)
+        placed_at = time.perf_counter()
+
+        placed = []
+        with bracket._lock:
+            for (role, quantity, _), response in zip(places, responses):
+                if response is None or not response.success or not response.order_id:
+                    logger.error(f'Exit leg {role} of bracket {bracket.entry_order_id} not placed')
+                    bracket._failed_roles.add(role)
+                    continue
+                bracket._legs[response.order_id] = (role, quantity)
+                if role == _TARGET:
+                    bracket.target_order_id = response.order_id
+                else:
+                    bracket.stop_loss_order_id = response.order_id
+                placed.append(response.order_id)
+
+            if placed and bracket.legs_placed_at is None:
+                bracket.legs_placed_at = placed_at
+                bracket.status = BracketStatus.Active
+        return placed
+
+    @staticmethod
+    def __leg_requests(bracket: Bracket, places: List[Tuple[str, int, bool]]) -> List[PlaceOrderRequestParams]:
+        request, legs = bracket.request, bracket.legs
+        entry_price = bracket.entry_price
+        is_short = request.side == PositionType.Sell
+        sign = 1 if is_short else -1
+
+        def distance(value: float) -> float:
+            return entry_price * value / 100 if legs.percent else value
+
+        def to_tick(price: float) -> float:
+            return max(round(round(price / legs.tick_size) * legs.tick_size, 8), legs.tick_size)
+
+        requests = []
+        for role, quantity, market in places:
+            if market:
+                # exit time expired: a market order closes the position
+                order_info = MarketOrderParams()
+            elif role == _STOP_LOSS:
+                trigger_price = to_tick(entry_price + sign * distance(legs.stop_loss))
+                limit_price = to_tick(trigger_price + sign * legs.stop_loss_slippage)
+                order_info = StopLossOrderParams(limit_price=limit_price, trigger_price=trigger_price)
+            else:
+                order_info = LimitOrderParams(limit_price=to_tick(entry_price - sign * distance(legs.target)))
+            requests.append(replace(
+                request,
+                side=PositionType.Buy if is_short else PositionType.Sell,
+                quantity=quantity,
+                order_info=order_info,
+                tags=dict(request.tags)
+            ))
+        return requests
+
+    def __time_exit(self, bracket: Bracket):
+        with bracket._lock:
+            if bracket.is_done or bracket._time_exit:
+                return
+            logger.info(f'Time exit of bracket {bracket.entry_order_id}')
+            bracket._time_exit = True
+            self.__step(bracket)
+
+    def __exit_at_market(self, bracket: Bracket, order_ids: List[Hashable]):
+        # noinspection PyBroadException
+        try:
+            response = self.__orders.modify_orders(
+                [ModifyOrderRequestParams(order_id=order_id, order_info=MarketOrderParams()) for order_id in order_ids],
+                Priority.High
+            )
+            if not all(modify_response.success for modify_response in response.values()):
+                logger.error(f'Time exit of bracket {bracket.entry_order_id} rejected: {response}')
+        except Exception:
+            logger.exception(f'Failed to exit bracket {bracket.entry_order_id} at market')
+
+    def __cancel(self, order_ids: List[Hashable]):
+        # noinspection PyBroadException
+        try:
+            self.__orders.cancel_orders(order_ids, Priority.High)
+        except Exception:
+            logger.exception(f'Failed to cancel the orders {order_ids}')
+
+    def __finish(self, bracket: Bracket, status: BracketStatus):
+        with bracket._lock:
+            bracket.status = status
+            bracket._done_event.set()
+        with self.__lock:
+            for order_id in [order_id for order_id, tracked in self.__orders_by_id.items() if tracked is bracket]:
+                # the canceled legs are not followed anymore
+                del self.__orders_by_id[order_id]
@@ -0,0 +1,452 @@
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+import threading
+import datetime
+import sqlite3
+import logging
+import json
+import time
+
+from .constant.order import TERMINAL_ORDER_STATUSES
+from .entity.order import Order
+from .utils import is_older
+
+logger = logging.getLogger(__name__)
+
+# default TTL (seconds) of the read-mostly endpoints
+DEFAULT_CACHE_TTLS = {
+    'brokers': 5.,
+    'broker': 5.,
+    'today-orders': 1.,
+}
+
+
+@dataclass
+class CacheStats:
+    """ Counters of the response cache """
+    hits: int = 0
+    misses: int = 0
+    shared: int = 0
+    revalidated: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """ Fraction of the requests served without a round trip of their own """
+        total = self.hits + self.misses + self.shared
+        return (self.hits + self.shared) / total if total else 0.
+
+
+class _CacheEntry:
+
+    def __init__(self, value: Any, expires_at: float, validators: Dict[str, str]):
+        self.value = value
+        self.expires_at = expires_at
+        # headers to revalidate the entry once expired (If-None-Match, If-Modified-Since)
+        self.validators = validators
+
+
+class ResponseCache:
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None):
+        """
+        TTL cache of the responses of read-only endpoints, with single-flight and conditional revalidation.
+
+        Concurrent identical requests share a single in-flight call. Expired entries are revalidated with
+        the ETag/Last-Modified validators sent by the server, when available, so unchanged responses are not resent.
+        Cached responses are shared between callers and must be treated as read-only.
+
+        :param ttls: [Optional] TTL (seconds) for each endpoint name, `DEFAULT_CACHE_TTLS` if not provided.\
+        Endpoints not listed are not cached.
+        """
+        self.__ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+
+        self.__lock = threading.Lock()
+        self.__entries: Dict[Tuple[str, Hashable], _CacheEntry] = {}
+        # in-flight request of each key, with the generation it was sent in
+        self.__in_flight: Dict[Tuple[str, Hashable], Tuple[int, Future]] = {}
+        # incremented on every invalidation: responses fetched across an invalidation are not stored
+        self.__generation = 0
+        self.__stats = CacheStats()
+
+    @property
+    def stats(self) -> CacheStats:
+        """ A snapshot of the cache counters """
+        with self.__lock:
+            return replace(self.__stats)
+
+    def is_cached(self, endpoint: str) -> bool:
+        return endpoint in self.__ttls
+
+    def get(
+            self,
+            endpoint: str,
+            key: Hashable,
+            fetch: Callable[[Dict[str, str]], Tuple[bool, Any, Dict[str, str]]]
+    ) -> Any:
+        """
+        Get the cached response, or fetch it if expired or not available.
+
+        :param endpoint: name of the endpoint
+        :param key: key identifying the request within the endpoint (i.e. url and params)
+        :param fetch: function sending the request with the given validator headers,\
+        returning (not modified flag, response, validators of the response)
+        :return: the response
+        """
+        cache_key = (endpoint, key)
+
+        with self.__lock:
+            entry = self.__entries.get(cache_key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self.__stats.hits += 1
+                return entry.value
+
+            # single-flight: join the identical request already in flight, unless sent before an invalidation
+            shared = None
+            generation = self.__generation
+            in_flight_generation, in_flight = self.__in_flight.get(cache_key, (None, None))
+            if in_flight_generation == generation:
+                shared = in_flight
+                self.__stats.shared += 1
+            else:
+                self.__stats.misses += 1
+                in_flight = Future()
+                self.__in_flight[cache_key] = (generation, in_flight)
+
+        if shared is not None:
+            return shared.result()
+
+        try:
+            not_modified, value, validators = fetch(entry.validators if entry is not None else {})
+            if not_modified and entry is not None:
+                value = entry.value
+                validators = validators or entry.validators
+
+            with self.__lock:
+                if not_modified:
+                    self.__stats.revalidated += 1
+                if generation == self.__generation:
+                    expires_at = time.monotonic() + self.__ttls[endpoint]
+                    self.__entries[cache_key] = _CacheEntry(value, expires_at, validators)
+
+            in_flight.set_result(value)
+            return value
+
+        except Exception as exc:
+            in_flight.set_exception(exc)
+            raise
+
+        finally:
+            with self.__lock:
+                # a newer request may have replaced this one after an invalidation
+                if self.__in_flight.get(cache_key, (None, None))[1] is in_flight:
+                    del self.__in_flight[cache_key]
+
+    def invalidate(self, endpoint: Optional[str] = None, match: Optional[Callable[[Hashable], bool]] = None):
+        """
+        Drop the cached responses of an endpoint (all the endpoints if not provided),
+        optionally only the ones whose key satisfies `match`.
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__stats.invalidations += 1
+
+            for cache_key in list(self.__entries):
+                cached_endpoint, key = cache_key
+                if endpoint is not None and cached_endpoint != endpoint:
+                    continue
+                if match is not None and not match(key):
+                    continue
+                del self.__entries[cache_key]
+
+
+@dataclass
+class OrderCacheStats:
+    """ Counters of the order cache """
+    size: int = 0
+    terminal: int = 0
+    hits: int = 0
+    spill_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class SqliteOrderSpill:
+
+    def __init__(self, path: str):
+        """
+        On-disk store of the orders evicted from the order cache, in a SQLite database.
+
+        :param path: path of the database file
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db: Optional[sqlite3.Connection] = None
+
+    def save(self, order: Order) -> None:
+        data = json.dumps(order.dump(), default=str)
+        with self.__lock:
+            self.__connection().execute('INSERT OR REPLACE INTO orders VALUES (?, ?)', (str(order.order_id), data))
+
+    def load(self, order_id: Hashable) -> Optional[Order]:
+        with self.__lock:
+            row = self.__connection().execute(
+                'SELECT data FROM orders WHERE order_id = ?', (str(order_id),)
+            ).fetchone()
+        return Order.load(json.loads(row[0])) if row is not None else None
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
+    def __connection(self) -> sqlite3.Connection:
+        # must be called with the lock held, (re)opens the database on first use
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.execute('PRAGMA synchronous=NORMAL')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        return self.__db
+
+
+class OrderCache:
+
+    def __init__(
+            self,
+            ttl: Optional[float] = None,
+            max_terminal_orders: Optional[int] = None,
+            spill: Optional[SqliteOrderSpill] = None,
+            eviction_callback: Optional[Callable[[Order], None]] = None,
+            max_tombstones: Optional[int] = None
+    ):
+        """
+        In-memory store of the orders of a client, evicting the completed, rejected and canceled orders.
+        Open orders are never evicted.
+
+        Terminal orders are evicted, least recently used first, when not accessed for `ttl` seconds
+        or when there are more than `max_terminal_orders`. Without a policy, orders are never evicted.
+        Evicted orders are written to the `spill` store, if provided, where lookups still find them.
+        The last update time of the evicted orders is remembered for the whole session, so that their late
+        or duplicate updates are rejected by `put_if_newer` instead of being stored again as new orders
+        (and their fills counted twice by the positions).
+
+        Reads never take a lock: orders are immutable and the store is copy-on-write. Each write publishes a new
+        mapping of the orders, never changed afterwards, so `snapshot()` returns a consistent view in O(1).
+        Writes are serialized by a lock. The hit and miss counters are approximate under concurrent reads.
+
+        :param ttl: [Optional] max time (seconds) a terminal order is kept in memory since its last access
+        :param max_terminal_orders: [Optional] max number of terminal orders kept in memory
+        :param spill: [Optional] on-disk store of the evicted orders
+        :param eviction_callback: [Optional] function called with every evicted order, i.e. to drop its state\
+        elsewhere. It is called without the lock held.
+        :param max_tombstones: [Optional] max number of evicted orders whose last update time is remembered,\
+        unbounded by default. Beyond it, late updates of the orders evicted first are accepted as new orders.
+        """
+        self.ttl = ttl
+        self.max_terminal_orders = max_terminal_orders
+        self.spill = spill
+        self.eviction_callback = eviction_callback
+
+        self.__write_lock = threading.Lock()
+        # published mapping of the orders, replaced on every write and never changed once published
+        self.__orders: Dict[Hashable, Order] = {}
+        self.__snapshot: Mapping[Hashable, Order] = MappingProxyType(self.__orders)
+        # terminal order ids, least recently stored first, with their [store time, last read time].
+        # The readers set the read time of the entry without a lock, the entry being dropped on eviction
+        self.__terminal: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+        # last update time of the evicted orders, least recently evicted first
+        self.__tombstones: "OrderedDict[Hashable, Optional[datetime.datetime]]" = OrderedDict()
+        self.__max_tombstones = max_tombstones
+        self.__stats = OrderCacheStats()
+
+        # incremented on every write
+        self.__version = 0
+
+    @property
+    def version(self) -> int:
+        """ Incremented on every change of the store """
+        return self.__version
+
+    def snapshot(self) -> Mapping[Hashable, Order]:
+        """ A consistent read-only view of the orders in memory, by order id, not affected by later updates """
+        return self.__snapshot
+
+    def with_snapshot(self, func: Callable[[Mapping[Hashable, Order]], Any]) -> Any:
+        """
+        Call `func` with the snapshot of the orders and the write lock held, i.e. to seed state then maintained
+        by the `on_stored` callbacks of `put_if_newer` without missing or applying twice a concurrent update.
+        `func` must not write to the store.
+
+        :param func: function called with the read-only view of the orders in memory
+        :return: the return value of `func`
+        """
+        with self.__write_lock:
+            return func(self.__snapshot)
+
+    @property
+    def stats(self) -> OrderCacheStats:
+        """ A snapshot of the cache counters """
+        with self.__write_lock:
+            return replace(self.__stats, size=len(self.__orders), terminal=len(self.__terminal))
+
+    def __len__(self) -> int:
+        return len(self.__orders)
+
+    def __contains__(self, order_id: Hashable) -> bool:
+        return order_id in self.__orders
+
+    def peek(self, order_id: Hashable, spilled: bool = False) -> Optional[Order]:
+        """
+        The order, if in memory, without updating the counters and the eviction order.
+        If `spilled`, orders not in memory are looked up in the spill store too.
+        """
+        order = self.__orders.get(order_id)
+        if order is None and spilled and self.spill is not None:
+            order = self.spill.load(order_id)
+        return order
+
+    def get(self, order_id: Hashable) -> Optional[Order]:
+        """ The order, looked up in memory and then in the spill store, None if not found """
+        order = self.__orders.get(order_id)
+        if order is not None:
+            self.__stats.hits += 1
+            entry = self.__terminal.get(order_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+            return order
+
+        order = self.spill.load(order_id) if self.spill is not None else None
+        if order is not None:
+            self.__stats.spill_hits += 1
+        else:
+            self.__stats.misses += 1
+        return order
+
+    def is_outdated(self, order_id: Hashable, updated_at: Optional[datetime.datetime]) -> bool:
+        """
+        True if an update of the order at `updated_at` is not newer than the known one,
+        in memory, evicted or in the spill store.
+        """
+        order = self.__orders.get(order_id)
+        if order is not None:
+            return not is_older(order.updated_at, updated_at)
+        if order_id in self.__tombstones:
+            return not is_older(self.__tombstones.get(order_id), updated_at)
+        order = self.spill.load(order_id) if self.spill is not None else None
+        return order is not None and not is_older(order.updated_at, updated_at)
+
+    def put(self, order: Order) -> None:
+        self.put_if_newer(order, force=True)
+
+    def put_if_newer(
+            self,
+            order: Order,
+            force: bool = False,
+            on_stored: Optional[Callable[[Order, Optional[Order]], None]] = None
+    ) -> Tuple[bool, Optional[Order]]:
+        """
+        Store the order, unless the one in memory has a more recent update or is identical (duplicate update).
+        Compare and store are atomic.
+
+        :param order: the order update
+        :param force: store the order regardless of its update time and content
+        :param on_stored: [Optional] function called with the order and the previous one if the order is stored,\
+        with the lock held: state derived from the updates is applied in the same order as the store
+        :return: (True if stored, the order in memory before the update)
+        """
+        order_id = order.order_id
+        with self.__write_lock:
+            previous = self.__orders.get(order_id)
+            if not force:
+                if previous is not None and (order == previous or is_older(order.updated_at, previous.updated_at)):
+                    return False, previous
+                # evicted orders accept only strictly newer updates
+                if previous is None and order_id in self.__tombstones and \
+                        not is_older(self.__tombstones[order_id], order.updated_at):
+                    return False, None
+
+            self.__tombstones.pop(order_id, None)
+            orders = self.__orders.copy()
+            orders[order_id] = order
+            if on_stored is not None:
+                on_stored(order, previous)
+            if order.status in TERMINAL_ORDER_STATUSES:
+                self.__terminal[order_id] = [time.monotonic(), 0.]
+                self.__terminal.move_to_end(order_id)
+            else:
+                self.__terminal.pop(order_id, None)
+
+            _, evicted = self.__evict(orders)
+            self.__publish(orders)
+
+        self.__on_evicted(evicted)
+        return True, previous
+
+    def evict_expired(self) -> int:
+        """ Evict the terminal orders expired since the last update, i.e. from a periodic task """
+        with self.__write_lock:
+            orders, evicted = self.__evict()
+            if evicted:
+                self.__publish(orders)
+
+        self.__on_evicted(evicted)
+        return len(evicted)
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+    def __on_evicted(self, evicted: List[Order]):
+        # called without the write lock held
+        for evicted_order in evicted:
+            if self.spill is not None:
+                self.spill.save(evicted_order)
+            if self.eviction_callback is not None:
+                self.eviction_callback(evicted_order)
+
+    def __publish(self, orders: Dict[Hashable, Order]):
+        # must be called with the write lock held, `orders` is never changed afterwards
+        self.__orders = orders
+        self.__snapshot = MappingProxyType(orders)
+        self.__version += 1
+
+    def __evict(self, orders: Optional[Dict[Hashable, Order]] = None) -> Tuple[Dict[Hashable, Order], List[Order]]:
+        """
+        Evict the expired terminal orders from `orders`, a copy of the published orders being changed.
+        If not provided, the published orders are copied on the first eviction.
+        Must be called with the write lock held.
+        """
+        evicted = []
+        now = time.monotonic()
+        while self.__terminal:
+            order_id, entry = next(iter(self.__terminal.items()))
+            stored_at, accessed_at = entry
+
+            # second chance: orders read since they were queued go back to the end of the queue
+            if accessed_at > stored_at:
+                entry[0] = accessed_at
+                self.__terminal.move_to_end(order_id)
+                continue
+
+            over_size = self.max_terminal_orders is not None and len(self.__terminal) > self.max_terminal_orders
+            expired = self.ttl is not None and now - stored_at > self.ttl
+            if not (over_size or expired):
+                break
+
+            del self.__terminal[order_id]
+            if orders is None:
+                orders = self.__orders.copy()
+            order = orders.pop(order_id)
+            evicted.append(order)
+            self.__stats.evictions += 1
+
+            self.__tombstones[order_id] = order.updated_at
+            while self.__max_tombstones is not None and len(self.__tombstones) > self.__max_tombstones:
+                self.__tombstones.popitem(last=False)
+        return orders, evicted
+
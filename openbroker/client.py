@@ -1,10 +1,22 @@
-from typing import Optional, Callable
+from typing import Optional, Callable, Dict
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+import time
 import os
 
 from .broker import BrokersClient
+from .feed import FeedCodec, MarketDataClient
 from .order import OrdersClient
 from .instrument import InstrumentsClient
-from .session import generate_session
+from .cache import ResponseCache, OrderCache
+from .journal import OrderJournal
+from .killswitch import KillSwitchReport
+from .config import Config
+from .metrics import MetricsHook
+from .session import generate_session, get_public_session, SessionStore
+from .transport import TransportConfig
+
+logger = logging.getLogger(__name__)
 
 
 class OpenBroker:
@@ -18,7 +30,24 @@ class OpenBroker:
     instruments: InstrumentsClient
     "API interface for instruments"
 
-    def __init__(self, phone_number: str, password: str, orders_group_tag: str = ''):
+    market_data: Optional[MarketDataClient]
+    "Streaming client of the prices feed, None if no feed url was provided"
+
+    def __init__(
+            self,
+            phone_number: str,
+            password: str,
+            orders_group_tag: str = '',
+            session_store: Optional[SessionStore] = None,
+            transport: Optional[TransportConfig] = None,
+            response_cache: Optional[ResponseCache] = None,
+            metrics: Optional[MetricsHook] = None,
+            order_journal: Optional[OrderJournal] = None,
+            order_cache: Optional[OrderCache] = None,
+            order_relay_path: Optional[str] = None,
+            feed_url: Optional[str] = None,
+            feed_codec: Optional[FeedCodec] = None
+    ):
         """
         OpenBroker client. The main entry point to AlgoTest APIs.
         Initialize the OpenBroker client with the user credentials.
@@ -30,17 +59,77 @@ class OpenBroker:
         :param orders_group_tag: A common tag that a user wants to assign to all the orders placed by this client.\
         It's commonly used to identify a session or a strategy, by marking all the orders with the same identifier.\
         The identifier can be kept same across multiple sessions to track and restore the orders state.
+
+        :param session_store: [Optional] An encrypted on-disk store of the login session.\
+        When provided, restarts reuse the stored session while it's valid, without logging in again.
+
+        :param transport: [Optional] HTTP transport settings of the session (connection pool size, TCP options, HTTP/2).
+
+        :param response_cache: [Optional] A TTL cache of the responses of read-mostly endpoints (brokers, today's orders).\
+        Its hit and miss counters are available in `response_cache.stats`.
+
+        :param metrics: [Optional] A metrics hook called for every REST request and websocket frame,\
+        i.e. `InMemoryMetrics` or `PrometheusMetrics`. Disabled by default.
+
+        :param order_journal: [Optional] A local append-only journal of the order updates.\
+        On restart, the orders of the group tag are restored from the journal, loading only the ones updated since.
+
+        :param order_cache: [Optional] The in-memory store of the orders, with the eviction policy of the terminal orders\
+        (TTL, max count) and an optional on-disk spill. By default orders are never evicted.
+
+        :param order_relay_path: [Optional] path of the Unix socket of an order update relay, started by another process\
+        of the host with `orders.start_relay`. The order updates of the group tag are received from the relay\
+        instead of opening a websocket.
+
+        :param feed_url: [Optional] url of the websocket of a prices feed. When provided, `market_data` is a\
+        `MarketDataClient` of the feed, otherwise it's None.
+
+        :param feed_codec: [Optional] message format of the prices feed, `JsonFeedCodec` by default.
         
         """
         
         self.phone_number = phone_number
         self.password = password
         self.orders_group_tag = orders_group_tag
+        self.session_store = session_store
+        self.transport = transport
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.order_journal = order_journal
+        self.order_cache = order_cache
+        self.order_relay_path = order_relay_path
+        self.feed_url = feed_url
+        self.feed_codec = feed_codec
+        self.__user_session = None
 
         self.orders = None
         self.brokers = None
+        self.market_data = None
         self.instruments = InstrumentsClient()
 
+        self.__startup_timings: Dict[str, float] = {}
+
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        """
+        Duration (seconds) of each phase of the last `connect` call:
+        'login', 'brokers', 'tagged_orders', 'websocket', 'instruments' and 'total'.
+        Phases after login run concurrently, so their sum exceeds the total.
+        """
+        return dict(self.__startup_timings)
+
+    def __timed(self, phase: str, func: Callable, *args):
+        started_at = time.perf_counter()
+        func(*args)
+        self.__startup_timings[phase] = time.perf_counter() - started_at
+
+    def __load_instruments(self, instrument_filepath: str):
+        if os.path.exists(instrument_filepath):
+            self.instruments.load(instrument_filepath)
+        else:
+            self.instruments.update()
+            self.instruments.dump(instrument_filepath)
+
     def connect(self, instrument_filepath: Optional[str] = None, order_update_callback: Optional[Callable] = None) -> None:
         """
         Connect to AlgoTest account and initialize internal components to start using the APIs.
@@ -49,32 +138,103 @@ class OpenBroker:
         
         It also initializes the `BrokersClient`, fetching the list of brokers connected by the user.
         It also initializes the `InstrumentsClient`, fetching or restoring the list of instruments available for trading.
+        If a feed url was supplied, the `MarketDataClient` is created, its feed is opened with `market_data.connect`\
+        after subscribing instruments.
         It is recommended to provide a static instrument_filepath to avoid fetching instruments every time.
+
+        The instruments are loaded while logging in, then brokers, previous orders and the websocket handshake
+        are initialized concurrently. The duration of each phase is available in `startup_timings`.
         
         :param instrument_filepath: [Optional] path to the file where instruments are stored. If it is `None` then the instruments are not initialized.\
         If the file exists, it will be loaded. If the file does not exist, instruments will be fetched from the server and saved to the file.
         
-        :param order_update_callback: [Optional] A callback function that will be called whenever an order update is received on websocket.\
+        :param order_update_callback: [Optional] A callback function that will be called with the updated `Order` whenever\
+        an order changes, as received on websocket. Duplicate and outdated updates are not notified.\
+        It's a change subscriber receiving the whole order: to get only the changes (status transition,\
+        filled quantity delta), or the changes of some statuses only, use `orders.subscribe` instead.\
         
         :return: None
         """
-        user_session = generate_session(self.phone_number, self.password)
+        self.__startup_timings = {}
+        started_at = time.perf_counter()
 
-        self.orders = OrdersClient(user_session=user_session, orders_group_tag=self.orders_group_tag, order_update_callback=order_update_callback)
-        self.brokers = BrokersClient(user_session=user_session)
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='openbroker-connect') as executor:
+            # instruments do not depend on the user session
+            tasks = []
+            if instrument_filepath is not None:
+                tasks.append(executor.submit(self.__timed, 'instruments', self.__load_instruments, instrument_filepath))
 
-        self.brokers.update_brokers()
-        self.orders.connect()
-        
-        if instrument_filepath is None:
-            return
-        
-        if os.path.exists(instrument_filepath):
-            self.instruments.load(instrument_filepath)
-        else:
-            self.instruments.update()
-            self.instruments.dump(instrument_filepath)
+            try:
+                login_started_at = time.perf_counter()
+                user_session = generate_session(
+                    self.phone_number, self.password, session_store=self.session_store,
+                    transport=self.transport, response_cache=self.response_cache, metrics=self.metrics
+                )
+                self.__startup_timings['login'] = time.perf_counter() - login_started_at
+                self.__user_session = user_session
+
+                self.orders = OrdersClient(
+                    user_session=user_session,
+                    orders_group_tag=self.orders_group_tag,
+                    order_update_callback=order_update_callback,
+                    journal=self.order_journal,
+                    order_cache=self.order_cache
+                )
+                self.brokers = BrokersClient(user_session=user_session)
+                if self.feed_url:
+                    # the feed is opened on demand, after subscribing the instruments
+                    self.market_data = MarketDataClient(self.feed_url, user_session=user_session, codec=self.feed_codec)
+
+                tasks.append(executor.submit(self.__timed, 'brokers', self.brokers.update_brokers))
+                tasks.append(executor.submit(self.orders.connect, relay_path=self.order_relay_path))
+
+            finally:
+                # never leave a phase running in the background, even if login failed
+                wait(tasks)
+
+        # raise the first error, if any
+        for task in tasks:
+            task.result()
+
+        self.__startup_timings.update(self.orders.connect_timings)
+        phases = ', '.join(f'{phase}: {duration:.3f}s' for phase, duration in self.__startup_timings.items())
+        self.__startup_timings['total'] = time.perf_counter() - started_at
+        logger.info(f"Connected in {self.__startup_timings['total']:.3f}s ({phases})")
         
+    def warm_up(self, connections: int = 1) -> float:
+        """
+        Open connections to the orders and feed hosts ahead of time, i.e. a few seconds before market open,
+        so that the first order does not pay the DNS, TCP and TLS setup. Must be called after `connect`.
+
+        :param connections: number of connections to open for each host,\
+        i.e. the number of orders expected to be placed concurrently
+        :return: time (seconds) spent warming up
+        """
+        if self.__user_session is None:
+            raise Exception('Not connected. Please call connect() method.')
+
+        orders_elapsed = self.__user_session.warm_up([Config.order_base_url], connections=connections)
+        feed_elapsed = get_public_session().warm_up([Config.feed_base_url], connections=1)
+        return orders_elapsed + feed_elapsed
+
+    def kill_switch(self, square_off: bool = True, refresh: Optional[bool] = None) -> KillSwitchReport:
+        """
+        Cancel every open order and square off every position of the orders of this client,
+        across all the brokers in `brokers`, concurrently and with the highest priority.
+        The positions of a broker are squared off once its cancels are acknowledged.
+        It works even if the order updates websocket is down. See `OrdersClient.kill_switch`.
+
+        :param square_off: False to cancel the open orders only
+        :param refresh: [Optional] True to fetch the orders from the API first, by default only if the websocket\
+        is not healthy
+        :return: the report of the canceled orders and square-offs, with the timings
+        """
+        if self.orders is None or self.brokers is None:
+            raise Exception('Not connected. Please call connect() method.')
+
+        broker_ids = {broker_connection.id for broker_connection in self.brokers.brokers.values()}
+        return self.orders.kill_switch(broker_ids=broker_ids, square_off=square_off, refresh=refresh)
+
     def close(self):
         """
         Close the OpenBroker API connection
@@ -82,5 +242,10 @@ class OpenBroker:
         if self.orders is not None:
             self.orders.close()
 
+        if self.market_data is not None:
+            self.market_data.close()
+
         self.orders = None
         self.brokers = None
+        self.market_data = None
+        self.__user_session = None
@@ -38,3 +38,8 @@ class OrderStatus(str, enum.Enum):
     Canceled = 'Canceled'
     Rejected = 'Rejected'
     Completed = 'Completed'
+
+
+# statuses after which an order is not updated anymore.
+# A tuple, so that membership is tested by value: order updates carry the status as a plain string
+TERMINAL_ORDER_STATUSES = (OrderStatus.Completed, OrderStatus.Rejected, OrderStatus.Canceled)
@@ -1,2 +1,2 @@
 from .broker import BrokerConnection
-from .order import Order
\ No newline at end of file
+from .order import Order, OrderChangeEvent
\ No newline at end of file
@@ -1,3 +1,4 @@
+from typing import Union
 from dataclasses import dataclass
 
 import uuid
@@ -6,14 +7,23 @@ import datetime
 
 from ..constant.order import PositionType, ProductType, OrderStatus
 from ..datatype.order import OrderParams, ORDER_TYPE_PARAMS
+from ..utils import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# direct lookups by raw value, faster than the enum constructors.
+# Unknown values are kept as they are, so that new statuses do not break the updates processing
+_PRODUCT_TYPES = {product_type.value: product_type for product_type in ProductType}
+_POSITION_TYPES = {position_type.value: position_type for position_type in PositionType}
+_ORDER_STATUSES = {status.value: status for status in OrderStatus}
+_ORDER_PARAMS_LOADERS = {order_type.value: params.load for order_type, params in ORDER_TYPE_PARAMS.items()}
 
-@dataclass
+
+@dataclass(frozen=True)
 class Order:
     """
     Class representing all the properties of and order that has been placed.
+    Instances are immutable: every update of an order is a new instance.
 
     Attributes:
         instrument_id (str): The instrument id of the order.
@@ -26,7 +36,16 @@ class Order:
         order_id (int): The internal order id of the order.
         broker_order_id (str): The broker order id of the order.
         status (OrderStatus): The status of the order.
+        created_at (datetime): The creation time of the order, timezone aware.
+        updated_at (datetime): The time of the last update of the order, timezone aware.
     """
+    # slots: no per-instance dict, orders are created for every update
+    __slots__ = (
+        'order_id', 'created_at', 'updated_at', 'user_tag', 'extra_tags',
+        'instrument_id', 'symbol', 'product_type', 'side', 'quantity', 'lot_size', 'order_info', 'broker_id', 'user_id',
+        'broker_order_id', 'status',
+        'rejection_code', 'rejection_reason', 'trade_time', 'filled_quantity', 'average_price',
+    )
 
     order_id: uuid.UUID
     created_at: datetime.datetime
@@ -54,28 +73,63 @@ class Order:
     filled_quantity: int
     average_price: float
 
+    def dump(self) -> dict:
+        """ The order data, in the format accepted by `Order.load` """
+        return {
+            'order_id': self.order_id,
+            'created_at': self.created_at.isoformat() if self.created_at is not None else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at is not None else None,
+
+            'user_tag': self.user_tag,
+            'extra_tags': self.extra_tags,
+
+            'instrument_id': self.instrument_id,
+            'symbol': self.symbol,
+            'product_type': getattr(self.product_type, 'value', self.product_type),
+            'side': getattr(self.side, 'value', self.side),
+            'quantity': self.quantity,
+            'lot_size': self.lot_size,
+            'order_info': self.order_info.dump(),
+            'broker_id': self.broker_id,
+            'user_id': self.user_id,
+
+            'broker_order_id': self.broker_order_id,
+            'status': getattr(self.status, 'value', self.status),
+
+            'rejection_code': self.rejection_code,
+            'rejection_reason': self.rejection_reason,
+            'trade_time': self.trade_time,
+            'filled_quantity': self.filled_quantity,
+            'average_price': self.average_price
+        }
+
     @classmethod
     def load(cls, order_data: dict) -> "Order":
+        order_info = order_data['order_info']
+        product_type = order_data['product_type']
+        side = order_data['side']
+        status = order_data['status']
+
         return cls(
             order_id=order_data['order_id'],
-            created_at=order_data['created_at'],
-            updated_at=order_data['updated_at'],
+            created_at=parse_timestamp(order_data['created_at']),
+            updated_at=parse_timestamp(order_data['updated_at']),
 
             user_tag=order_data['user_tag'],
             extra_tags=order_data['extra_tags'],
-            
+
             instrument_id=order_data['instrument_id'],
             symbol=order_data['symbol'],
-            product_type=order_data['product_type'],
-            side=order_data['side'],
+            product_type=_PRODUCT_TYPES.get(product_type, product_type),
+            side=_POSITION_TYPES.get(side, side),
             quantity=order_data['quantity'],
             lot_size=order_data['lot_size'],
-            order_info=ORDER_TYPE_PARAMS[order_data['order_info']['order_type']].load(order_data['order_info']),
+            order_info=_ORDER_PARAMS_LOADERS[order_info['order_type']](order_info),
             broker_id=order_data['broker_id'],
             user_id=order_data['user_id'],
 
             broker_order_id=order_data['broker_order_id'],
-            status=order_data['status'],
+            status=_ORDER_STATUSES.get(status, status),
 
             rejection_code=order_data['rejection_code'],
             rejection_reason=order_data['rejection_reason'],
@@ -83,3 +137,60 @@ class Order:
             filled_quantity=order_data['filled_quantity'],
             average_price=order_data['average_price']
         )
+
+
+@dataclass
+class OrderChangeEvent:
+    """
+    Class representing the changes of an order between two updates.
+
+    Attributes:
+        order (Order): The order after the update.
+        old_status (OrderStatus): The status before the update, None if the order was not known.
+        filled_quantity_delta (int): The quantity filled since the previous update.
+        fill_price (float): The average price of the quantity filled since the previous update, 0 if none.
+        old_order_info (OrderParams): The order params before the update if they changed (i.e. modified price),\
+        None otherwise.
+    """
+    __slots__ = ('order', 'old_status', 'filled_quantity_delta', 'fill_price', 'old_order_info')
+
+    order: Order
+    old_status: Union[OrderStatus, None]
+    filled_quantity_delta: int
+    fill_price: float
+    old_order_info: Union[OrderParams, None]
+
+    @property
+    def order_id(self) -> uuid.UUID:
+        return self.order.order_id
+
+    @property
+    def status(self) -> OrderStatus:
+        return self.order.status
+
+    @property
+    def is_new(self) -> bool:
+        """ True if this is the first update of the order """
+        return self.old_status is None
+
+    @property
+    def status_changed(self) -> bool:
+        return self.old_status != self.order.status
+
+    @classmethod
+    def diff(cls, old: Union[Order, None], new: Order) -> "OrderChangeEvent":
+        if old is None:
+            return cls(new, None, new.filled_quantity, new.average_price if new.filled_quantity else 0., None)
+
+        delta = new.filled_quantity - old.filled_quantity
+        fill_price = 0.
+        if delta > 0:
+            fill_price = (new.filled_quantity * new.average_price - old.filled_quantity * old.average_price) / delta
+
+        return cls(
+            new,
+            old.status,
+            delta,
+            fill_price,
+            old.order_info if old.order_info != new.order_info else None
+        )
@@ -1,7 +1,32 @@
+from typing import Union
+
 
 class RequestFailedException(Exception):
-    pass
+
+    def __init__(self, msg: str = '', status_code: Union[int, None] = None, ambiguous: bool = False):
+        """
+        :param msg: error message or response content
+        :param status_code: HTTP status code of the response, None if no response was received
+        :param ambiguous: True if the request may have been processed by the server despite the failure\
+        (i.e. read timeout), so it's unsafe to resend non-idempotent requests without checking first
+        """
+        super().__init__(msg)
+        self.status_code = status_code
+        self.ambiguous = ambiguous
 
 
 class InvalidDataException(Exception):
     pass
+
+
+class RiskCheckFailedException(Exception):
+
+    def __init__(self, msg: str = '', rule: str = '', request=None):
+        """
+        :param msg: reason of the rejection
+        :param rule: name of the pre-trade risk rule rejecting the order
+        :param request: the rejected place request
+        """
+        super().__init__(msg)
+        self.rule = rule
+        self.request = request
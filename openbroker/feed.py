@@ -0,0 +1,343 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from array import array
+import threading
+import logging
+import time
+import json
+
+from .api import WsAPI
+from .api.ws import WsHealth
+from .datatype.instrument import Instrument
+from .session import UserSession, get_public_session
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Tick:
+    """
+    Dataclass representing a price update of an instrument.
+
+    Attributes:
+        token (str): Token of the instrument.
+        price (float): Last traded price.
+        volume (float): Traded volume, 0 if not provided by the feed.
+        timestamp (float): Time of the tick (epoch seconds).
+    """
+    token: str
+    price: float
+    volume: float
+    timestamp: float
+
+
+class TickBuffer:
+    """
+    Fixed-size ring of the last ticks of an instrument, stored in arrays preallocated at subscription.
+    Written by the feed thread only, read lock-free by any thread.
+    """
+
+    __slots__ = (
+        'token', 'capacity', 'last_price', 'last_timestamp', '_slots', '_prices', '_volumes', '_timestamps', '_count'
+    )
+
+    def __init__(self, token: str, capacity: int):
+        if capacity <= 0:
+            raise ValueError('Tick buffer capacity must be positive')
+
+        self.token = token
+        self.capacity = capacity
+        # last tick, read in O(1) without going through the ring
+        self.last_price: Optional[float] = None
+        self.last_timestamp: Optional[float] = None
+
+        # a spare slot is the one being written, so that a full ring is read while a tick is appended
+        self._slots = capacity + 1
+        self._prices = array('d', bytes(8 * self._slots))
+        self._volumes = array('d', bytes(8 * self._slots))
+        self._timestamps = array('d', bytes(8 * self._slots))
+        # number of ticks appended since the subscription, the next slot is count % slots
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    @property
+    def count(self) -> int:
+        """ Number of ticks received since the subscription, including the ones overwritten """
+        return self._count
+
+    def append(self, price: float, volume: float, timestamp: float):
+        index = self._count % self._slots
+        self._prices[index] = price
+        self._volumes[index] = volume
+        self._timestamps[index] = timestamp
+        self.last_price = price
+        self.last_timestamp = timestamp
+        # published last: readers never see the slot before it is written
+        self._count += 1
+
+    def ticks(self, n: Optional[int] = None) -> List[Tick]:
+        """
+        The last ticks, oldest first
+
+        :param n: [Optional] max number of ticks, all the buffered ones by default
+        :return: list of ticks
+        """
+        return [
+            Tick(self.token, price, volume, timestamp)
+            for price, volume, timestamp in zip(*self.__copy(n, self._prices, self._volumes, self._timestamps))
+        ]
+
+    def prices(self, n: Optional[int] = None) -> List[float]:
+        """
+        The last prices, oldest first
+
+        :param n: [Optional] max number of prices, all the buffered ones by default
+        :return: list of prices
+        """
+        prices, = self.__copy(n, self._prices)
+        return prices
+
+    def __copy(self, n: Optional[int], *arrays: array) -> List[List[float]]:
+        count = self._count
+        size = min(count, self.capacity) if n is None else min(n, count, self.capacity)
+        positions = range(count - size, count)
+        copies = [[values[position % self._slots] for position in positions] for values in arrays]
+
+        # slots overwritten by the writer while copying are dropped
+        torn = self._count - self.capacity - (count - size)
+        if torn > 0:
+            copies = [values[torn:] for values in copies]
+        return copies
+
+
+# a decoded tick: (token, price, volume, timestamp in epoch seconds)
+RawTick = Tuple[str, float, float, float]
+
+
+class FeedCodec(ABC):
+    """
+    Interface of the message format of a prices feed: the subscription requests sent to the feed
+    and the tick frames received from it. Implement it to connect `MarketDataClient` to a given feed.
+    """
+
+    @abstractmethod
+    def encode_subscription(self, action: str, tokens: List[str]) -> Union[str, bytes]:
+        """
+        Encode a subscription request
+
+        :param action: 'subscribe' or 'unsubscribe'
+        :param tokens: tokens of the instruments
+        :return: the websocket frame, text or binary
+        """
+        pass
+
+    @abstractmethod
+    def decode_ticks(self, message: Union[str, bytes]) -> Iterable[RawTick]:
+        """
+        Decode a frame received from the feed, called in the feed thread
+
+        :param message: the websocket frame, text or binary
+        :return: the ticks of the frame, as (token, price, volume, timestamp) tuples
+        """
+        pass
+
+
+class JsonFeedCodec(FeedCodec):
+    """
+    JSON feed format, as served by `LocalFeedServer`.
+    Requests are `{"action": str, "tokens": [str]}`, frames are a tick or a list of ticks:
+    `{"token": str, "ltp": float, "volume": float, "timestamp": epoch seconds}`.
+    """
+
+    def encode_subscription(self, action: str, tokens: List[str]) -> str:
+        return json.dumps({'action': action, 'tokens': tokens})
+
+    def decode_ticks(self, message: Union[str, bytes]) -> List[RawTick]:
+        payload = json.loads(message)
+        return [
+            (
+                tick.get('token'),
+                float(tick['ltp']),
+                float(tick.get('volume') or 0),
+                float(tick.get('timestamp') or time.time())
+            )
+            for tick in (payload if isinstance(payload, list) else (payload,))
+        ]
+
+
+class MarketDataClient:
+
+    def __init__(
+            self,
+            feed_url: str,
+            user_session: Optional[UserSession] = None,
+            buffer_size: int = 1024,
+            tick_callback: Optional[Callable[[Tick], None]] = None,
+            codec: Optional[FeedCodec] = None
+    ):
+        """
+        Streaming client of the prices feed, keeping the last ticks of each subscribed instrument in a ring buffer.
+
+        Subscriptions are sent again after each reconnection. The last price of an instrument is read in O(1)
+        from any thread, without locks.
+
+        :param feed_url: url of the feed websocket
+        :param user_session: [Optional] the user session, the public session if not provided
+        :param buffer_size: number of ticks kept for each instrument
+        :param tick_callback: [Optional] function called with every tick, in the feed thread
+        :param codec: [Optional] message format of the feed, `JsonFeedCodec` by default
+        """
+        if not feed_url:
+            raise ValueError('Feed url is required')
+
+        self.__session = user_session or get_public_session()
+        self.buffer_size = buffer_size
+        self.__tick_callback = tick_callback
+        self.__feed_url = feed_url
+        self.__codec = codec if codec is not None else JsonFeedCodec()
+
+        self.__lock = threading.Lock()
+        # copy on write: the feed thread reads the buffers without a lock
+        self.__buffers: Dict[str, TickBuffer] = {}
+        self.__ws_connection: Union[WsAPI, None] = None
+
+    @property
+    def tokens(self) -> List[str]:
+        """ Tokens of the subscribed instruments """
+        return list(self.__buffers)
+
+    @property
+    def is_connected(self) -> bool:
+        return self.__ws_connection is not None and self.__ws_connection.is_connected
+
+    @property
+    def health(self) -> Union[WsHealth, None]:
+        """ Liveness of the feed websocket, None if not connected. """
+        if self.__ws_connection is None:
+            return None
+        return self.__ws_connection.health
+
+    def connect(
+            self,
+            timeout: float = 10.,
+            ping_interval: Optional[float] = 10.,
+            stall_timeout: Optional[float] = 30.
+    ) -> bool:
+        """
+        Open the feed websocket in the background and subscribe the instruments
+
+        :param timeout: max time (seconds) to wait for the websocket handshake
+        :param ping_interval: interval (seconds) between websocket pings, None to disable the pings
+        :param stall_timeout: max time (seconds) without frames before reconnecting, None to disable
+        :return: True if connected, False if still connecting in the background
+        """
+        if self.__ws_connection is not None:
+            raise RuntimeError('Market data client already connected')
+
+        self.__ws_connection = WsAPI(
+            user_session=self.__session,
+            ws_url=self.__feed_url,
+            callback_func=self.__on_ticks,
+            decode_func=self.__codec.decode_ticks,
+            ping_interval=ping_interval,
+            stall_timeout=stall_timeout,
+            connect_callback=self.__on_connect
+        )
+        self.__ws_connection.start()
+
+        connected = self.__ws_connection.wait_connected(timeout)
+        if not connected:
+            logger.warning(f'Feed not connected after {timeout}s, still connecting in the background')
+        return connected
+
+    def close(self):
+        if self.__ws_connection is not None:
+            self.__ws_connection.stop()
+            self.__ws_connection = None
+
+    def subscribe(self, instruments: Iterable[Union[Instrument, str]]) -> List[TickBuffer]:
+        """
+        Subscribe instruments, i.e. found with `InstrumentsClient.find_instrument`.
+        Their ring buffers are allocated now, so that ticks are stored without allocating.
+
+        :param instruments: instruments or their tokens
+        :return: the tick buffers of the instruments
+        """
+        tokens = [instrument.token if isinstance(instrument, Instrument) else instrument for instrument in instruments]
+
+        with self.__lock:
+            buffers = dict(self.__buffers)
+            new_tokens = [token for token in dict.fromkeys(tokens) if token not in buffers]
+            for token in new_tokens:
+                buffers[token] = TickBuffer(token, self.buffer_size)
+            self.__buffers = buffers
+
+        if new_tokens:
+            self.__send('subscribe', new_tokens)
+        return [buffers[token] for token in tokens]
+
+    def unsubscribe(self, instruments: Iterable[Union[Instrument, str]]):
+        """
+        Unsubscribe instruments, dropping their tick buffers
+
+        :param instruments: instruments or their tokens
+        """
+        tokens = [instrument.token if isinstance(instrument, Instrument) else instrument for instrument in instruments]
+
+        with self.__lock:
+            buffers = dict(self.__buffers)
+            removed = [token for token in tokens if buffers.pop(token, None) is not None]
+            self.__buffers = buffers
+
+        if removed:
+            self.__send('unsubscribe', removed)
+
+    def buffer(self, instrument: Union[Instrument, str]) -> Union[TickBuffer, None]:
+        """ The tick buffer of a subscribed instrument, None if not subscribed """
+        token = instrument.token if isinstance(instrument, Instrument) else instrument
+        return self.__buffers.get(token)
+
+    def last_price(self, instrument: Union[Instrument, str]) -> Union[float, None]:
+        """ The last traded price of a subscribed instrument, None if no tick was received yet """
+        tick_buffer = self.__buffers.get(instrument.token if isinstance(instrument, Instrument) else instrument)
+        return tick_buffer.last_price if tick_buffer is not None else None
+
+    def wait_for_price(self, instrument: Union[Instrument, str], timeout: float = 5.) -> Union[float, None]:
+        """
+        Block until a tick of a subscribed instrument is received
+
+        :param instrument: the instrument or its token
+        :param timeout: max time (seconds) to wait
+        :return: the last traded price, None if the timeout expired
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            price = self.last_price(instrument)
+            if price is not None or time.monotonic() >= deadline:
+                return price
+            time.sleep(0.01)
+
+    def __send(self, action: str, tokens: List[str]):
+        if self.__ws_connection is not None:
+            # not connected: the subscriptions are sent on connect
+            self.__ws_connection.send(self.__codec.encode_subscription(action, tokens))
+
+    def __on_connect(self):
+        tokens = list(self.__buffers)
+        if tokens:
+            self.__send('subscribe', tokens)
+
+    def __on_ticks(self, ticks: Iterable[RawTick]):
+        buffers = self.__buffers
+        for token, price, volume, timestamp in ticks:
+            tick_buffer = buffers.get(token)
+            if tick_buffer is None:
+                continue
+
+            tick_buffer.append(price, volume, timestamp)
+
+            if self.__tick_callback is not None:
+                self.__tick_callback(Tick(token, price, volume, timestamp))
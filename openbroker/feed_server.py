@@ -0,0 +1,251 @@
+from typing import Dict, Iterable, List, Optional, Set
+import threading
+import logging
+import hashlib
+import base64
+import socket
+import struct
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+_OPCODE_TEXT = 0x1
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xa
+
+
+def _encode_frame(opcode: int, data: bytes) -> bytes:
+    size = len(data)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + data
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Feed client disconnected')
+        data += chunk
+    return data
+
+
+def _recv_frame(sock: socket.socket):
+    first, second = _recv_exact(sock, 2)
+    size = second & 0x7f
+    if size == 126:
+        size, = struct.unpack('!H', _recv_exact(sock, 2))
+    elif size == 127:
+        size, = struct.unpack('!Q', _recv_exact(sock, 8))
+    # client frames are always masked
+    mask = _recv_exact(sock, 4) if second & 0x80 else b'\x00\x00\x00\x00'
+    data = _recv_exact(sock, size)
+    return first & 0x0f, bytes(byte ^ mask[i % 4] for i, byte in enumerate(data))
+
+
+class _FeedClient:
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.tokens: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def send(self, opcode: int, data: bytes):
+        with self.lock:
+            self.sock.sendall(_encode_frame(opcode, data))
+
+
+class LocalFeedServer:
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Stand-in of a prices feed websocket for local tests, speaking the format of `JsonFeedCodec`.
+        Ticks are published by the test and sent to the clients subscribed to their token.
+
+        :param host: host to listen on
+        :param port: port to listen on, a free port by default
+        """
+        self.host = host
+        self.port = port
+
+        self.__lock = threading.Lock()
+        self.__clients: List[_FeedClient] = []
+        self.__server: Optional[socket.socket] = None
+        self.__stop_event = threading.Event()
+        self.connections = 0
+
+    @property
+    def url(self) -> str:
+        """ Url of the feed, to pass to `MarketDataClient` """
+        return f'ws://{self.host}:{self.port}'
+
+    @property
+    def subscriptions(self) -> Dict[str, int]:
+        """ Number of subscribed clients by token """
+        subscriptions: Dict[str, int] = {}
+        with self.__lock:
+            for client in self.__clients:
+                for token in client.tokens:
+                    subscriptions[token] = subscriptions.get(token, 0) + 1
+        return subscriptions
+
+    def start(self) -> "LocalFeedServer":
+        self.__stop_event.clear()
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__server.bind((self.host, self.port))
+        self.__server.listen()
+        self.port = self.__server.getsockname()[1]
+
+        threading.Thread(target=self.__accept_loop, name='openbroker-feed-server', daemon=True).start()
+        logger.info(f'Local feed server listening on {self.url}')
+        return self
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__server is not None:
+            self.__server.close()
+            self.__server = None
+
+        with self.__lock:
+            clients, self.__clients = self.__clients, []
+        for client in clients:
+            self.__close(client)
+
+    def __enter__(self) -> "LocalFeedServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def publish(self, token: str, price: float, volume: float = 0, timestamp: Optional[float] = None) -> int:
+        """
+        Send a tick to the clients subscribed to its token
+
+        :return: number of clients the tick was sent to
+        """
+        return self.publish_ticks([{
+            'token': token,
+            'ltp': price,
+            'volume': volume,
+            'timestamp': timestamp if timestamp is not None else time.time()
+        }])
+
+    def publish_ticks(self, ticks: Iterable[Dict]) -> int:
+        """
+        Send ticks, as dicts in the feed format, to the clients subscribed to their tokens.
+        The ticks of a client are sent in a single frame.
+
+        :return: number of clients the ticks were sent to
+        """
+        ticks = list(ticks)
+        with self.__lock:
+            clients = list(self.__clients)
+
+        sent = 0
+        for client in clients:
+            client_ticks = [tick for tick in ticks if tick['token'] in client.tokens]
+            if not client_ticks:
+                continue
+            # noinspection PyBroadException
+            try:
+                client.send(_OPCODE_TEXT, json.dumps(client_ticks).encode())
+                sent += 1
+            except Exception:
+                self.__close(client)
+        return sent
+
+    def disconnect_clients(self):
+        """ Drop the client connections, i.e. to test the reconnections """
+        with self.__lock:
+            clients, self.__clients = self.__clients, []
+        for client in clients:
+            self.__close(client)
+
+    def __accept_loop(self):
+        while not self.__stop_event.is_set():
+            try:
+                sock, _ = self.__server.accept()
+            except OSError:
+                # server socket closed
+                break
+
+            # noinspection PyBroadException
+            try:
+                self.__handshake(sock)
+            except Exception:
+                logger.warning('Feed client handshake failed')
+                sock.close()
+                continue
+
+            client = _FeedClient(sock)
+            with self.__lock:
+                self.__clients.append(client)
+                self.connections += 1
+            threading.Thread(target=self.__serve, args=(client,), name='openbroker-feed-client', daemon=True).start()
+
+    @staticmethod
+    def __handshake(sock: socket.socket):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError('Feed client disconnected during the handshake')
+            request += chunk
+
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + _WS_GUID).encode()).digest()).decode()
+        sock.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+
+    def __serve(self, client: _FeedClient):
+        # noinspection PyBroadException
+        try:
+            while True:
+                opcode, data = _recv_frame(client.sock)
+                if opcode == _OPCODE_PING:
+                    client.send(_OPCODE_PONG, data)
+                elif opcode == _OPCODE_CLOSE:
+                    client.send(_OPCODE_CLOSE, data)
+                    break
+                elif opcode == _OPCODE_TEXT:
+                    self.__on_request(client, json.loads(data.decode('utf-8')))
+        except Exception:
+            pass
+        self.__close(client)
+
+    def __on_request(self, client: _FeedClient, request: Dict):
+        tokens = [str(token) for token in request.get('tokens', [])]
+        with self.__lock:
+            if request.get('action') == 'subscribe':
+                client.tokens.update(tokens)
+            elif request.get('action') == 'unsubscribe':
+                client.tokens.difference_update(tokens)
+
+    def __close(self, client: _FeedClient):
+        with self.__lock:
+            if client in self.__clients:
+                self.__clients.remove(client)
+        # noinspection PyBroadException
+        try:
+            client.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        client.sock.close()
@@ -7,6 +7,7 @@ import dataclasses
 from copy import copy, deepcopy
 
 from .api import InstrumentsAPI
+from .exceptions import RequestFailedException
 from .datatype.instrument import Instrument, Segment, OptionType
 
 logger = logging.getLogger(__name__)
@@ -96,7 +97,7 @@ class InstrumentsClient:
             logger.exception("Failed to decode response from API")
             raise Exception("Failed to update contract map")
 
-        except requests.exceptions.RequestException as exc:
+        except (requests.exceptions.RequestException, RequestFailedException):
             logger.exception("Failed to fetch contract map from API")
             raise Exception("Failed to update contract map")
 
@@ -0,0 +1,181 @@
+from typing import Dict
+import threading
+import datetime
+import logging
+import shutil
+import json
+import os
+
+from .constant.order import TERMINAL_ORDER_STATUSES
+from .entity.order import Order
+from .utils import is_older
+
+logger = logging.getLogger(__name__)
+
+
+class OrderJournal:
+
+    def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024, fsync: bool = False):
+        """
+        Append-only local journal of order updates (one JSON line per update), to restore the orders state
+        on restart without reloading every order of the group tag.
+
+        The journal is compacted to the latest update of each order when it grows by more than `max_bytes`
+        since the last compaction. Compaction runs in a background thread, appends are not blocked meanwhile:
+        they go to a new file, merged at the end of the compaction.
+        If the compacted journal still takes more than half of `max_bytes`, the completed, rejected and canceled
+        orders with the oldest updates are dropped, they will be fetched again from the API on restart.
+
+        :param path: path of the journal file
+        :param max_bytes: max size (bytes) of the journal before compaction
+        :param fsync: flush every update to disk (slower, survives an OS crash)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+
+        # journal being compacted, the updates appended meanwhile going to a new file at `path`
+        self.__compacting_path = f'{path}.compacting'
+
+        self.__lock = threading.Lock()
+        # a single compaction at a time
+        self.__compaction_lock = threading.Lock()
+        self.__file = None
+        self.__compaction_running = False
+        # size of the journal from which it is compacted again
+        self.__compact_at = max_bytes
+
+    def append(self, order: Order) -> None:
+        line = json.dumps(order.dump(), default=str) + '\n'
+
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, 'a', encoding='utf-8')
+
+            self.__file.write(line)
+            self.__file.flush()
+            if self.fsync:
+                os.fsync(self.__file.fileno())
+
+            if self.__file.tell() > self.__compact_at and not self.__compaction_running:
+                self.__compaction_running = True
+                threading.Thread(
+                    target=self.__compact_in_background, name='openbroker-journal-compaction', daemon=True
+                ).start()
+
+    def replay(self) -> Dict[str, Order]:
+        """ The latest update of each order in the journal, by order id """
+        with self.__lock:
+            # the journal being compacted holds the oldest updates, if any
+            return self.__read(self.__compacting_path, self.path)
+
+    def compact(self) -> None:
+        """ Rewrite the journal keeping only the latest update of each order, in the calling thread """
+        with self.__compaction_lock:
+            self.__compact()
+
+    def clear(self) -> None:
+        with self.__compaction_lock, self.__lock:
+            self.__close()
+            for path in (self.__compacting_path, self.path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.__compact_at = self.max_bytes
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__close()
+
+    def __close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    @staticmethod
+    def __read(*paths: str) -> Dict[str, Order]:
+        """ The latest update of each order in the journal files, read in order """
+        orders: Dict[str, Order] = {}
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    # noinspection PyBroadException
+                    try:
+                        order = Order.load(json.loads(line))
+                    except Exception:
+                        # i.e. a line truncated by a crash while writing
+                        logger.warning(f'Skipping unreadable line {line_number} of order journal {path}')
+                        continue
+
+                    key = str(order.order_id)
+                    if key not in orders or not is_older(order.updated_at, orders[key].updated_at):
+                        orders[key] = order
+        return orders
+
+    def __compact_in_background(self):
+        # noinspection PyBroadException
+        try:
+            with self.__compaction_lock:
+                self.__compact()
+        except Exception:
+            logger.exception(f'Failed to compact order journal {self.path}')
+        finally:
+            with self.__lock:
+                self.__compaction_running = False
+
+    def __compact(self):
+        # must be called with the compaction lock held. The appends are blocked only while swapping the files
+        with self.__lock:
+            self.__close()
+            if os.path.exists(self.path):
+                if os.path.exists(self.__compacting_path):
+                    # left by an interrupted compaction: compacted together
+                    _append_file(self.path, self.__compacting_path)
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.__compacting_path)
+            if not os.path.exists(self.__compacting_path):
+                return
+
+        # orders without update time first
+        orders = sorted(
+            self.__read(self.__compacting_path).values(),
+            key=lambda order: (order.updated_at is not None, order.updated_at or datetime.datetime.min)
+        )
+        lines = [json.dumps(order.dump(), default=str) + '\n' for order in orders]
+
+        # drop the oldest terminal orders, if the latest updates alone exceed the budget
+        size = sum(len(line.encode()) for line in lines)
+        dropped = set()
+        for i, order in enumerate(orders):
+            if size <= self.max_bytes // 2:
+                break
+            if order.status in TERMINAL_ORDER_STATUSES:
+                size -= len(lines[i].encode())
+                dropped.add(i)
+
+        # write and rename, to never leave a truncated journal behind
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(line for i, line in enumerate(lines) if i not in dropped)
+
+        with self.__lock:
+            self.__close()
+            # the updates appended during the compaction are newer
+            if os.path.exists(self.path):
+                _append_file(self.path, tmp_path)
+            with open(tmp_path, 'a', encoding='utf-8') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            os.remove(self.__compacting_path)
+            self.__compact_at = os.path.getsize(self.path) + self.max_bytes
+
+        logger.info(f'Compacted order journal {self.path}: {len(orders) - len(dropped)} orders, '
+                    f'{len(dropped)} terminal orders dropped')
+
+
+def _append_file(src_path: str, dst_path: str):
+    with open(src_path, 'rb') as src, open(dst_path, 'ab') as dst:
+        shutil.copyfileobj(src, dst)
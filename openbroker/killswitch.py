@@ -0,0 +1,120 @@
+from typing import Collection, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+from dataclasses import dataclass, field
+
+from .constant.order import PositionType, ProductType, TERMINAL_ORDER_STATUSES
+from .datatype.instrument import Instrument
+from .datatype.order import PlaceOrderRequestParams, PlaceResponse, MarketOrderParams
+from .entity.order import Order
+from .slicer import slice_quantity
+
+
+@dataclass
+class KillSwitchReport:
+    """
+    Dataclass representing the outcome of a kill switch.
+
+    Attributes:
+        canceled (list): Ids of the open orders canceled.
+        cancel_failed (list): Ids of the open orders whose cancel failed or was rejected.
+        square_offs (list): Place responses of the square-off orders placed.
+        square_off_failed (list): Square-off requests that failed or were rejected.
+        refreshed (bool): The orders were fetched from the API before, the websocket or the cache not being reliable.
+        timings (dict): Duration (seconds) of each phase: 'collect', 'broker <id>' for each broker, and 'total'.
+        errors (list): Errors of the failed requests.
+    """
+    canceled: List[Hashable] = field(default_factory=list)
+    cancel_failed: List[Hashable] = field(default_factory=list)
+    square_offs: List[PlaceResponse] = field(default_factory=list)
+    square_off_failed: List[PlaceOrderRequestParams] = field(default_factory=list)
+    refreshed: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def success(self) -> bool:
+        """ Every open order was canceled and every position was squared off """
+        return not (self.cancel_failed or self.square_off_failed or self.errors)
+
+
+def open_orders_by_broker(
+        orders: Iterable[Order],
+        broker_ids: Optional[Collection[str]] = None
+) -> Dict[str, List[Hashable]]:
+    """ Ids of the orders not completed, rejected or canceled, by broker id """
+    open_orders: Dict[str, List[Hashable]] = {}
+    for order in orders:
+        if order.status in TERMINAL_ORDER_STATUSES:
+            continue
+        if broker_ids is not None and order.broker_id not in broker_ids:
+            continue
+        open_orders.setdefault(order.broker_id, []).append(order.order_id)
+    return open_orders
+
+
+def square_off_requests(
+        orders: Iterable[Order],
+        broker_ids: Optional[Collection[str]] = None,
+        instruments: Optional[Mapping[str, Instrument]] = None,
+        user_tag: str = ''
+) -> Dict[str, List[PlaceOrderRequestParams]]:
+    """
+    Market orders flattening the net filled quantity of the orders, by broker id.
+    The remaining quantity of the orders still working and reducing a position is not squared off,
+    so that the position is not flipped if they fill, i.e. when their cancel failed.
+
+    :param orders: the orders of the positions
+    :param broker_ids: [Optional] only the positions of these brokers
+    :param instruments: [Optional] instruments by token, to split the orders above their freeze limit
+    :param user_tag: user tag of the square-off orders
+    :return: square-off requests by broker id
+    """
+    # net filled quantity, and remaining quantity of the working buy and sell orders,
+    # by broker, instrument and product type
+    net_quantities: Dict[Tuple[str, str, ProductType], int] = {}
+    working_quantities: Dict[Tuple[str, str, ProductType], Tuple[int, int]] = {}
+    symbols: Dict[str, str] = {}
+    for order in orders:
+        if broker_ids is not None and order.broker_id not in broker_ids:
+            continue
+        key = (order.broker_id, order.instrument_id, order.product_type)
+
+        if order.status not in TERMINAL_ORDER_STATUSES:
+            remaining = max(order.quantity - order.filled_quantity, 0)
+            working_buy, working_sell = working_quantities.get(key, (0, 0))
+            if order.side == PositionType.Buy:
+                working_quantities[key] = (working_buy + remaining, working_sell)
+            else:
+                working_quantities[key] = (working_buy, working_sell + remaining)
+
+        if not order.filled_quantity:
+            continue
+        quantity = order.filled_quantity if order.side == PositionType.Buy else -order.filled_quantity
+        net_quantities[key] = net_quantities.get(key, 0) + quantity
+        symbols[order.instrument_id] = order.symbol
+
+    requests: Dict[str, List[PlaceOrderRequestParams]] = {}
+    for key, net_quantity in net_quantities.items():
+        broker_id, instrument_id, product_type = key
+        working_buy, working_sell = working_quantities.get(key, (0, 0))
+        square_off_quantity = max(abs(net_quantity) - (working_sell if net_quantity > 0 else working_buy), 0)
+        if not square_off_quantity:
+            continue
+
+        quantities = [square_off_quantity]
+        instrument = instruments.get(instrument_id) if instruments is not None else None
+        if instrument is not None and square_off_quantity % instrument.lot_size == 0:
+            quantities = slice_quantity(square_off_quantity, instrument.lot_size, instrument.max_qty_in_order)
+
+        requests.setdefault(broker_id, []).extend(
+            PlaceOrderRequestParams(
+                instrument_id=instrument_id,
+                symbol=symbols[instrument_id],
+                product_type=product_type,
+                side=PositionType.Sell if net_quantity > 0 else PositionType.Buy,
+                quantity=quantity,
+                order_info=MarketOrderParams(),
+                user_tag=user_tag
+            )
+            for quantity in quantities
+        )
+    return requests
@@ -0,0 +1,173 @@
+from typing import Deque, Dict, Optional, Tuple, Union
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
+import threading
+import time
+import uuid
+
+from .constant.order import OrderStatus, OrderType, TERMINAL_ORDER_STATUSES
+from .entity.order import Order
+
+# lifecycle intervals summarized per broker and order type
+LIFECYCLE_INTERVALS = ('ack', 'first_update', 'open', 'completed')
+
+# max number of updates of orders not submitted yet kept, waiting for their place response
+MAX_EARLY_UPDATES = 1000
+
+
+@dataclass
+class OrderTimeline:
+    """
+    Dataclass representing the lifecycle timestamps of an order, as seen by the client.
+    Timestamps are `time.perf_counter()` values, None if the transition was not seen.
+    """
+    order_id: uuid.UUID
+    broker_id: str = ''
+    order_type: Union[OrderType, str] = ''
+    submitted_at: Optional[float] = None
+    acked_at: Optional[float] = None
+    first_update_at: Optional[float] = None
+    open_at: Optional[float] = None
+    completed_at: Optional[float] = None
+    terminal_status: Optional[OrderStatus] = None
+
+    def interval(self, transition: str) -> Optional[float]:
+        """ Time (seconds) from submission to the transition: 'ack', 'first_update', 'open' or 'completed' """
+        timestamp = getattr(self, f'{transition}_at' if transition != 'ack' else 'acked_at')
+        if self.submitted_at is None or timestamp is None:
+            return None
+        return timestamp - self.submitted_at
+
+
+class LifecycleTracker:
+
+    def __init__(self, max_orders: int = 10000, window: int = 1000):
+        """
+        Track the lifecycle of the orders placed by the client:
+        submission, place response (ack), first update, Open and Completed.
+
+        Only the orders registered by `on_submit` are tracked: updates of other orders (i.e. placed by other
+        clients) are ignored, except for the last `MAX_EARLY_UPDATES` ones, kept apart in case their place
+        response is still on its way.
+
+        Memory is bounded: the oldest timelines are dropped beyond `max_orders`, and the percentiles
+        are computed on the last `window` orders of each broker and order type.
+
+        :param max_orders: max number of order timelines kept
+        :param window: number of orders in the rolling percentile window
+        """
+        self.__max_orders = max_orders
+        self.__window = window
+
+        self.__lock = threading.Lock()
+        self.__timelines: "OrderedDict[str, OrderTimeline]" = OrderedDict()
+        # timelines of the orders updated before their place response, never evicting the tracked ones
+        self.__early: "OrderedDict[str, OrderTimeline]" = OrderedDict()
+        self.__recorded = set()
+        self.__samples: Dict[Tuple[str, str, str], Deque[float]] = {}
+
+    def on_submit(self, submitted_at: float, acked_at: float, broker_id: str, order_type: OrderType,
+                  order_id: uuid.UUID):
+        """ Record the submission and the place response of an order """
+        with self.__lock:
+            timeline = self.__early.pop(str(order_id), None)
+            if timeline is not None:
+                self.__track(timeline)
+            else:
+                timeline = self.__timeline(order_id)
+            timeline.broker_id = broker_id
+            timeline.order_type = order_type
+            timeline.submitted_at = submitted_at
+            timeline.acked_at = acked_at
+            self.__record(timeline)
+
+    def on_update(self, order: Order, received_at: Optional[float] = None):
+        """ Record the transitions of an order update """
+        received_at = received_at or time.perf_counter()
+
+        with self.__lock:
+            timeline = self.__timelines.get(str(order.order_id))
+            if timeline is None:
+                timeline = self.__early_timeline(order.order_id)
+            if not timeline.broker_id:
+                timeline.broker_id = order.broker_id
+
+            if timeline.first_update_at is None:
+                timeline.first_update_at = received_at
+
+            if order.status == OrderStatus.Open and timeline.open_at is None:
+                timeline.open_at = received_at
+
+            elif order.status in TERMINAL_ORDER_STATUSES and timeline.terminal_status is None:
+                timeline.terminal_status = OrderStatus(order.status)
+                if order.status == OrderStatus.Completed:
+                    timeline.completed_at = received_at
+
+            self.__record(timeline)
+
+    def timeline(self, order_id: uuid.UUID) -> Optional[OrderTimeline]:
+        """ A copy of the timeline of the order, None if not tracked """
+        with self.__lock:
+            timeline = self.__timelines.get(str(order_id))
+            return replace(timeline) if timeline is not None else None
+
+    def summary(self, percentiles=(50, 90, 99)) -> Dict[Tuple[str, str], Dict[str, Dict[str, float]]]:
+        """
+        Rolling percentiles (seconds) of each lifecycle interval, for each broker and order type.
+
+        :return: {(broker_id, order_type): {interval: {'count': n, 'p50': ..., ...}}}
+        """
+        with self.__lock:
+            samples = {key: sorted(values) for key, values in self.__samples.items()}
+
+        result = {}
+        for (broker_id, order_type, interval), values in samples.items():
+            stats = {'count': len(values)}
+            for q in percentiles:
+                stats[f'p{q}'] = values[min(len(values) - 1, int(q / 100 * len(values)))]
+            result.setdefault((broker_id, order_type), {})[interval] = stats
+        return result
+
+    def __timeline(self, order_id: uuid.UUID) -> OrderTimeline:
+        # must be called with the lock held
+        key = str(order_id)
+        timeline = self.__timelines.get(key)
+        if timeline is None:
+            timeline = OrderTimeline(order_id=order_id)
+            self.__track(timeline)
+        return timeline
+
+    def __track(self, timeline: OrderTimeline):
+        # must be called with the lock held
+        self.__timelines[str(timeline.order_id)] = timeline
+        while len(self.__timelines) > self.__max_orders:
+            evicted, _ = self.__timelines.popitem(last=False)
+            self.__recorded.difference_update({(evicted, i) for i in LIFECYCLE_INTERVALS})
+
+    def __early_timeline(self, order_id: uuid.UUID) -> OrderTimeline:
+        # must be called with the lock held
+        key = str(order_id)
+        timeline = self.__early.get(key)
+        if timeline is None:
+            timeline = self.__early[key] = OrderTimeline(order_id=order_id)
+            while len(self.__early) > MAX_EARLY_UPDATES:
+                self.__early.popitem(last=False)
+        return timeline
+
+    def __record(self, timeline: OrderTimeline):
+        # must be called with the lock held, adds the intervals available for the first time to the rolling windows
+        if timeline.submitted_at is None:
+            return
+
+        order_type = getattr(timeline.order_type, 'value', timeline.order_type)
+        for interval in LIFECYCLE_INTERVALS:
+            key = (str(timeline.order_id), interval)
+            value = timeline.interval(interval)
+            if value is None or key in self.__recorded:
+                continue
+
+            self.__recorded.add(key)
+            samples = self.__samples.get((timeline.broker_id, order_type, interval))
+            if samples is None:
+                samples = self.__samples[(timeline.broker_id, order_type, interval)] = deque(maxlen=self.__window)
+            samples.append(value)
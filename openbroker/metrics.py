@@ -0,0 +1,228 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# latency buckets (seconds), from 100us to 10s
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsHook:
+    """
+    Interface of the metrics and tracing hooks, called by the API clients for every REST request
+    and every websocket frame. This base implementation does nothing.
+
+    Callers check `enabled` before measuring anything, so a disabled hook has negligible overhead.
+    """
+    enabled = False
+
+    def on_request(
+            self,
+            endpoint: str,
+            method: str,
+            status: int,
+            latency: float,
+            request_bytes: int,
+            response_bytes: int
+    ) -> None:
+        """
+        Called after every REST request attempt.
+
+        :param endpoint: name of the endpoint
+        :param method: HTTP method
+        :param status: HTTP status code of the response, 0 if no response was received
+        :param latency: time (seconds) from sending the request to receiving the response
+        :param request_bytes: size of the request body
+        :param response_bytes: size of the response body
+        """
+
+    def on_ws_frame(
+            self,
+            url: str,
+            frame_bytes: int,
+            decode_time: float,
+            callback_time: float,
+            lag: Optional[float]
+    ) -> None:
+        """
+        Called after every websocket frame is processed.
+
+        :param url: url of the websocket
+        :param frame_bytes: size of the frame
+        :param decode_time: time (seconds) spent decoding the frame
+        :param callback_time: time (seconds) spent in the frame callback
+        :param lag: time (seconds) between the update on the server (`updated_at`) and its local receipt, if available
+        """
+
+
+NOOP_METRICS = MetricsHook()
+
+
+class Histogram:
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for the values above the highest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        """ Estimate of the q-th percentile (0-100), the upper bound of the bucket containing it """
+        if not self.count:
+            return 0.
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class InMemoryMetrics(MetricsHook):
+    """ Metrics hook aggregating latencies in histograms and sizes in counters, in memory """
+    enabled = True
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1., **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.) + value
+
+    def on_request(self, endpoint, method, status, latency, request_bytes, response_bytes):
+        self.observe('openbroker_http_request_duration_seconds', latency,
+                     endpoint=endpoint, method=method, status=str(status))
+        self.increment('openbroker_http_request_bytes_total', request_bytes, endpoint=endpoint)
+        self.increment('openbroker_http_response_bytes_total', response_bytes, endpoint=endpoint)
+
+    def on_ws_frame(self, url, frame_bytes, decode_time, callback_time, lag):
+        self.increment('openbroker_ws_frames_total', url=url)
+        self.increment('openbroker_ws_frame_bytes_total', frame_bytes, url=url)
+        self.observe('openbroker_ws_frame_decode_seconds', decode_time, url=url)
+        self.observe('openbroker_ws_frame_callback_seconds', callback_time, url=url)
+        if lag is not None:
+            self.observe('openbroker_ws_frame_lag_seconds', lag, url=url)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        """ The histogram of a metric, None if nothing was observed """
+        with self._lock:
+            return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0.)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Count, mean and percentiles of every histogram series, keyed by series name """
+        with self._lock:
+            histograms = list(self._histograms.items())
+
+        result = {}
+        for (name, labels), histogram in histograms:
+            result[_series_name(name, labels)] = {
+                'count': histogram.count,
+                'mean': histogram.sum / histogram.count if histogram.count else 0.,
+                'p50': histogram.percentile(50),
+                'p90': histogram.percentile(90),
+                'p99': histogram.percentile(99),
+            }
+        return result
+
+
+class PrometheusMetrics(InMemoryMetrics):
+    """ In-memory metrics hook exposing the metrics in the Prometheus text format """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(buckets)
+        self.__server: Optional[ThreadingHTTPServer] = None
+
+    def render(self) -> str:
+        """ The metrics in the Prometheus text exposition format """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(h.counts), h.count, h.sum, h.buckets) for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+
+        lines: List[str] = []
+        typed = set()
+
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{_series_name(name, labels)} {value}')
+
+        for (name, labels), counts, count, total, buckets in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{_series_name(name + "_bucket", labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{_series_name(name + "_bucket", labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{_series_name(name + "_sum", labels)} {total}')
+            lines.append(f'{_series_name(name + "_count", labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        """ Serve the metrics over HTTP for a Prometheus server to scrape, from a background thread """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        logger.info(f'Serving metrics on http://{host}:{self.__server.server_port}/metrics')
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server = None
+
+
+def _series_name(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    escaped = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return f'{name}{{{escaped}}}'
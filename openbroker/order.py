@@ -1,103 +1,633 @@
-from typing import Dict, List, Union, Callable, Optional
+from typing import Collection, Dict, Hashable, List, Mapping, Union, Callable, Optional, Set
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import replace
+import threading
+import itertools
+import secrets
 import time
 import uuid
 import logging
 
 from .api import OrdersAPI, WsAPI
+from .api.ws import WsHealth
+from .batching import PlaceOrderCoalescer, CoalescerStats, ModifyPipeline, ModifyPipelineStats
 from .config import Config
-from .datatype.order import PlaceOrderRequestParams, ModifyOrderRequestParams
+from .ratelimit import RequestScheduler, RateLimit, ThrottleStats, Priority
+from .retry import RetryPolicy, RequestStats, DEFAULT_RETRY_POLICIES
+from .datatype.order import PlaceOrderRequestParams, ModifyOrderRequestParams, ORDER_PARAMS_TYPE
 from .datatype.order import PlaceResponse, ModifyResponse, CancelResponse
+from .datatype.instrument import Instrument
 from .entity.broker import BrokerConnection
-from .entity.order import Order
+from .entity.order import Order, OrderChangeEvent
+from .cache import OrderCache, OrderCacheStats
+from .constant.order import OrderStatus, TERMINAL_ORDER_STATUSES
+from .exceptions import RequestFailedException
+from .journal import OrderJournal
+from .killswitch import KillSwitchReport, open_orders_by_broker, square_off_requests
+from .lifecycle import LifecycleTracker
+from .positions import PositionsEngine
+from .prefilter import FramePreFilter
+from .reconcile import OrderReconciler, ReconcilerStats
+from .relay import OrderUpdateRelay, RelaySubscriber
+from .risk import RiskEngine
 from .session import UserSession
+from .slicer import SlicedOrder, slice_order
+from .utils import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# tag key carrying the client generated idempotency key of an order, when place retries are enabled
+IDEMPOTENCY_TAG_KEY = 'idempotency_key'
+
 
 class OrdersClient:
 
-    def __init__(self, user_session: UserSession, orders_group_tag: str = '', order_update_callback: Optional[Callable] = None) -> None:
+    def __init__(
+            self,
+            user_session: UserSession,
+            orders_group_tag: str = '',
+            order_update_callback: Optional[Callable] = None,
+            journal: Optional[OrderJournal] = None,
+            order_cache: Optional[OrderCache] = None
+    ) -> None:
         if len(orders_group_tag) > 32:
             raise ValueError('Order API supports max 32 characters in user tag')
 
         self.__user_session = user_session
         self.__user_tag = orders_group_tag
-        self.__order_update_callback = order_update_callback
+        self.__journal = journal
 
         self.__orders_api = OrdersAPI(user_session=self.__user_session)
 
-        self.__orders_dict: Dict[uuid.UUID, Order] = {}
-        self.__ws_connection: Union[WsAPI, None] = None
+        # an empty cache is falsy
+        self.__orders = order_cache if order_cache is not None else OrderCache()
+        self.__ws_connection: Union[WsAPI, RelaySubscriber, None] = None
+        self.__relay: Union[OrderUpdateRelay, None] = None
+        self.__connect_timings: Dict[str, float] = {}
+        self.__place_coalescer: Union[PlaceOrderCoalescer, None] = None
+        self.__modify_pipeline: Union[ModifyPipeline, None] = None
+        self.__lifecycle = LifecycleTracker()
+        self.__positions = PositionsEngine(ignored_tag_keys=(IDEMPOTENCY_TAG_KEY,))
+        # the state derived from an order is dropped with the order, chaining the callback of a provided cache
+        self.__eviction_callback = self.__orders.eviction_callback
+        self.__orders.eviction_callback = self.__on_order_evicted
+        self.__reconciler: Union[OrderReconciler, None] = None
+        self.__risk_engine: Union[RiskEngine, None] = None
+        self.__subscribers_lock = threading.Lock()
+        # change subscribers by status, None for every status
+        self.__subscribers: Dict[Union[OrderStatus, None], tuple] = {}
+        if order_update_callback is not None:
+            # a change subscriber called with the whole order, notified of the changes only
+            self.subscribe(lambda event: order_update_callback(event.order))
+        # sliced parent orders by the order id of their children, until every child is terminal
+        self.__sliced_children: Dict[Hashable, SlicedOrder] = {}
+        # frames of other group tags are dropped before being decoded
+        self.__frame_filter: Union[FramePreFilter, None] = None
+        if orders_group_tag:
+            self.__frame_filter = FramePreFilter(user_tag=orders_group_tag)
+
+    @property
+    def all_orders(self) -> Mapping[uuid.UUID, Order]:
+        """
+        Read-only snapshot of all the orders in memory, by order id.
+        The snapshot is consistent and is not changed by later updates: read the property again to see them.
+        """
+        return self.__orders.snapshot()
+
+    @property
+    def order_cache_stats(self) -> OrderCacheStats:
+        """ Counters of the order cache (size, hits, evictions). """
+        return self.__orders.stats
+
+    @property
+    def place_coalescer_stats(self) -> Union[CoalescerStats, None]:
+        """ Counters of the place orders coalescer, None if coalescing is not enabled. """
+        if self.__place_coalescer is None:
+            return None
+        return self.__place_coalescer.stats
+
+    def enable_place_coalescing(self, window: float = 0.002, max_batch_size: int = 10) -> None:
+        """
+        Merge concurrent `place_orders` calls for the same broker into a single API call.
+
+        Useful when several threads place 1-2 orders each at the same time.
+        Each call waits at most `window` seconds for other calls to join the batch,
+        trading a small queueing delay for fewer API round trips.
+
+        :param window: max time (seconds) to wait for other calls before sending a batch
+        :param max_batch_size: max number of orders sent in a single call (up to 10)
+        :return: None
+        """
+        self.__place_coalescer = PlaceOrderCoalescer(
+            send_func=lambda broker_id, order_list: self.__send_place_request(broker_id, order_list),
+            window=window,
+            max_batch_size=max_batch_size
+        )
+
+    def disable_place_coalescing(self) -> None:
+        """ Send every `place_orders` call as its own API call (default behaviour). """
+        self.__place_coalescer = None
+
+    @property
+    def modify_pipeline_stats(self) -> Union[ModifyPipelineStats, None]:
+        """ Counters of the modify pipeline (coalesced modifies, latency), None if the pipeline is not enabled. """
+        if self.__modify_pipeline is None:
+            return None
+        return self.__modify_pipeline.stats
+
+    def enable_modify_pipeline(self, max_concurrent_batches: int = 2) -> None:
+        """
+        Start the modify pipeline used by `submit_modify`.
+
+        The pipeline keeps at most one modify in flight per order. Newer modifies replace the pending ones
+        of the same order instead of being queued, and pending modifies of different orders are sent
+        together in batches of 10 orders.
+
+        :param max_concurrent_batches: max number of modify API calls in flight
+        :return: None
+        """
+        if self.__modify_pipeline is not None:
+            self.__modify_pipeline.stop()
+
+        self.__modify_pipeline = ModifyPipeline(
+            send_func=lambda order_list: self.__orders_api.modify_orders(
+                order_list=order_list,
+                broker_ids=self.__broker_ids(request.order_id for request in order_list)
+            ),
+            max_concurrent_batches=max_concurrent_batches
+        )
+
+    def submit_modify(self, request: ModifyOrderRequestParams) -> Future:
+        """
+        Queue a modify request in the modify pipeline, without waiting for the API response.
+        If a modify for the same order is still waiting to be sent, it is replaced by this request.
+
+        :param request: the modify request
+        :return: a Future resolving to the ModifyResponse of the order
+        """
+        if self.__modify_pipeline is None:
+            raise Exception('Modify pipeline not enabled. Please call enable_modify_pipeline() method.')
+
+        response_future = Future()
+
+        def on_done(future: Future):
+            if future.exception() is not None:
+                response_future.set_exception(future.exception())
+                return
+            # exceptions raised in a done callback are only logged: the caller would wait forever
+            try:
+                response_future.set_result(ModifyResponse.load(future.result()))
+            except Exception as exc:
+                response_future.set_exception(exc)
+
+        self.__modify_pipeline.submit(request).add_done_callback(on_done)
+        return response_future
+
+    @property
+    def rate_limit_stats(self) -> Dict[str, ThrottleStats]:
+        """ Throttling counters (requests, throttled requests, wait times) for each endpoint of the Orders API. """
+        scheduler = self.__orders_api.scheduler
+        if scheduler is None:
+            return {}
+        return scheduler.stats
+
+    def set_rate_limits(
+            self,
+            endpoint_limits: Dict[str, RateLimit],
+            broker_limit: Optional[RateLimit] = None
+    ) -> None:
+        """
+        Throttle the requests to the Orders API on the client side, smoothing bursts instead of failing them.
+        Requests exceeding the limits wait for their turn, cancels and high priority orders first.
+
+        Endpoint names: 'place', 'modify', 'cancel', 'today-orders', 'order', 'orders-by-user-tag'.
+
+        :param endpoint_limits: rate limit for each endpoint (i.e. {'place': RateLimit(rate=10, burst=10)})
+        :param broker_limit: [Optional] rate limit applied to the requests of each broker, across all endpoints
+        :return: None
+        """
+        self.__orders_api.scheduler = RequestScheduler(endpoint_limits=endpoint_limits, broker_limit=broker_limit)
 
     @property
-    def all_orders(self):
-        """ Dictionary representing all orders. """
-        # TODO: should probably return a RO view (deepcopy) of the dict
-        return self.__orders_dict
+    def request_stats(self) -> Dict[str, RequestStats]:
+        """ Counters (requests, retries, failures, latency) for each endpoint of the Orders API. """
+        return self.__orders_api.request_stats
+
+    def set_retry_policies(self, retry_policies: Optional[Dict[str, RetryPolicy]] = None) -> None:
+        """
+        Automatically retry the failed requests to the Orders API.
+
+        Failed place requests are resent only when it is safe: every order is tagged with a client generated
+        idempotency key (in `tags`), and after an ambiguous failure (i.e. read timeout) the orders already
+        received by the server are looked up by their key, and only the missing ones are resubmitted.
+        When place retries are enabled, orders support max 2 tags.
+
+        Endpoint names: 'place', 'modify', 'cancel', 'today-orders', 'order', 'orders-by-user-tag'.
 
-    def __update_order(self, new_update: Order) -> None:
-        order_id = new_update.order_id
+        :param retry_policies: [Optional] retry policy for each endpoint, `DEFAULT_RETRY_POLICIES` if not provided.\
+        Endpoints not listed are not retried.
+        :return: None
+        """
+        if retry_policies is None:
+            retry_policies = DEFAULT_RETRY_POLICIES
+        self.__orders_api.retry_policies = dict(retry_policies)
 
-        update_dict = True
-        if order_id in self.__orders_dict:
-            old_update = self.__orders_dict[order_id]
-            update_dict = new_update.updated_at >= old_update.updated_at
+    @property
+    def lifecycle(self) -> LifecycleTracker:
+        """
+        Lifecycle latencies of the orders placed by the client (place response, first update, Open, Completed),
+        as per-order timelines and rolling percentiles for each broker and order type.
+        Updates are timed when received from the websocket or the relay: the orders fetched from the API
+        (i.e. by `get_order` or the reconciler) are not recorded.
+        """
+        return self.__lifecycle
 
-        if update_dict:
-            self.__orders_dict[order_id] = new_update
+    def track_lifecycle(self, max_orders: int = 10000, window: int = 1000) -> None:
+        """
+        Reset the lifecycle tracker with new memory bounds.
 
-    def __update_order_callback(self, order_update: dict) -> None:
+        :param max_orders: max number of order timelines kept
+        :param window: number of orders in the rolling percentile window of each broker and order type
+        :return: None
+        """
+        self.__lifecycle = LifecycleTracker(max_orders=max_orders, window=window)
+
+    @property
+    def positions(self) -> PositionsEngine:
+        """
+        Net positions and P&L of the filled orders, per instrument and per tag, updated from every order update.
+        Read them with `positions.snapshot()` or `positions.tag_snapshot(tag)`.
+        """
+        return self.__positions
+
+    @property
+    def reconciler_stats(self) -> Union[ReconcilerStats, None]:
+        """ Counters of the order reconciler (runs, repaired orders, current interval), None if not started. """
+        if self.__reconciler is None:
+            return None
+        return self.__reconciler.stats
+
+    def start_reconciler(self, min_interval: float = 1., max_interval: float = 60.) -> None:
+        """
+        Start a background task that periodically fetches the orders (tagged orders, or today's orders if
+        no group tag is set) and repairs the ones missed by the websocket, through the same update path.
+
+        It polls every `min_interval` seconds while there are open orders, and backs off up to `max_interval`
+        seconds while every order is completed, rejected or canceled. Placing orders resets the interval.
+
+        :param min_interval: interval (seconds) between fetches while there are open orders
+        :param max_interval: max interval (seconds) between fetches
+        :return: None
+        """
+        if self.__reconciler is not None:
+            self.__reconciler.stop()
+
+        self.__reconciler = OrderReconciler(
+            fetch_func=self.__fetch_orders_to_reconcile,
+            outdated_func=self.__orders.is_outdated,
+            repair_func=self.__update_order_callback,
+            min_interval=min_interval,
+            max_interval=max_interval
+        )
+        self.__reconciler.start()
+
+    def __fetch_orders_to_reconcile(self) -> List[Dict]:
+        if self.__user_tag:
+            return self.__orders_api.get_order_by_user_tag(user_tag=self.__user_tag)
+        return self.__orders_api.get_todays_orders()
+
+    @property
+    def risk_engine(self) -> Union[RiskEngine, None]:
+        """ The pre-trade risk engine checking the placed orders, None if not set. """
+        return self.__risk_engine
+
+    def set_risk_engine(self, risk_engine: Optional[RiskEngine]) -> None:
+        """
+        Check every order placed with `place_orders` (and `place_sliced_order`) against the rules of a risk engine,
+        rejected orders raising `RiskCheckFailedException` before any API call. The counters of the engine are
+        seeded from the orders in memory, then maintained from every order update. Seed and attach are atomic
+        with the order updates: an update is applied to the engine either by the seed or afterwards, exactly once.
+
+        The kill switch bypasses the engine: square-offs are never blocked.
+
+        :param risk_engine: the risk engine, None to disable the checks
+        :return: None
+        """
+        def attach(orders: Mapping[Hashable, Order]):
+            if risk_engine is not None:
+                risk_engine.load(orders.values())
+            self.__risk_engine = risk_engine
+
+        self.__orders.with_snapshot(attach)
+
+    @property
+    def frame_filter(self) -> Union[FramePreFilter, None]:
+        """ The pre-filter of the websocket frames, with its counters, None if disabled. """
+        return self.__frame_filter
+
+    def set_frame_filter(
+            self,
+            order_ids: Optional[Collection[str]] = None,
+            statuses: Optional[Collection[OrderStatus]] = None,
+            enabled: bool = True
+    ) -> None:
+        """
+        Configure the pre-filter dropping the websocket frames not of interest before they are decoded.
+        By default, it is enabled when a group tag is set and drops the updates of other tags.
+
+        Filtering by order ids or statuses drops the other updates entirely: the orders state is not updated
+        and the update callback is not called for them.
+
+        :param order_ids: [Optional] accept only the updates of these orders, ids as strings.\
+        The collection is not copied, so it can be updated while the filter is in use.
+        :param statuses: [Optional] accept only the updates with these statuses
+        :param enabled: False to decode every frame
+        :return: None
+        """
+        if enabled and (self.__user_tag or order_ids is not None or statuses is not None):
+            self.__frame_filter = FramePreFilter(user_tag=self.__user_tag, order_ids=order_ids, statuses=statuses)
+        else:
+            self.__frame_filter = None
+
+        if self.__ws_connection is not None:
+            self.__ws_connection.frame_filter = self.__frame_filter
+
+    def __broker_ids(self, order_ids) -> set:
+        """ Brokers of the orders available in memory, used to apply the per-broker rate limits """
+        return {
+            self.__orders.peek(order_id).broker_id for order_id in order_ids if order_id in self.__orders
+        }
+
+    def __update_order(self, new_update: Order, received_at: Optional[float] = None) -> Optional[OrderChangeEvent]:
+        """ Store the order update, returning its changes, None if the update is outdated or a duplicate """
+        # compare and store atomically, updates are applied by the ws thread and by the API callers.
+        # Positions and risk counters are updated with the store lock held, in the same order as the updates are stored
+        update_dict, old_update = self.__orders.put_if_newer(new_update, on_stored=self.__on_order_stored)
+        if not update_dict:
+            return None
+
+        if received_at is not None:
+            # only pushed updates time the lifecycle, not the orders polled or repaired
+            self.__lifecycle.on_update(new_update, received_at)
+
+        if self.__journal is not None:
+            self.__journal.append(new_update)
+
+        sliced_order = self.__sliced_children.get(new_update.order_id)
+        if sliced_order is not None:
+            self.__on_child_update(sliced_order, new_update)
+
+        return OrderChangeEvent.diff(old_update, new_update)
+
+    def __on_order_stored(self, order: Order, _previous: Optional[Order]) -> None:
+        self.__positions.on_update(order)
+        risk_engine = self.__risk_engine
+        if risk_engine is not None:
+            risk_engine.on_update(order)
+
+    def __on_order_evicted(self, order: Order) -> None:
+        self.__positions.forget(order.order_id)
+        if self.__eviction_callback is not None:
+            self.__eviction_callback(order)
+
+    def __on_ws_update(self, order_update: dict) -> None:
+        self.__update_order_callback(order_update, time.perf_counter())
+
+    def __update_order_callback(self, order_update: dict, received_at: Optional[float] = None) -> None:
         # noinspection PyBroadException
         try:
             if self.__user_tag and order_update.get('user_tag') != self.__user_tag:
                 return
             
             new_update = Order.load(order_update)
-            self.__update_order(new_update)
+            event = self.__update_order(new_update, received_at)
+            if event is None:
+                return
 
-            if self.__order_update_callback:
-                self.__order_update_callback(new_update)
+            self.__notify_subscribers(event)
 
         except Exception:
             logger.exception(f"Error in processing ws callback payload: {order_update}")
 
+    def subscribe(
+            self,
+            callback: Callable[[OrderChangeEvent], None],
+            statuses: Optional[Collection[OrderStatus]] = None
+    ) -> Callable[[OrderChangeEvent], None]:
+        """
+        Call `callback` with an `OrderChangeEvent` (old and new status, filled quantity delta and price,
+        modified params) for every change of an order received from the websocket or the reconciler.
+        Duplicate and outdated updates are not notified.
+
+        :param callback: the function to call, from the websocket thread
+        :param statuses: [Optional] notify only the changes of the orders with these statuses (after the update).\
+        Use `event.status_changed` to tell status transitions from other changes, i.e. partial fills.
+        :return: the callback, to be passed to `unsubscribe`
+        """
+        with self.__subscribers_lock:
+            keys = [None] if statuses is None else [OrderStatus(status) for status in statuses]
+            for key in keys:
+                # copy on write: the websocket thread iterates the subscribers without a lock
+                self.__subscribers[key] = self.__subscribers.get(key, ()) + (callback,)
+        return callback
+
+    def unsubscribe(self, callback: Callable[[OrderChangeEvent], None]) -> None:
+        with self.__subscribers_lock:
+            for key, callbacks in list(self.__subscribers.items()):
+                self.__subscribers[key] = tuple(cb for cb in callbacks if cb is not callback)
+
+    def __notify_subscribers(self, event: OrderChangeEvent) -> None:
+        subscribers = self.__subscribers
+        for callback in subscribers.get(None, ()) + subscribers.get(event.status, ()):
+            # noinspection PyBroadException
+            try:
+                callback(event)
+            except Exception:
+                logger.exception(f"Error in order change subscriber {callback} for order {event.order_id}")
+
+    def __fetch_all_orders(self, priority: Priority = Priority.Normal) -> Dict[Hashable, Order]:
+        """ Fetch the orders of the group tag, or all today's orders if no group tag, and apply them """
+        if self.__user_tag:
+            order_dicts = self.__orders_api.get_order_by_user_tag(user_tag=self.__user_tag, priority=priority, fresh=True)
+        else:
+            order_dicts = self.__orders_api.get_todays_orders(priority=priority, fresh=True)
+
+        orders = {}
+        for order_dict in order_dicts:
+            order = Order.load(order_dict)
+            self.__update_order(order)
+            orders[order.order_id] = order
+        return orders
+
     def __fetch_tagged_orders(self) -> None:
         if not self.__user_tag:
             return
 
         response = self.__orders_api.get_order_by_user_tag(user_tag=self.__user_tag)
         for order_dict in response:
+            # skip the orders already up to date, i.e. restored from the journal
+            if self.__orders.is_outdated(order_dict['order_id'], parse_timestamp(order_dict.get('updated_at'))):
+                continue
             self.__update_order(Order.load(order_dict))
 
-    def connect(self, ws_update=True, fetch_prev_orders=True):
+    def __replay_journal(self) -> None:
+        for order in self.__journal.replay().values():
+            if order.user_tag != self.__user_tag:
+                continue
+            # never overwrite a newer update, i.e. received by a websocket already connected
+            self.__orders.put_if_newer(order, on_stored=self.__on_order_stored)
+
+    @property
+    def connect_timings(self) -> Dict[str, float]:
+        """ Duration (seconds) of each phase of the last `connect` call: 'journal', 'tagged_orders' and 'websocket'. """
+        return dict(self.__connect_timings)
+
+    def connect(
+            self,
+            ws_update=True,
+            fetch_prev_orders=True,
+            ws_timeout: float = 10.,
+            ws_ping_interval: Optional[float] = 10.,
+            ws_stall_timeout: Optional[float] = 30.,
+            relay_path: Optional[str] = None
+    ):
         """
         Establish a connection to the Orders API Update Websocket, and fetches previous orders, if required.
+        The websocket handshake runs in the background while the previous orders are fetched.
+        If a journal and a group tag are set, the previous orders are restored from the journal first, before the
+        websocket starts, and only the orders updated since are loaded from the API response. Without a group tag
+        the journal is not replayed: previous orders are not fetched, so the journaled ones would never be corrected.
 
         :param ws_update: If websocket should be enabled for orders update
         :param fetch_prev_orders: If previous orders placed with the same orders_group_tag are to be fetched
+        :param ws_timeout: max time (seconds) to wait for the websocket handshake.\
+        If it expires the websocket keeps connecting in the background.
+        :param ws_ping_interval: interval (seconds) between websocket pings, measuring the round trip time.\
+        None to disable the pings.
+        :param ws_stall_timeout: max time (seconds) without websocket frames or pongs, after which the connection\
+        is considered stalled and is opened again. Until then, `get_order` does not trust the orders in memory.\
+        None to disable the stall detection.
+        :param relay_path: [Optional] path of the Unix socket of an order update relay started by another process\
+        with `start_relay`. The updates of the group tag are received from the relay instead of the websocket.
         :return: None
         """
+        self.__connect_timings = {}
+        started_at = time.perf_counter()
 
-        if fetch_prev_orders:
-            self.__fetch_tagged_orders()
+        # restored before the websocket starts, so that the journal never overwrites its updates
+        if fetch_prev_orders and self.__journal is not None and self.__user_tag:
+            self.__replay_journal()
+            self.__connect_timings['journal'] = time.perf_counter() - started_at
 
-        if ws_update:
+        if ws_update and relay_path is not None:
+            self.__ws_connection = RelaySubscriber(
+                relay_path,
+                callback_func=self.__on_ws_update,
+                user_tag=self.__user_tag,
+                stall_timeout=ws_stall_timeout,
+                connect_callback=self.__on_ws_connect
+            )
+            self.__ws_connection.frame_filter = self.__frame_filter
+            self.__ws_connection.start()
+        elif ws_update:
             self.__ws_connection = WsAPI(
                 user_session=self.__user_session,
                 ws_url=Config.ws_url,
-                callback_func=self.__update_order_callback
+                callback_func=self.__on_ws_update,
+                frame_filter=self.__frame_filter,
+                ping_interval=ws_ping_interval,
+                stall_timeout=ws_stall_timeout,
+                connect_callback=self.__on_ws_connect,
+                frame_hook=self.__relay.publish if self.__relay is not None else None
             )
             self.__ws_connection.start()
-            time.sleep(1)
+
+        if fetch_prev_orders:
+            self.__fetch_tagged_orders()
+            self.__connect_timings['tagged_orders'] = time.perf_counter() - started_at
+
+        if ws_update:
+            if not self.__ws_connection.wait_connected(ws_timeout):
+                logger.warning(f'Websocket not connected after {ws_timeout}s, still connecting in the background')
+            self.__connect_timings['websocket'] = time.perf_counter() - started_at
     
+    @property
+    def ws_health(self) -> Union[WsHealth, None]:
+        """ Liveness of the order updates websocket (ping RTT, update lag, silence, reconnects), None if not enabled. """
+        if self.__ws_connection is None:
+            return None
+        return self.__ws_connection.health
+
+    def start_relay(self, path: str, heartbeat_interval: float = 1., mode: int = 0o600) -> OrderUpdateRelay:
+        """
+        Relay the order updates websocket of this client to the other processes of the host, over a Unix socket.
+        The other processes connect with `connect(relay_path=path)` and receive only the updates of their group tag,
+        without opening their own websocket. The frames of every tag are relayed, whatever the group tag of this client.
+
+        :param path: path of the Unix socket
+        :param heartbeat_interval: interval (seconds) between the heartbeats sent while the websocket is healthy,\
+        subscribers consider the relay stalled after their stall timeout without frames or heartbeats
+        :param mode: permissions of the Unix socket, only the user running this process can connect by default
+        :return: the relay, with the number of subscribers
+        :raises OSError: if another relay is listening on the path
+        """
+        if self.__relay is not None:
+            raise RuntimeError(f'Order updates already relayed on {self.__relay.path}')
+        if isinstance(self.__ws_connection, RelaySubscriber):
+            raise RuntimeError('Order updates received from a relay cannot be relayed')
+
+        self.__relay = OrderUpdateRelay(
+            path,
+            heartbeat_interval=heartbeat_interval,
+            mode=mode,
+            health_func=lambda: self.__ws_connection is not None and self.__ws_connection.is_healthy
+        )
+        self.__relay.start()
+        if self.__ws_connection is not None:
+            self.__ws_connection.frame_hook = self.__relay.publish
+        return self.__relay
+
+    def __on_ws_connect(self):
+        # updates may have been missed while disconnected
+        if self.__reconciler is not None:
+            self.__reconciler.wake()
+
     def close(self):
         if self.__ws_connection is not None:
             self.__ws_connection.stop()
+
+        if self.__relay is not None:
+            self.__relay.stop()
+            self.__relay = None
+
+        if self.__modify_pipeline is not None:
+            self.__modify_pipeline.stop()
+            self.__modify_pipeline = None
+
+        if self.__reconciler is not None:
+            self.__reconciler.stop()
+            self.__reconciler = None
+
+        if self.__journal is not None:
+            self.__journal.close()
+
+        self.__orders.close()
     
+    def cached_order(self, order_id: uuid.UUID) -> Union[Order, None]:
+        """
+        The order in memory, as last updated, without API requests
+
+        :param order_id: UUID of the order
+        :return: the order, None if not in memory
+        """
+        return self.__orders.get(order_id)
+
     def get_order(self, order_id: uuid.UUID, force_fetch=False) -> Order:
         """
         Fetch the order object associated with the order_id.
         If the order is not available and updated in memory, it is fetched via API request.
+        Completed, rejected and canceled orders are final: they are served from memory, or from the
+        spill store of the order cache once evicted, even if the websocket is not active.
         Specifying force_fetch=True will always fetch the order via API request.
 
         :param order_id: UUID of the order
@@ -108,16 +638,12 @@ class OrdersClient:
 
         # fetch the order if explicitly requested or if:
         #   - the order is not in the cache
-        #   - the order updates websocket is not active
-        force_fetch = (
-                force_fetch
-                or order_id not in self.__orders_dict
-                or self.__ws_connection is None
-                or not self.__ws_connection.is_connected
-        )
-
+        #   - the order is not terminal and the order updates websocket is not healthy (disconnected or stalled)
         if not force_fetch:
-            return self.__orders_dict[order_id]
+            order = self.__orders.get(order_id)
+            ws_active = self.__ws_connection is not None and self.__ws_connection.is_healthy
+            if order is not None and (ws_active or order.status in TERMINAL_ORDER_STATUSES):
+                return order
 
         response = self.__orders_api.get_order(order_id=order_id)
         order = Order.load(response)
@@ -129,7 +655,8 @@ class OrdersClient:
     def place_orders(
             self,
             broker_connection: BrokerConnection,
-            order_list: List[PlaceOrderRequestParams]
+            order_list: List[PlaceOrderRequestParams],
+            priority: Priority = Priority.Normal
     ) -> List[PlaceResponse]:
         """
         Place orders in a single API call.
@@ -138,13 +665,140 @@ class OrdersClient:
 
         :param broker_connection: the broker the orders are to be placed with
         :param order_list: list of place orders requests
+        :param priority: priority of the request when rate limits are set. Exits and square-offs should use\
+        `Priority.High` to be sent ahead of new entries, bypassing the place coalescer if enabled.
         :return: list of PlaceResponse objects for each order placed (sorting is maintained)
+        :raises RiskCheckFailedException: if a risk engine is set and rejects an order, no order is placed
         """
         
         assert 0 < len(order_list) <= 10
         assert broker_connection.logged_in
 
+        order_list = self.__prepare_place_requests(order_list)
+
+        risk_engine = self.__risk_engine
+        reservations = risk_engine.check(order_list) if risk_engine is not None else None
+
+        submitted_at = time.perf_counter()
+        coalescer = self.__place_coalescer
+        try:
+            if coalescer is not None and priority >= Priority.Normal:
+                response = coalescer.submit(broker_connection.id, order_list)
+            else:
+                response = self.__send_place_request(broker_connection.id, order_list, priority)
+        except Exception:
+            if risk_engine is not None:
+                risk_engine.release(reservations)
+            raise
+        acked_at = time.perf_counter()
+
+        if self.__reconciler is not None:
+            self.__reconciler.wake()
+
+        place_responses = [PlaceResponse.load(data) for data in response]
+        if risk_engine is not None:
+            risk_engine.on_placed(reservations, place_responses)
+        for order, place_response in zip(order_list, place_responses):
+            if place_response.success and place_response.order_id:
+                self.__lifecycle.on_submit(
+                    submitted_at=submitted_at,
+                    acked_at=acked_at,
+                    broker_id=broker_connection.id,
+                    order_type=ORDER_PARAMS_TYPE[type(order.order_info)],
+                    order_id=place_response.order_id
+                )
+        return place_responses
+
+    def place_sliced_order(
+            self,
+            broker_connection: BrokerConnection,
+            request: PlaceOrderRequestParams,
+            instrument: Instrument,
+            priority: Priority = Priority.Normal,
+            max_concurrent_batches: int = 4
+    ) -> SlicedOrder:
+        """
+        Place an order of any size, split into lot-aligned child orders within the `max_qty_in_order` freeze limit
+        of the instrument. The children are placed in batches of 10 orders, sent concurrently, and the call returns
+        once every batch is acknowledged, so that large exits are sent in a single call.
+
+        The returned parent aggregates the fills of the children from their updates (filled quantity, average price),
+        and `wait` blocks until every child is completed, rejected or canceled.
+        If some batches fail, the parent holds the children placed and the errors of the failed batches.
+
+        :param broker_connection: the broker the orders are to be placed with
+        :param request: the parent place request, its quantity must be a multiple of the lot size
+        :param instrument: the instrument of the order, i.e. found with `InstrumentsClient.find_instrument`
+        :param priority: priority of the requests when rate limits are set, exits should use `Priority.High`
+        :param max_concurrent_batches: max number of place API calls in flight
+        :return: the parent order
+        """
+        if request.instrument_id != instrument.token:
+            raise ValueError(f'Instrument {instrument.token} does not match the order instrument {request.instrument_id}')
+
+        sliced_order = SlicedOrder(request, slice_order(request, instrument))
+        child_requests = sliced_order.child_requests
+        batches = [(index, child_requests[index:index + 10]) for index in range(0, len(child_requests), 10)]
+
+        def place_batch(index: int, batch: List[PlaceOrderRequestParams]):
+            # noinspection PyBroadException
+            try:
+                responses = self.place_orders(broker_connection, batch, priority)
+            except Exception as exc:
+                logger.exception(f'Failed to place {len(batch)} child orders of {request.symbol}')
+                sliced_order.on_failed(exc)
+                return
+            self.__track_children(sliced_order, index, responses)
+
+        if len(batches) == 1:
+            place_batch(*batches[0])
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=min(max_concurrent_batches, len(batches)), thread_name_prefix='openbroker-slicer'
+            ) as executor:
+                for index, batch in batches:
+                    executor.submit(place_batch, index, batch)
+
+        sliced_order.on_placing_done()
+        if not sliced_order.child_order_ids and sliced_order.errors:
+            raise sliced_order.errors[0]
+        return sliced_order
+
+    def __track_children(self, sliced_order: SlicedOrder, index: int, responses: List[PlaceResponse]):
+        sliced_order.on_placed(index, responses)
+        for response in responses:
+            if response.success and response.order_id:
+                self.__sliced_children[response.order_id] = sliced_order
+                # the first updates may have been applied before the place response
+                order = self.__orders.get(response.order_id)
+                if order is not None:
+                    self.__on_child_update(sliced_order, order)
+
+    def __on_child_update(self, sliced_order: SlicedOrder, order: Order):
+        sliced_order.on_child_update(order)
+        if order.status in TERMINAL_ORDER_STATUSES:
+            self.__sliced_children.pop(order.order_id, None)
+
+    def __prepare_place_requests(self, order_list: List[PlaceOrderRequestParams]) -> List[PlaceOrderRequestParams]:
+        """
+        Validate the tags of the requests and set the group tag, returning the requests to send.
+        When place retries are enabled, the requests sent are copies carrying their own idempotency key:
+        the tags of the caller are not changed, and may be shared by several requests.
+        """
+        idempotent_retries = self.__place_retries_enabled()
+        prepared = []
         for order in order_list:
+            if self.__user_tag:
+                order.user_tag = self.__user_tag
+
+            if idempotent_retries:
+                # a new key on every call, the same request may be intentionally placed more than once
+                tags = {key: value for key, value in order.tags.items() if key != IDEMPOTENCY_TAG_KEY}
+                if len(tags) > 2:
+                    raise ValueError('Order API supports max 2 tags when place retries are enabled')
+                tags[IDEMPOTENCY_TAG_KEY] = secrets.token_hex(12)
+                order = replace(order, tags=tags)
+
             if len(order.tags) > 3:
                 raise ValueError('Order API supports max 3 tags')
             
@@ -153,40 +807,293 @@ class OrdersClient:
                     raise ValueError('Order API supports max 20 characters in tag key')
                 if len(value) > 30:
                     raise ValueError('Order API supports max 30 characters in tag value')
-            
-            if self.__user_tag:
-                order.user_tag = self.__user_tag
 
-        response = self.__orders_api.place_orders(broker_id=broker_connection.id, order_list=order_list)
-        return [PlaceResponse.load(data) for data in response]
+            prepared.append(order)
+        return prepared
+
+    def kill_switch(
+            self,
+            broker_ids: Optional[Collection[str]] = None,
+            square_off: bool = True,
+            refresh: Optional[bool] = None,
+            instruments: Optional[Mapping[str, Instrument]] = None,
+            max_workers: int = 16
+    ) -> KillSwitchReport:
+        """
+        Cancel every open order and square off every position of the orders of this client, across brokers,
+        as fast as possible. The brokers are handled concurrently, with `Priority.Critical`, ahead of any queued request.
+        The cancels are sent first (10 orders per call, concurrently), then the square-off market orders
+        (10 per call), once all the cancels are acknowledged: an open order filled while its cancel is in flight
+        would otherwise flip the position. The brokers without open orders are squared off right away.
+
+        Open orders and net positions (by broker, instrument and product type) are collected from the orders in memory.
+        If the websocket is not healthy or terminal orders were evicted from the order cache, the orders are
+        fetched from the API first, so that it works even if the websocket is down.
+        After the cancels, the orders are fetched from the API again, once for all the brokers, and the net positions
+        are recomputed from their final fills. The remaining quantity of the orders still working (i.e. whose cancel failed)
+        and reducing a position is not squared off: check the report and the positions.
+
+        :param broker_ids: [Optional] only the orders of these brokers, all by default
+        :param square_off: False to cancel the open orders only
+        :param refresh: [Optional] True to fetch the orders from the API first, False to use the orders in memory only.\
+        By default, they are fetched only when the websocket is not healthy or the order cache evicted orders.
+        :param instruments: [Optional] instruments by token, to split the square-off orders above the freeze limit
+        :param max_workers: max number of API calls in flight
+        :return: the report of the canceled orders and square-offs, with the timings
+        """
+        started_at = time.perf_counter()
+        report = KillSwitchReport()
+
+        if refresh is None:
+            ws_healthy = self.__ws_connection is not None and self.__ws_connection.is_healthy
+            refresh = not ws_healthy or self.__orders.stats.evictions > 0
+
+        orders: Dict[Hashable, Order] = dict(self.__orders.snapshot())
+        if refresh:
+            # noinspection PyBroadException
+            try:
+                orders.update(self.__fetch_all_orders(Priority.Critical))
+                report.refreshed = True
+            except Exception as exc:
+                logger.exception('Kill switch failed to fetch the orders, using the orders in memory')
+                report.errors.append(f'Failed to fetch the orders: {exc}')
+
+        open_orders = open_orders_by_broker(orders.values(), broker_ids)
+        report.timings['collect'] = time.perf_counter() - started_at
+
+        lock = threading.Lock()
+        futures: List[Future] = []
+        # number of cancel calls in flight, the positions of the brokers canceled are squared off after the last one
+        cancels_in_flight = sum((len(order_ids) + 9) // 10 for order_ids in open_orders.values())
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='openbroker-kill-switch')
+
+        def submit(func: Callable, *args):
+            with lock:
+                futures.append(executor.submit(func, *args))
+
+        def cancel(broker_id: str, order_ids: List[Hashable]):
+            nonlocal cancels_in_flight
+            try:
+                # noinspection PyBroadException
+                try:
+                    response = self.__orders_api.cancel_orders(
+                        order_ids=set(order_ids), broker_ids=(broker_id,), priority=Priority.Critical
+                    )
+                    errors = []
+                except Exception as exc:
+                    response, errors = {}, [f'Failed to cancel {len(order_ids)} orders of broker {broker_id}: {exc}']
+
+                with lock:
+                    for order_id in order_ids:
+                        cancel_response = response.get(order_id)
+                        # noinspection PyBroadException
+                        try:
+                            success = cancel_response is not None and CancelResponse.load(cancel_response).success
+                        except Exception as exc:
+                            success = False
+                            errors.append(f'Invalid cancel response of order {order_id} of broker {broker_id}: {exc}')
+                        if success:
+                            report.canceled.append(order_id)
+                        else:
+                            report.cancel_failed.append(order_id)
+                    report.errors.extend(errors)
+                    report.timings[f'broker {broker_id}'] = time.perf_counter() - started_at
+            finally:
+                with lock:
+                    cancels_in_flight -= 1
+                    cancels_done = not cancels_in_flight
+
+            if cancels_done and square_off:
+                square_off_after_cancels()
+
+        def square_off_after_cancels():
+            # the final fills of the orders canceled may not have been received yet
+            final_orders = dict(orders)
+            final_orders.update(self.__orders.snapshot())
+            # noinspection PyBroadException
+            try:
+                final_orders.update(self.__fetch_all_orders(Priority.Critical))
+            except Exception as exc:
+                logger.exception('Kill switch failed to fetch the orders after the cancels, '
+                                 'squaring off from the orders in memory')
+                with lock:
+                    report.errors.append(f'Failed to fetch the orders after the cancels: {exc}')
+
+            for broker_id in open_orders:
+                square_off_broker(broker_id, final_orders)
+
+        def square_off_broker(broker_id: str, broker_orders: Mapping[Hashable, Order]):
+            requests = square_off_requests(broker_orders.values(), (broker_id,), instruments, self.__user_tag)
+            requests = self.__prepare_place_requests(requests.get(broker_id, []))
+            for index in range(0, len(requests), 10):
+                submit(place, broker_id, requests[index:index + 10])
+
+        def place(broker_id: str, requests: List[PlaceOrderRequestParams]):
+            # noinspection PyBroadException
+            try:
+                responses = [
+                    PlaceResponse.load(data) for data in self.__send_place_request(broker_id, requests, Priority.Critical)
+                ]
+                errors = []
+            except Exception as exc:
+                responses, errors = [], [f'Failed to square off {len(requests)} positions of broker {broker_id}: {exc}']
+
+            with lock:
+                for request, response in itertools.zip_longest(requests, responses[:len(requests)]):
+                    if response is not None and response.success:
+                        report.square_offs.append(response)
+                    else:
+                        report.square_off_failed.append(request)
+                report.errors.extend(errors)
+                report.timings[f'broker {broker_id}'] = time.perf_counter() - started_at
+
+        try:
+            for broker_id, order_ids in open_orders.items():
+                for index in range(0, len(order_ids), 10):
+                    submit(cancel, broker_id, order_ids[index:index + 10])
+            if square_off:
+                # the brokers without open orders are squared off right away
+                broker_positions = {
+                    order.broker_id for order in orders.values()
+                    if order.filled_quantity and (broker_ids is None or order.broker_id in broker_ids)
+                }
+                for broker_id in broker_positions.difference(open_orders):
+                    square_off_broker(broker_id, orders)
+
+            # the square-offs of the brokers canceled are submitted by the last cancel
+            while True:
+                with lock:
+                    pending = [future for future in futures if not future.done()]
+                if not pending:
+                    break
+                wait(pending)
+        finally:
+            executor.shutdown(wait=True)
+
+        if self.__reconciler is not None:
+            self.__reconciler.wake()
+
+        report.timings['total'] = time.perf_counter() - started_at
+        logger.warning(
+            f"Kill switch: {len(report.canceled)} orders canceled, {len(report.cancel_failed)} cancels failed, "
+            f"{len(report.square_offs)} positions squared off, {len(report.square_off_failed)} square-offs failed "
+            f"in {report.timings['total']:.3f}s"
+        )
+        return report
+
+    def __place_retries_enabled(self) -> bool:
+        policy = self.__orders_api.retry_policies.get('place')
+        return policy is not None and policy.max_attempts > 1
+
+    def __send_place_request(
+            self,
+            broker_id: str,
+            order_list: List[PlaceOrderRequestParams],
+            priority: Priority = Priority.Normal
+    ) -> List[Dict]:
+        if not self.__place_retries_enabled():
+            return self.__orders_api.place_orders(broker_id=broker_id, order_list=order_list, priority=priority)
+
+        policy = self.__orders_api.retry_policies['place']
+        responses: Dict[str, Dict] = {}
+        pending = list(order_list)
+
+        attempt = 0
+        while pending:
+            attempt += 1
+            try:
+                response = self.__orders_api.place_orders(broker_id=broker_id, order_list=pending, priority=priority)
+
+            except RequestFailedException as exc:
+                if not exc.ambiguous or attempt >= policy.max_attempts:
+                    raise
+
+                # the orders may have reached the server: resubmit only the ones not found
+                time.sleep(policy.delay(attempt))
+                try:
+                    responses.update(self.__find_placed_orders({order.tags[IDEMPOTENCY_TAG_KEY] for order in pending}))
+                except Exception:
+                    logger.exception('Failed to look up the orders of an ambiguous place request')
+                    raise exc
+
+                pending = [order for order in pending if order.tags[IDEMPOTENCY_TAG_KEY] not in responses]
+                logger.warning(f'Place request failed (attempt {attempt}/{policy.max_attempts}): {exc}. '
+                               f'Orders found on the server: {len(order_list) - len(pending)}, '
+                               f'resubmitting: {len(pending)}')
+                continue
+
+            for order, order_response in zip(pending, response):
+                responses[order.tags[IDEMPOTENCY_TAG_KEY]] = order_response
+            pending = []
+
+        return [responses[order.tags[IDEMPOTENCY_TAG_KEY]] for order in order_list]
+
+    def __find_placed_orders(self, idempotency_keys: Set[str]) -> Dict[str, Dict]:
+        """ Look up the orders tagged with the idempotency keys, returning a place response for each order found """
+        # never from the response cache: a stale response would resubmit orders already placed
+        if self.__user_tag:
+            orders = self.__orders_api.get_order_by_user_tag(user_tag=self.__user_tag, fresh=True)
+        else:
+            orders = self.__orders_api.get_todays_orders(fresh=True)
+
+        found = {}
+        for order_dict in orders:
+            extra_tags = order_dict.get('extra_tags') or {}
+            key = extra_tags.get(IDEMPOTENCY_TAG_KEY)
+            if key in idempotency_keys:
+                found[key] = {
+                    'success': True,
+                    'order_id': order_dict['order_id'],
+                    'user_tag': order_dict.get('user_tag', ''),
+                    'extra_tags': extra_tags
+                }
+        return found
     
-    def modify_orders(self, order_list: List[ModifyOrderRequestParams]) -> Dict[uuid.UUID, ModifyResponse]:
+    def modify_orders(
+            self,
+            order_list: List[ModifyOrderRequestParams],
+            priority: Priority = Priority.Normal
+    ) -> Dict[uuid.UUID, ModifyResponse]:
         """
         Modify orders in a single API call.
 
         The API supports modifying up to 10 orders in a single call.
 
         :param order_list: list of modify requests
+        :param priority: priority of the request when rate limits are set
         :return: dictionary of order_id: ModifyResponse pairs for each order
         """
         assert 0 < len(order_list) <= 10
 
-        response = self.__orders_api.modify_orders(order_list=order_list)
+        response = self.__orders_api.modify_orders(
+            order_list=order_list,
+            broker_ids=self.__broker_ids(request.order_id for request in order_list),
+            priority=priority
+        )
         return {
             order_id: ModifyResponse.load(modify_response) for order_id, modify_response in response.items()
         }
 
-    def cancel_orders(self, order_list: List[uuid.UUID]) -> Dict[uuid.UUID, CancelResponse]:
+    def cancel_orders(
+            self,
+            order_list: List[uuid.UUID],
+            priority: Priority = Priority.High
+    ) -> Dict[uuid.UUID, CancelResponse]:
         """
         Cancel orders in a single API call.
 
         :param order_list: list of order ids to be cancelled
+        :param priority: priority of the request when rate limits are set, cancels jump ahead of new entries by default
         :return: dictionary of order_id: CancelResponse pairs for each order
         """
 
         assert 0 < len(order_list) <= 10
 
-        response = self.__orders_api.cancel_orders(order_ids=set(order_list))
+        response = self.__orders_api.cancel_orders(
+            order_ids=set(order_list),
+            broker_ids=self.__broker_ids(order_list),
+            priority=priority
+        )
         return {
             order_id: CancelResponse.load(cancel_response) for order_id, cancel_response in response.items()
         }
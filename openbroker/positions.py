@@ -0,0 +1,173 @@
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+import threading
+
+from .constant.order import PositionType
+from .entity.order import Order
+
+
+@dataclass(frozen=True)
+class Position:
+    """
+    Dataclass representing the net position of an instrument. Instances are immutable snapshots.
+
+    Attributes:
+        instrument_id (str): The instrument id of the position.
+        symbol (str): The symbol of the instrument.
+        net_quantity (int): Net filled quantity, positive if long, negative if short.
+        average_price (float): Average cost of the open quantity, 0 if flat.
+        realized_pnl (float): P&L of the closed quantity.
+        bought_quantity (int): Total filled quantity of the buy orders.
+        sold_quantity (int): Total filled quantity of the sell orders.
+    """
+    instrument_id: str
+    symbol: str = ''
+    net_quantity: int = 0
+    average_price: float = 0.
+    realized_pnl: float = 0.
+    bought_quantity: int = 0
+    sold_quantity: int = 0
+
+    def unrealized_pnl(self, price: float) -> float:
+        """ P&L of the open quantity at the given price """
+        return self.net_quantity * (price - self.average_price)
+
+    def total_pnl(self, price: float) -> float:
+        return self.realized_pnl + self.unrealized_pnl(price)
+
+    def fill(self, quantity: int, price: float) -> "Position":
+        """ The position after a fill of `quantity` (negative if sold) at `price` """
+        net = self.net_quantity
+        average_price = self.average_price
+        realized_pnl = self.realized_pnl
+
+        if net == 0 or (net > 0) == (quantity > 0):
+            # opening or increasing the position
+            average_price = (abs(net) * average_price + abs(quantity) * price) / (abs(net) + abs(quantity))
+        else:
+            # reducing, closing or reversing the position
+            closed = min(abs(quantity), abs(net))
+            realized_pnl += closed * (price - average_price) * (1 if net > 0 else -1)
+            if abs(quantity) > abs(net):
+                average_price = price
+            elif abs(quantity) == abs(net):
+                average_price = 0.
+
+        return replace(
+            self,
+            net_quantity=net + quantity,
+            average_price=average_price,
+            realized_pnl=realized_pnl,
+            bought_quantity=self.bought_quantity + max(quantity, 0),
+            sold_quantity=self.sold_quantity - min(quantity, 0)
+        )
+
+
+class PositionsEngine:
+
+    def __init__(self, ignored_tag_keys: Iterable[str] = ()):
+        """
+        Net positions and P&L, per instrument and per tag, updated incrementally from the fills of the order updates.
+
+        Each update is applied in O(1): only the fill delta since the previous update of the order is applied,
+        at the price implied by the change of its average price, so partial fills are handled correctly.
+        The filled quantity of an order never decreases: outdated and repeated updates are ignored.
+        The fill state of an order is kept until `forget` is called, i.e. when the order is evicted from memory.
+        Snapshots are immutable mappings of immutable positions, rebuilt only after a change.
+
+        :param ignored_tag_keys: keys of the order tags not to aggregate positions for (i.e. idempotency keys)
+        """
+        self.__ignored_tag_keys = frozenset(ignored_tag_keys)
+
+        self.__lock = threading.Lock()
+        # last (filled quantity, average price) of the orders, until forgotten
+        self.__fills: Dict[str, Tuple[int, float]] = {}
+        self.__positions: Dict[str, Position] = {}
+        self.__tag_positions: Dict[str, Dict[str, Position]] = {}
+
+        self.__snapshot: Optional[Mapping[str, Position]] = None
+        self.__tag_snapshots: Dict[str, Mapping[str, Position]] = {}
+
+    def on_update(self, order: Order) -> None:
+        """ Apply the fill delta of an order update """
+        key = str(order.order_id)
+
+        with self.__lock:
+            filled, average_price = self.__fills.get(key, (0, 0.))
+            delta = order.filled_quantity - filled
+            if delta <= 0:
+                return
+            self.__fills[key] = (order.filled_quantity, order.average_price)
+
+            price = (order.filled_quantity * order.average_price - filled * average_price) / delta
+            quantity = delta if order.side == PositionType.Buy else -delta
+
+            self.__positions[order.instrument_id] = self.__fill(
+                self.__positions, order, quantity, price
+            )
+            self.__snapshot = None
+
+            for tag in self.__tags(order):
+                positions = self.__tag_positions.setdefault(tag, {})
+                positions[order.instrument_id] = self.__fill(positions, order, quantity, price)
+                self.__tag_snapshots.pop(tag, None)
+
+    def forget(self, order_id) -> None:
+        """ Drop the fill state of an order no longer updated, i.e. evicted from the order cache """
+        with self.__lock:
+            self.__fills.pop(str(order_id), None)
+
+    def snapshot(self) -> Mapping[str, Position]:
+        """ Read-only mapping of the positions of every instrument, by instrument id """
+        snapshot = self.__snapshot
+        if snapshot is None:
+            with self.__lock:
+                snapshot = self.__snapshot = MappingProxyType(dict(self.__positions))
+        return snapshot
+
+    def tag_snapshot(self, tag: str) -> Mapping[str, Position]:
+        """ Read-only mapping of the positions of the orders with the tag (user tag or tag value), by instrument id """
+        snapshot = self.__tag_snapshots.get(tag)
+        if snapshot is None:
+            with self.__lock:
+                snapshot = self.__tag_snapshots[tag] = MappingProxyType(dict(self.__tag_positions.get(tag, {})))
+        return snapshot
+
+    @property
+    def tags(self) -> Tuple[str, ...]:
+        with self.__lock:
+            return tuple(self.__tag_positions)
+
+    def unrealized_pnl(self, prices: Dict[str, float], tag: Optional[str] = None) -> float:
+        """
+        Total P&L of the open positions at the given prices
+
+        :param prices: price of each instrument, by instrument id. Positions without a price are skipped.
+        :param tag: [Optional] only the positions of the orders with the tag
+        """
+        positions = self.snapshot() if tag is None else self.tag_snapshot(tag)
+        return sum(
+            position.unrealized_pnl(prices[instrument_id])
+            for instrument_id, position in positions.items() if instrument_id in prices
+        )
+
+    def realized_pnl(self, tag: Optional[str] = None) -> float:
+        positions = self.snapshot() if tag is None else self.tag_snapshot(tag)
+        return sum(position.realized_pnl for position in positions.values())
+
+    def __tags(self, order: Order) -> set:
+        tags = {
+            tag_value for tag_key, tag_value in (order.extra_tags or {}).items()
+            if tag_value and tag_key not in self.__ignored_tag_keys
+        }
+        if order.user_tag:
+            tags.add(order.user_tag)
+        return tags
+
+    @staticmethod
+    def __fill(positions: Dict[str, Position], order: Order, quantity: int, price: float) -> Position:
+        position = positions.get(order.instrument_id)
+        if position is None:
+            position = Position(instrument_id=order.instrument_id, symbol=order.symbol)
+        return position.fill(quantity, price)
@@ -0,0 +1,77 @@
+from typing import Collection, Optional, Union
+from dataclasses import dataclass, replace
+import re
+
+
+@dataclass
+class FrameFilterStats:
+    """ Counters of the websocket frame pre-filter """
+    checked: int = 0
+    rejected: int = 0
+
+
+def _field_pattern(name: str) -> "re.Pattern":
+    # string value of the field, escapes included: the value is compared only if it has none
+    return re.compile(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(name))
+
+
+_USER_TAG_PATTERN = _field_pattern('user_tag')
+_ORDER_ID_PATTERN = _field_pattern('order_id')
+_STATUS_PATTERN = _field_pattern('status')
+
+
+class FramePreFilter:
+
+    def __init__(
+            self,
+            user_tag: str = '',
+            order_ids: Optional[Collection[str]] = None,
+            statuses: Optional[Collection[str]] = None
+    ):
+        """
+        Filter of the raw websocket frames, rejecting the order updates not of interest before they are decoded.
+
+        The fields are matched with regular expressions on the raw frame. The filter is conservative:
+        a frame is rejected only if the field is present and none of its occurrences match,
+        frames it cannot decide on (missing field, escaped characters, binary frames) are accepted.
+
+        :param user_tag: [Optional] accept only the updates of orders with this user tag
+        :param order_ids: [Optional] accept only the updates of these orders, ids as strings. The collection is not copied,\
+        so it can be updated while the filter is in use (i.e. a set of the ids of the open orders).
+        :param statuses: [Optional] accept only the updates with these statuses
+        """
+        self.user_tag = user_tag
+        self.order_ids = order_ids
+        self.statuses = None if statuses is None else {getattr(status, 'value', status) for status in statuses}
+        self.__stats = FrameFilterStats()
+
+    @property
+    def stats(self) -> FrameFilterStats:
+        return replace(self.__stats)
+
+    def __call__(self, message: Union[str, bytes]) -> bool:
+        """ True if the frame is to be decoded, False if it can be dropped """
+        if not isinstance(message, str):
+            return True
+
+        self.__stats.checked += 1
+        if self.user_tag and not _matches(_USER_TAG_PATTERN, message, (self.user_tag,)):
+            self.__stats.rejected += 1
+            return False
+        if self.order_ids is not None and not _matches(_ORDER_ID_PATTERN, message, self.order_ids):
+            self.__stats.rejected += 1
+            return False
+        if self.statuses is not None and not _matches(_STATUS_PATTERN, message, self.statuses):
+            self.__stats.rejected += 1
+            return False
+        return True
+
+
+def _matches(pattern: "re.Pattern", message: str, accepted: Collection[str]) -> bool:
+    """ False only if the field is present and none of its values is accepted """
+    found = False
+    for value in pattern.findall(message):
+        if '\\' in value or value in accepted:
+            return True
+        found = True
+    return not found
@@ -0,0 +1,175 @@
+from typing import Dict, Iterable, List, Optional
+from dataclasses import dataclass, replace
+import itertools
+import threading
+import logging
+import enum
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """
+    Enum representing the scheduling priority of a request. Lower values are served first.
+    """
+    Critical = 0
+    High = 1
+    Normal = 2
+    Low = 3
+
+
+@dataclass
+class RateLimit:
+    """ Dataclass representing a token bucket limit: `rate` requests per second, with bursts up to `burst` requests """
+    rate: float
+    burst: int = 1
+
+
+@dataclass
+class ThrottleStats:
+    """ Counters of the requests scheduled for an endpoint """
+    requests: int = 0
+    throttled: int = 0
+    total_wait: float = 0.
+    max_wait: float = 0.
+
+    @property
+    def avg_wait(self) -> float:
+        """ Average time (seconds) a request waited for a token """
+        return self.total_wait / self.requests if self.requests else 0.
+
+
+class TokenBucket:
+
+    def __init__(self, limit: RateLimit):
+        if limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f'Invalid rate limit {limit}')
+
+        self.rate = limit.rate
+        self.capacity = float(limit.burst)
+        self.tokens = float(limit.burst)
+        self.__updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+    def time_until_available(self) -> float:
+        """ Time (seconds) until a token is available, as of the last refill """
+        return max(0., (1. - self.tokens) / self.rate)
+
+
+class _Waiter:
+
+    def __init__(self, priority: Priority, seq: int, buckets: List[TokenBucket]):
+        self.key = (priority, seq)
+        self.buckets = buckets
+
+
+class RequestScheduler:
+
+    def __init__(self, endpoint_limits: Dict[str, RateLimit], broker_limit: Optional[RateLimit] = None):
+        """
+        Client-side token bucket scheduler for API requests.
+
+        A request consumes a token from the bucket of its endpoint and from the bucket of each broker it targets.
+        When no token is available the request waits instead of failing, and waiting requests are served
+        by priority first and arrival order second, so urgent requests (i.e. cancels) jump ahead of new entries.
+
+        :param endpoint_limits: rate limit for each endpoint name (i.e. {'place': RateLimit(10, 10)}).\
+        Endpoints not listed are not limited.
+        :param broker_limit: [Optional] rate limit applied to each broker, across all its endpoints
+        """
+        self.__endpoint_buckets = {endpoint: TokenBucket(limit) for endpoint, limit in endpoint_limits.items()}
+        self.__broker_limit = broker_limit
+        self.__broker_buckets: Dict[str, TokenBucket] = {}
+
+        self.__cond = threading.Condition()
+        self.__waiters: List[_Waiter] = []
+        self.__seq = itertools.count()
+        self.__stats: Dict[str, ThrottleStats] = {}
+
+    @property
+    def stats(self) -> Dict[str, ThrottleStats]:
+        """ A snapshot of the throttling counters for each endpoint """
+        with self.__cond:
+            return {endpoint: replace(stats) for endpoint, stats in self.__stats.items()}
+
+    def __buckets(self, endpoint: str, broker_ids: Iterable[str]) -> List[TokenBucket]:
+        # must be called with the lock held
+        buckets = []
+        if endpoint in self.__endpoint_buckets:
+            buckets.append(self.__endpoint_buckets[endpoint])
+
+        if self.__broker_limit is not None:
+            for broker_id in set(broker_ids):
+                if broker_id not in self.__broker_buckets:
+                    self.__broker_buckets[broker_id] = TokenBucket(self.__broker_limit)
+                buckets.append(self.__broker_buckets[broker_id])
+
+        return buckets
+
+    def __blocked_by_others(self, waiter: _Waiter) -> bool:
+        # a waiter must let the earlier or more urgent waiters sharing any of its buckets go first
+        for other in self.__waiters:
+            if other.key < waiter.key and any(bucket in waiter.buckets for bucket in other.buckets):
+                return True
+        return False
+
+    def acquire(self, endpoint: str, broker_ids: Iterable[str] = (), priority: Priority = Priority.Normal) -> float:
+        """
+        Block until the request may be sent.
+
+        :param endpoint: name of the endpoint requested
+        :param broker_ids: ids of the brokers targeted by the request
+        :param priority: scheduling priority of the request
+        :return: time (seconds) spent waiting
+        """
+        started_at = time.monotonic()
+
+        with self.__cond:
+            buckets = self.__buckets(endpoint, broker_ids)
+            waiter = _Waiter(priority, next(self.__seq), buckets)
+            self.__waiters.append(waiter)
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    for bucket in buckets:
+                        bucket.refill(now)
+
+                    if self.__blocked_by_others(waiter):
+                        # woken up as soon as a request ahead is served
+                        self.__cond.wait()
+                        continue
+
+                    timeout = max((bucket.time_until_available() for bucket in buckets), default=0.)
+                    if timeout <= 0:
+                        break
+                    self.__cond.wait(timeout)
+
+                for bucket in buckets:
+                    bucket.tokens -= 1.
+            finally:
+                self.__waiters.remove(waiter)
+                self.__cond.notify_all()
+
+            wait_time = time.monotonic() - started_at
+            self.__record(endpoint, wait_time)
+
+        if wait_time > 0.001:
+            logger.debug(f'Request to {endpoint} throttled for {wait_time:.3f}s (priority {priority.name})')
+        return wait_time
+
+    def __record(self, endpoint: str, wait_time: float):
+        # must be called with the lock held
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            stats = self.__stats[endpoint] = ThrottleStats()
+
+        stats.requests += 1
+        stats.total_wait += wait_time
+        stats.max_wait = max(stats.max_wait, wait_time)
+        if wait_time > 0.001:
+            stats.throttled += 1
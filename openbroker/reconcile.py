@@ -0,0 +1,142 @@
+from typing import Callable, Dict, List, Optional
+from dataclasses import dataclass, replace
+import threading
+import datetime
+import logging
+import time
+
+from .constant.order import TERMINAL_ORDER_STATUSES
+from .utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReconcilerStats:
+    """ Counters of the order reconciler """
+    runs: int = 0
+    repaired: int = 0
+    failures: int = 0
+    interval: float = 0.
+    last_run_at: Optional[float] = None
+
+
+class OrderReconciler:
+
+    def __init__(
+            self,
+            fetch_func: Callable[[], List[Dict]],
+            outdated_func: Callable[[str, Optional[datetime.datetime]], bool],
+            repair_func: Callable[[Dict], None],
+            min_interval: float = 1.,
+            max_interval: float = 60.,
+            backoff: float = 2.
+    ):
+        """
+        Background task pulling the orders from the API and repairing the ones the websocket missed.
+
+        The fetched orders are compared by `updated_at` with the known ones, including the ones evicted from memory,
+        and the new or newer ones are passed to `repair_func`. The interval is `min_interval` while there are open orders or after a repair,
+        and grows by `backoff` up to `max_interval` while every order is terminal.
+
+        :param fetch_func: function fetching the order dicts, i.e. the tagged orders
+        :param outdated_func: function returning True if an update of an order (order id, update time)\
+        is not newer than the known one, i.e. `OrderCache.is_outdated`
+        :param repair_func: function applying a fetched order dict, through the same path as the websocket updates
+        :param min_interval: interval (seconds) between fetches while there are open orders
+        :param max_interval: max interval (seconds) between fetches
+        :param backoff: factor the interval grows by after each fetch without open orders
+        """
+        self.__fetch_func = fetch_func
+        self.__outdated_func = outdated_func
+        self.__repair_func = repair_func
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.__lock = threading.Lock()
+        self.__stats = ReconcilerStats(interval=min_interval)
+        self.__thread: Optional[threading.Thread] = None
+        self.__stop_event = threading.Event()
+        self.__wake_event = threading.Event()
+        self.__last_run = 0.
+
+    @property
+    def stats(self) -> ReconcilerStats:
+        """ A snapshot of the reconciler counters """
+        with self.__lock:
+            return replace(self.__stats)
+
+    def start(self):
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, name='openbroker-reconciler', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__wake_event.set()
+
+    def wake(self):
+        """ Reconcile now and reset the interval, i.e. after placing orders or reconnecting the websocket """
+        with self.__lock:
+            self.__stats.interval = self.min_interval
+        self.__wake_event.set()
+
+    def reconcile(self) -> int:
+        """
+        Fetch the orders once and repair the missing or outdated ones
+
+        :return: number of orders repaired
+        """
+        order_dicts = self.__fetch_func()
+
+        repaired = 0
+        has_open_orders = False
+        for order_dict in order_dicts:
+            if order_dict['status'] not in TERMINAL_ORDER_STATUSES:
+                has_open_orders = True
+
+            if self.__outdated_func(order_dict['order_id'], parse_timestamp(order_dict.get('updated_at'))):
+                continue
+
+            self.__repair_func(order_dict)
+            repaired += 1
+
+        with self.__lock:
+            self.__stats.runs += 1
+            self.__stats.repaired += repaired
+            self.__stats.last_run_at = time.time()
+            if has_open_orders or repaired:
+                self.__stats.interval = self.min_interval
+            else:
+                self.__stats.interval = min(self.__stats.interval * self.backoff, self.max_interval)
+
+        if repaired:
+            logger.warning(f'Reconciler repaired {repaired} order(s) missed by the websocket')
+        return repaired
+
+    def __run(self):
+        while not self.__stop_event.is_set():
+            with self.__lock:
+                interval = self.__stats.interval
+
+            self.__wake_event.wait(interval)
+            self.__wake_event.clear()
+
+            # never poll faster than min_interval, even if woken up repeatedly
+            elapsed = time.monotonic() - self.__last_run
+            if elapsed < self.min_interval:
+                self.__stop_event.wait(self.min_interval - elapsed)
+            if self.__stop_event.is_set():
+                break
+            self.__last_run = time.monotonic()
+
+            # noinspection PyBroadException
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception('Error reconciling orders')
+                with self.__lock:
+                    self.__stats.failures += 1
+                    self.__stats.interval = min(self.__stats.interval * self.backoff, self.max_interval)
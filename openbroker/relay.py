@@ -0,0 +1,431 @@
+from typing import Callable, List, Optional, Union
+import threading
+import logging
+import socket
+import struct
+import queue
+import json
+import time
+import os
+
+from .api.ws import WsHealth
+from .prefilter import FramePreFilter
+
+logger = logging.getLogger(__name__)
+
+# frames are prefixed with their length, a zero length frame is a heartbeat
+_LENGTH = struct.Struct('!I')
+
+
+def _send_frame(sock: socket.socket, data: bytes):
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Relay connection closed')
+        data += chunk
+    return data
+
+
+def _shutdown(sock: socket.socket):
+    # closing alone does not wake up the threads blocked on the socket
+    # noinspection PyBroadException
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+    sock.close()
+
+
+def _is_listening(path: str) -> bool:
+    """ True if a process accepts connections on the Unix socket """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    except OSError:
+        # i.e. not allowed to connect: owned by another user, still in use
+        return True
+    finally:
+        sock.close()
+    return True
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    size, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, size) if size else b''
+
+
+class _FrameReader:
+
+    def __init__(self, sock: socket.socket):
+        """
+        Frames reader of a socket with a timeout: the bytes received before a timeout are kept,
+        so that a frame interrupted by a timeout is completed by the next read and the stream stays in sync.
+        """
+        self.sock = sock
+        self.__buffer = bytearray()
+
+    def read_frame(self) -> bytes:
+        """ The next frame, empty for a heartbeat. Raises `socket.timeout` if the socket timeout expires first """
+        buffer = self.__buffer
+        while True:
+            if len(buffer) >= _LENGTH.size:
+                size, = _LENGTH.unpack_from(buffer)
+                end = _LENGTH.size + size
+                if len(buffer) >= end:
+                    data = bytes(buffer[_LENGTH.size:end])
+                    del buffer[:end]
+                    return data
+
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Relay connection closed')
+            buffer += chunk
+
+
+class _RelaySubscriber:
+
+    def __init__(self, sock: socket.socket, frame_filter: Optional[FramePreFilter], max_queue: int):
+        self.sock = sock
+        self.frame_filter = frame_filter
+        self.queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def send_loop(self, on_close: Callable[["_RelaySubscriber"], None]):
+        # noinspection PyBroadException
+        try:
+            while not self.closed:
+                data = self.queue.get()
+                if data is None:
+                    break
+                _send_frame(self.sock, data)
+        except Exception:
+            logger.info('Relay subscriber disconnected')
+        finally:
+            self.close()
+            on_close(self)
+
+    def close(self):
+        self.closed = True
+        _shutdown(self.sock)
+
+
+class OrderUpdateRelay:
+
+    def __init__(
+            self,
+            path: str,
+            heartbeat_interval: float = 1.,
+            max_queue: int = 10000,
+            health_func: Optional[Callable[[], bool]] = None,
+            mode: int = 0o600
+    ):
+        """
+        Host-local relay of the order updates websocket: the process holding the upstream websocket forwards
+        its raw frames to the subscriber processes over a Unix socket, so that they do not open their own websocket.
+
+        Each subscriber receives only the frames of its user tag, filtered on the raw frames without decoding them.
+        Heartbeats are sent every `heartbeat_interval` seconds while the upstream websocket is healthy,
+        so that subscribers detect when the updates are not flowing anymore.
+        Subscribers lagging more than `max_queue` frames behind are disconnected, they reconnect and resync.
+
+        :param path: path of the Unix socket
+        :param heartbeat_interval: interval (seconds) between heartbeats
+        :param max_queue: max number of frames queued for each subscriber
+        :param health_func: [Optional] function telling if the upstream websocket is healthy
+        :param mode: permissions of the Unix socket, only the owner can connect by default:\
+        the relayed updates are not filtered by user
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('The order update relay requires Unix sockets, not available on this platform')
+
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.max_queue = max_queue
+        self.health_func = health_func
+        self.mode = mode
+
+        self.__lock = threading.Lock()
+        # copy on write: published frames iterate the subscribers without a lock
+        self.__subscribers: tuple = ()
+        self.__server: Optional[socket.socket] = None
+        self.__stop_event = threading.Event()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.__subscribers)
+
+    def start(self):
+        """
+        Listen on the Unix socket
+
+        :raises OSError: if another relay is listening on the path
+        """
+        if os.path.exists(self.path):
+            if _is_listening(self.path):
+                raise OSError(f'An order update relay is already listening on {self.path}')
+            # left by a relay that did not stop
+            os.remove(self.path)
+
+        self.__stop_event.clear()
+        self.__server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__server.bind(self.path)
+        # before listening: no connection is accepted with the default permissions
+        os.chmod(self.path, self.mode)
+        self.__server.listen()
+
+        threading.Thread(target=self.__accept_loop, name='openbroker-relay-accept', daemon=True).start()
+        threading.Thread(target=self.__heartbeat_loop, name='openbroker-relay-heartbeat', daemon=True).start()
+        logger.info(f'Relaying order updates on {self.path}')
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__server is not None:
+            _shutdown(self.__server)
+            self.__server = None
+
+        with self.__lock:
+            subscribers, self.__subscribers = self.__subscribers, ()
+        for subscriber in subscribers:
+            subscriber.close()
+            # wake up the sender thread
+            self.__enqueue(subscriber, None)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def publish(self, message: Union[str, bytes]):
+        """ Forward a raw websocket frame to the subscribers of its tag """
+        data = None
+        for subscriber in self.__subscribers:
+            if subscriber.frame_filter is not None and not subscriber.frame_filter(message):
+                continue
+            if data is None:
+                data = message.encode() if isinstance(message, str) else message
+            self.__enqueue(subscriber, data)
+
+    def __enqueue(self, subscriber: _RelaySubscriber, data: Optional[bytes]):
+        try:
+            subscriber.queue.put_nowait(data)
+        except queue.Full:
+            logger.warning(f'Relay subscriber lagging more than {self.max_queue} frames behind, disconnecting it')
+            subscriber.close()
+
+    def __accept_loop(self):
+        while not self.__stop_event.is_set():
+            try:
+                sock, _ = self.__server.accept()
+            except OSError:
+                # server socket closed
+                break
+
+            # a slow subscriber never delays the others: the subscription is read by its own thread
+            threading.Thread(target=self.__serve, args=(sock,), name='openbroker-relay-sender', daemon=True).start()
+
+    def __serve(self, sock: socket.socket):
+        # noinspection PyBroadException
+        try:
+            # the subscriber sends its subscription first: {"user_tag": ..., "statuses": [...]}
+            sock.settimeout(5)
+            subscription = json.loads(_recv_frame(sock) or b'{}')
+            sock.settimeout(None)
+        except ConnectionError:
+            # closed before subscribing, i.e. probed by another relay starting
+            sock.close()
+            return
+        except Exception:
+            logger.warning('Invalid relay subscription, closing the connection')
+            sock.close()
+            return
+
+        frame_filter = None
+        if subscription.get('user_tag') or subscription.get('statuses'):
+            frame_filter = FramePreFilter(
+                user_tag=subscription.get('user_tag') or '',
+                statuses=subscription.get('statuses')
+            )
+
+        subscriber = _RelaySubscriber(sock, frame_filter, self.max_queue)
+        with self.__lock:
+            if self.__stop_event.is_set():
+                subscriber.close()
+                return
+            self.__subscribers = self.__subscribers + (subscriber,)
+        logger.info(f'Relay subscriber connected: {subscription}')
+        subscriber.send_loop(self.__remove)
+
+    def __remove(self, subscriber: _RelaySubscriber):
+        with self.__lock:
+            self.__subscribers = tuple(s for s in self.__subscribers if s is not subscriber)
+
+    def __heartbeat_loop(self):
+        while not self.__stop_event.wait(self.heartbeat_interval):
+            if self.health_func is not None and not self.health_func():
+                continue
+            for subscriber in self.__subscribers:
+                self.__enqueue(subscriber, b'')
+
+
+class RelaySubscriber:
+
+    def __init__(
+            self,
+            path: str,
+            callback_func: Callable,
+            user_tag: str = '',
+            statuses: Optional[List[str]] = None,
+            stall_timeout: Optional[float] = 5.,
+            connect_callback: Optional[Callable[[], None]] = None
+    ):
+        """
+        Subscriber of an `OrderUpdateRelay`, receiving the order updates of a tag from a local process
+        instead of the websocket. It has the same interface as the websocket connection and reconnects when dropped.
+
+        :param path: path of the Unix socket of the relay
+        :param callback_func: function called with every decoded update
+        :param user_tag: [Optional] receive only the updates of the orders with this user tag
+        :param statuses: [Optional] receive only the updates with these statuses
+        :param stall_timeout: [Optional] max time (seconds) without frames or heartbeats, after which the subscriber\
+        is not healthy, None to disable
+        :param connect_callback: [Optional] function called after each connection, i.e. to fetch the missed updates
+        """
+        self.path = path
+        self._callback = callback_func
+        self.__subscription = json.dumps({
+            'user_tag': user_tag,
+            'statuses': [getattr(status, 'value', status) for status in statuses] if statuses is not None else None
+        }).encode()
+        self.stall_timeout = stall_timeout
+        self._connect_callback = connect_callback
+        # applied to the frames received from the relay, as for the websocket
+        self.frame_filter: Optional[Callable[[Union[str, bytes]], bool]] = None
+
+        self.__sock: Optional[socket.socket] = None
+        self.__reader: Optional[_FrameReader] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__stop_event = threading.Event()
+        self.__connected_event = threading.Event()
+        self.__connections = 0
+        self.__stalls = 0
+        self.__stalled = False
+        self.__last_frame_at: Optional[float] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.__connected_event.is_set()
+
+    @property
+    def is_healthy(self) -> bool:
+        if not self.is_connected:
+            return False
+        if self.stall_timeout is None:
+            return True
+        last_frame_at = self.__last_frame_at
+        return last_frame_at is not None and time.perf_counter() - last_frame_at <= self.stall_timeout
+
+    @property
+    def health(self) -> WsHealth:
+        last_frame_at = self.__last_frame_at
+        return WsHealth(
+            connected=self.is_connected,
+            healthy=self.is_healthy,
+            silence=time.perf_counter() - last_frame_at if last_frame_at is not None else None,
+            rtt=None,
+            last_rtt=None,
+            lag=None,
+            reconnects=max(self.__connections - 1, 0),
+            stalls=self.__stalls
+        )
+
+    def wait_connected(self, timeout: Union[float, None] = None) -> bool:
+        return self.__connected_event.wait(timeout)
+
+    def start(self):
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, name='openbroker-relay-subscriber', daemon=True)
+        self.__thread.start()
+        logger.info(f'Listening for order updates from relay {self.path}')
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__connected_event.clear()
+        sock = self.__sock
+        if sock is not None:
+            _shutdown(sock)
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __run(self):
+        while not self.__stop_event.is_set():
+            message = None
+            try:
+                if self.__sock is None:
+                    self.__connect()
+
+                data = self.__reader.read_frame()
+                self.__last_frame_at = time.perf_counter()
+                self.__stalled = False
+                if not data:
+                    # heartbeat
+                    continue
+
+                message = data.decode('utf-8')
+                frame_filter = self.frame_filter
+                if frame_filter is not None and not frame_filter(message):
+                    continue
+                self._callback(json.loads(message))
+
+            except socket.timeout:
+                # a dead relay closes the socket: silence means the upstream websocket is not healthy,
+                # the subscriber stays connected and is unhealthy until the heartbeats resume
+                if not self.__stalled:
+                    logger.warning(f'No frames received from relay {self.path} for {self.stall_timeout}s')
+                    self.__stalls += 1
+                    self.__stalled = True
+
+            except (ConnectionError, OSError) as exc:
+                if self.__stop_event.is_set():
+                    break
+                logger.warning(f'Relay connection {self.path} failed: {exc}')
+                self.__disconnect()
+                self.__stop_event.wait(1)
+
+            except Exception:
+                logger.exception(f'Error in relay listen thread for {self.path}. msg={message}')
+
+    def __connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            _send_frame(sock, self.__subscription)
+        except OSError:
+            sock.close()
+            raise
+
+        sock.settimeout(self.stall_timeout)
+        self.__sock = sock
+        self.__reader = _FrameReader(sock)
+        self.__connections += 1
+        # healthy from the first frame or heartbeat
+        self.__last_frame_at = None
+        self.__connected_event.set()
+
+        if self._connect_callback is not None:
+            # noinspection PyBroadException
+            try:
+                self._connect_callback()
+            except Exception:
+                logger.exception(f'Error in connect callback for relay {self.path}')
+
+    def __disconnect(self):
+        self.__connected_event.clear()
+        if self.__sock is not None:
+            _shutdown(self.__sock)
+            self.__sock = None
@@ -0,0 +1,57 @@
+from typing import FrozenSet
+from dataclasses import dataclass, field
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Dataclass representing the retry policy of an API endpoint.
+
+    Failures are retried only when it's safe to do so: requests that did not reach the server (i.e. connect timeout)
+    and responses with a status in `retry_on_status` are always retried, while failures where the request may
+    have been processed (i.e. read timeout, 5xx responses) are retried only for `idempotent` endpoints,
+    even when their status is in `retry_on_status`.
+    """
+    max_attempts: int = 3
+    backoff: float = 0.05
+    backoff_multiplier: float = 2.
+    max_backoff: float = 1.
+    retry_on_status: FrozenSet[int] = field(default_factory=lambda: frozenset({429, 503}))
+    idempotent: bool = True
+
+    def delay(self, attempt: int) -> float:
+        """ Time (seconds) to wait before the attempt following the `attempt`-th one """
+        return min(self.max_backoff, self.backoff * self.backoff_multiplier ** (attempt - 1))
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+DEFAULT_RETRY_POLICIES = {
+    # placing an order twice is not safe, ambiguous failures are checked via the idempotency key by OrdersClient
+    'place': RetryPolicy(max_attempts=3, retry_on_status=frozenset({429}), idempotent=False),
+    'modify': RetryPolicy(max_attempts=3),
+    'cancel': RetryPolicy(max_attempts=3),
+    'today-orders': RetryPolicy(max_attempts=3),
+    'order': RetryPolicy(max_attempts=3),
+    'orders-by-user-tag': RetryPolicy(max_attempts=3),
+}
+
+
+@dataclass
+class RequestStats:
+    """ Counters of the requests sent to an endpoint """
+    requests: int = 0
+    attempts: int = 0
+    failures: int = 0
+    total_latency: float = 0.
+    max_latency: float = 0.
+
+    @property
+    def retries(self) -> int:
+        """ Number of attempts beyond the first one """
+        return self.attempts - self.requests
+
+    @property
+    def avg_latency(self) -> float:
+        """ Average time (seconds) of a request, including its retries """
+        return self.total_latency / self.requests if self.requests else 0.
@@ -0,0 +1,426 @@
+from typing import Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Union
+from dataclasses import dataclass, replace
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+import threading
+import time
+
+from .constant.order import PositionType, TERMINAL_ORDER_STATUSES
+from .datatype.instrument import Instrument
+from .datatype.order import PlaceOrderRequestParams, PlaceResponse, OrderParams
+from .entity.order import Order
+from .exceptions import RiskCheckFailedException
+
+# max number of ids of terminal orders remembered, to ignore their late and repeated updates
+MAX_TERMINAL_ORDERS = 10000
+
+
+@dataclass
+class RiskCheck:
+    """
+    Dataclass representing an order being checked, with the counters as they would be after placing it.
+
+    Attributes:
+        request (PlaceOrderRequestParams): The place request.
+        instrument (Instrument): The instrument of the order, None if not registered in the engine.
+        price (float): The price of the order (limit or reference price, or last known price), None if unknown.
+        open_quantity (int): Worst case open quantity of the instrument (filled and working orders).
+        underlying_lots (float): Worst case open lots of the underlying, None if the instrument is not registered.
+        notional (float): Worst case gross notional of every instrument, None if the price is unknown.
+    """
+    request: PlaceOrderRequestParams
+    instrument: Optional[Instrument]
+    price: Optional[float]
+    open_quantity: int
+    underlying_lots: Optional[float]
+    notional: Optional[float]
+
+
+class RiskRule(ABC):
+    """ A pre-trade check, run in O(1) from the counters of the risk engine """
+
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__
+
+    @abstractmethod
+    def check(self, check: RiskCheck) -> Optional[str]:
+        """ The reason of the rejection, None if the order is accepted """
+        pass
+
+    def on_accepted(self, check: RiskCheck) -> None:
+        """
+        Called when every rule accepted the order, i.e. to count it, before the next order of the request is checked:
+        the orders of a request are checked as if placed one after the other
+        """
+        pass
+
+    def on_rolled_back(self, check: RiskCheck) -> None:
+        """ Called for the orders accepted, in reverse order, when a later order of the same request is rejected """
+        pass
+
+
+class MaxOpenQuantity(RiskRule):
+
+    def __init__(self, max_quantity: int, per_instrument: Optional[Mapping[str, int]] = None):
+        """
+        :param max_quantity: max open quantity of an instrument, long or short
+        :param per_instrument: [Optional] max open quantity of specific instruments, by token
+        """
+        self.max_quantity = max_quantity
+        self.per_instrument = dict(per_instrument or {})
+
+    def check(self, check: RiskCheck) -> Optional[str]:
+        limit = self.per_instrument.get(check.request.instrument_id, self.max_quantity)
+        if check.open_quantity > limit:
+            return f'Open quantity {check.open_quantity} of {check.request.symbol} above {limit}'
+        return None
+
+
+class MaxUnderlyingLots(RiskRule):
+
+    def __init__(self, max_lots: float, per_underlying: Optional[Mapping[str, float]] = None):
+        """
+        Orders of instruments not registered in the engine are rejected, their underlying being unknown.
+
+        :param max_lots: max open lots of the instruments of an underlying
+        :param per_underlying: [Optional] max open lots of specific underlyings (i.e. {'NIFTY': 20})
+        """
+        self.max_lots = max_lots
+        self.per_underlying = dict(per_underlying or {})
+
+    def check(self, check: RiskCheck) -> Optional[str]:
+        if check.instrument is None or check.underlying_lots is None:
+            return f'Underlying of {check.request.symbol} unknown, instrument not registered'
+        limit = self.per_underlying.get(check.instrument.underlying, self.max_lots)
+        if check.underlying_lots > limit:
+            return f'Open lots {check.underlying_lots:g} of {check.instrument.underlying} above {limit:g}'
+        return None
+
+
+class MaxNotional(RiskRule):
+
+    def __init__(self, max_notional: float):
+        """
+        Orders without a known price (market orders without reference price nor previous fills) are rejected.
+
+        :param max_notional: max gross notional (quantity times price) of the open quantity of every instrument
+        """
+        self.max_notional = max_notional
+
+    def check(self, check: RiskCheck) -> Optional[str]:
+        if check.notional is None:
+            return f'Price of {check.request.symbol} unknown, set the reference price of the order'
+        if check.notional > self.max_notional:
+            return f'Notional {check.notional:.2f} above {self.max_notional:.2f}'
+        return None
+
+
+class MaxOrderRate(RiskRule):
+
+    def __init__(self, max_orders: int, period: float = 1.):
+        """
+        :param max_orders: max number of orders placed in any `period`
+        :param period: length (seconds) of the sliding window
+        """
+        if max_orders <= 0:
+            raise ValueError('Max orders must be positive')
+        self.max_orders = max_orders
+        self.period = period
+        # placement times of the last max_orders orders
+        self.__placed_at = deque(maxlen=max_orders)
+
+    def check(self, check: RiskCheck) -> Optional[str]:
+        placed_at = self.__placed_at
+        if len(placed_at) == self.max_orders and time.monotonic() - placed_at[0] < self.period:
+            return f'More than {self.max_orders} orders in {self.period:g}s'
+        return None
+
+    def on_accepted(self, check: RiskCheck) -> None:
+        self.__placed_at.append(time.monotonic())
+
+    def on_rolled_back(self, check: RiskCheck) -> None:
+        self.__placed_at.pop()
+
+
+@dataclass
+class RiskStats:
+    """ Counters of the risk engine """
+    checked: int = 0
+    rejected: int = 0
+    reducing: int = 0
+
+
+class _Tracked:
+    """ Contribution of an order (or of a reservation, until its place response) to the counters """
+
+    __slots__ = ('instrument_id', 'buy', 'working', 'filled', 'price')
+
+    def __init__(self, instrument_id: str, buy: bool, working: int, filled: int, price: Optional[float]):
+        self.instrument_id = instrument_id
+        self.buy = buy
+        self.working = working
+        self.filled = filled
+        self.price = price
+
+
+class _InstrumentCounters:
+
+    __slots__ = ('net', 'working_buy', 'working_sell', 'price', 'exposure', 'notional')
+
+    def __init__(self):
+        self.net = 0
+        self.working_buy = 0
+        self.working_sell = 0
+        self.price: Optional[float] = None
+        # worst case open quantity: every working order of one side filled
+        self.exposure = 0
+        # exposure valued at the last known price, included in the gross notional of the engine
+        self.notional = 0.
+
+    def exposure_with(self, buy: int = 0, sell: int = 0) -> int:
+        return max(abs(self.net + self.working_buy + buy), abs(self.net - self.working_sell - sell))
+
+
+class RiskEngine:
+
+    def __init__(
+            self,
+            rules: Iterable[RiskRule] = (),
+            instruments: Optional[Iterable[Instrument]] = None,
+            price_func: Optional[Callable[[str], Optional[float]]] = None
+    ):
+        """
+        Pre-trade risk checks of the place requests, against counters maintained incrementally
+        from the order updates: open quantity per instrument and underlying, gross notional.
+        Each check costs O(1) per order, whatever the number of orders.
+
+        Open quantities are worst case: the net filled quantity plus the working orders of one side.
+        Accepted orders are counted as working right away, before their first update.
+        The ids of the last `MAX_TERMINAL_ORDERS` terminal orders are remembered: their repeated updates are ignored,
+        and their reservation is dropped if their place response is received after their terminal update.
+        Orders reducing the open quantity of their instrument are always accepted, so that exits are never blocked.
+
+        :param rules: the rules every order must pass, i.e. `MaxOpenQuantity`, `MaxUnderlyingLots`, `MaxNotional`,\
+        `MaxOrderRate` or custom `RiskRule` subclasses
+        :param instruments: [Optional] instruments of the orders, for the underlying and lot size
+        :param price_func: [Optional] function returning the last price of an instrument by token,\
+        i.e. `MarketDataClient.last_price`, for the notional of the market orders
+        """
+        self.__rules: tuple = tuple(rules)
+        self.__instruments: Dict[str, Instrument] = {}
+        self.__price_func = price_func
+
+        self.__lock = threading.Lock()
+        self.__stats = RiskStats()
+        self.__orders: Dict[Hashable, _Tracked] = {}
+        self.__terminal: "OrderedDict[Hashable, None]" = OrderedDict()
+        self.__counters: Dict[str, _InstrumentCounters] = {}
+        self.__underlying_lots: Dict[str, float] = {}
+        self.__notional = 0.
+
+        if instruments is not None:
+            self.add_instruments(instruments)
+
+    @property
+    def rules(self) -> tuple:
+        return self.__rules
+
+    @property
+    def stats(self) -> RiskStats:
+        with self.__lock:
+            return replace(self.__stats)
+
+    @property
+    def notional(self) -> float:
+        """ Worst case gross notional of the open quantity of every instrument """
+        return self.__notional
+
+    def open_quantity(self, instrument_id: str) -> int:
+        """ Worst case open quantity of an instrument, long or short """
+        counters = self.__counters.get(instrument_id)
+        return counters.exposure if counters is not None else 0
+
+    def underlying_lots(self, underlying: str) -> float:
+        """ Worst case open lots of the registered instruments of an underlying """
+        return self.__underlying_lots.get(underlying, 0.)
+
+    def add_rule(self, rule: RiskRule) -> None:
+        with self.__lock:
+            self.__rules = self.__rules + (rule,)
+
+    def add_instruments(self, instruments: Iterable[Instrument]) -> None:
+        """ Register instruments, i.e. found with `InstrumentsClient.find_instrument`, before their first order """
+        with self.__lock:
+            for instrument in instruments:
+                self.__instruments[instrument.token] = instrument
+
+    def check(self, order_list: List[PlaceOrderRequestParams]) -> List[Hashable]:
+        """
+        Check the orders of a place request, counting them as working orders if they are all accepted
+
+        :param order_list: the place requests
+        :return: the reservations of the orders, to pass to `on_placed` or `release`
+        :raises RiskCheckFailedException: if an order is rejected, none of the orders is counted
+        """
+        reservations = []
+        accepted: List[RiskCheck] = []
+        with self.__lock:
+            try:
+                for request in order_list:
+                    reservations.append(self.__check(request, accepted))
+            except RiskCheckFailedException:
+                self.__stats.rejected += 1
+                for reservation in reservations:
+                    self.__remove(reservation)
+                for check in reversed(accepted):
+                    for rule in self.__rules:
+                        rule.on_rolled_back(check)
+                raise
+        return reservations
+
+    def on_placed(self, reservations: List[Hashable], responses: List[PlaceResponse]) -> None:
+        """ Track the reserved orders by their order id, releasing the ones not placed """
+        with self.__lock:
+            for reservation, response in zip(reservations, responses):
+                if not response.success or not response.order_id:
+                    self.__remove(reservation)
+                elif response.order_id in self.__orders or response.order_id in self.__terminal:
+                    # already counted from its first update, or already terminal
+                    self.__remove(reservation)
+                else:
+                    self.__orders[response.order_id] = self.__orders.pop(reservation)
+
+    def release(self, reservations: List[Hashable]) -> None:
+        """ Stop counting reserved orders, i.e. after the place request failed """
+        with self.__lock:
+            for reservation in reservations:
+                self.__remove(reservation)
+
+    def load(self, orders: Iterable[Order]) -> None:
+        """ Apply the known orders, i.e. when the engine is attached to a client with previous orders """
+        for order in orders:
+            self.on_update(order)
+
+    def on_update(self, order: Order) -> None:
+        """ Apply an order update """
+        terminal = order.status in TERMINAL_ORDER_STATUSES
+        working = 0 if terminal else max(order.quantity - order.filled_quantity, 0)
+        price = order.average_price if order.filled_quantity else _order_price(order.order_info)
+
+        with self.__lock:
+            if order.order_id in self.__terminal:
+                return
+            if terminal:
+                self.__terminal[order.order_id] = None
+                while len(self.__terminal) > MAX_TERMINAL_ORDERS:
+                    self.__terminal.popitem(last=False)
+
+            tracked = self.__orders.get(order.order_id)
+            if tracked is None:
+                if terminal and not order.filled_quantity:
+                    return
+                tracked = self.__orders[order.order_id] = _Tracked(
+                    order.instrument_id, order.side == PositionType.Buy, 0, 0, None
+                )
+
+            counters = self.__instrument_counters(tracked.instrument_id)
+            self.__apply(tracked, -tracked.working)
+            delta = order.filled_quantity - tracked.filled
+            counters.net += delta if tracked.buy else -delta
+            tracked.filled = order.filled_quantity
+            tracked.price = price or tracked.price
+            if order.filled_quantity and order.average_price:
+                counters.price = order.average_price
+            self.__apply(tracked, working)
+
+            if terminal:
+                del self.__orders[order.order_id]
+
+    def __check(self, request: PlaceOrderRequestParams, accepted: List[RiskCheck]) -> Hashable:
+        self.__stats.checked += 1
+        buy = request.side == PositionType.Buy
+        counters = self.__instrument_counters(request.instrument_id)
+        price = _order_price(request.order_info) or counters.price
+        if not price and self.__price_func is not None:
+            price = self.__price_func(request.instrument_id)
+
+        exposure = counters.exposure_with(buy=request.quantity if buy else 0, sell=0 if buy else request.quantity)
+        if exposure <= counters.exposure:
+            # reducing the open quantity: exits are never blocked
+            self.__stats.reducing += 1
+        else:
+            check = RiskCheck(
+                request=request,
+                instrument=self.__instruments.get(request.instrument_id),
+                price=price or None,
+                open_quantity=exposure,
+                underlying_lots=self.__underlying_lots_with(request.instrument_id, counters, exposure),
+                notional=self.__notional_with(counters, exposure, price)
+            )
+            for rule in self.__rules:
+                reason = rule.check(check)
+                if reason is not None:
+                    raise RiskCheckFailedException(reason, rule=rule.name, request=request)
+            accepted.append(check)
+            for rule in self.__rules:
+                rule.on_accepted(check)
+
+        reservation = object()
+        tracked = self.__orders[reservation] = _Tracked(request.instrument_id, buy, 0, 0, price or None)
+        self.__apply(tracked, request.quantity)
+        return reservation
+
+    def __remove(self, key: Hashable):
+        tracked = self.__orders.pop(key, None)
+        if tracked is not None:
+            self.__apply(tracked, -tracked.working)
+
+    def __apply(self, tracked: _Tracked, working_delta: int):
+        """ Add `working_delta` to the working quantity of an order, and update the aggregated counters """
+        counters = self.__instrument_counters(tracked.instrument_id)
+        tracked.working += working_delta
+        if tracked.buy:
+            counters.working_buy += working_delta
+        else:
+            counters.working_sell += working_delta
+        if tracked.price and not counters.price:
+            counters.price = tracked.price
+        self.__update_exposure(tracked.instrument_id, counters)
+
+    def __update_exposure(self, instrument_id: str, counters: _InstrumentCounters):
+        exposure = counters.exposure_with()
+        old_exposure, counters.exposure = counters.exposure, exposure
+
+        instrument = self.__instruments.get(instrument_id)
+        if instrument is not None and instrument.lot_size:
+            self.__underlying_lots[instrument.underlying] = (
+                self.__underlying_lots.get(instrument.underlying, 0.) + (exposure - old_exposure) / instrument.lot_size
+            )
+
+        notional = exposure * (counters.price or 0.)
+        self.__notional += notional - counters.notional
+        counters.notional = notional
+
+    def __underlying_lots_with(self, instrument_id: str, counters: _InstrumentCounters, exposure: int):
+        instrument = self.__instruments.get(instrument_id)
+        if instrument is None or not instrument.lot_size:
+            return None
+        return self.__underlying_lots.get(instrument.underlying, 0.) + (exposure - counters.exposure) / instrument.lot_size
+
+    def __notional_with(self, counters: _InstrumentCounters, exposure: int, price: Optional[float]):
+        if not price:
+            return None
+        return self.__notional - counters.notional + exposure * price
+
+    def __instrument_counters(self, instrument_id: str) -> _InstrumentCounters:
+        counters = self.__counters.get(instrument_id)
+        if counters is None:
+            counters = self.__counters[instrument_id] = _InstrumentCounters()
+        return counters
+
+
+def _order_price(order_info: OrderParams) -> Union[float, None]:
+    """ Limit price of the order, or reference price of a market order, None if not set """
+    price = getattr(order_info, 'limit_price', None) or getattr(order_info, 'reference_price', None)
+    return price or None
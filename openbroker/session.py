@@ -1,9 +1,18 @@
-from typing import Dict
+from typing import Dict, Callable, Optional, Union, Iterable
+import os
+import json
+import time
+import base64
+import hashlib
 import logging
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 import requests
 
+from .cache import ResponseCache
 from .config import Config
+from .metrics import MetricsHook, NOOP_METRICS
+from .transport import TransportConfig, create_request_session, warm_up
 
 logger = logging.getLogger(__name__)
 
@@ -17,20 +26,149 @@ class UserSession:
     request_headers: Dict
     connect_timeout: int = 5
     read_timeout: int = 10
+    response_cache: Optional[ResponseCache] = field(default=None, repr=False, compare=False)
+    metrics: MetricsHook = field(default=NOOP_METRICS, repr=False, compare=False)
+    login_func: Optional[Callable[["UserSession"], None]] = field(default=None, repr=False, compare=False)
+    _login_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
+    def relogin(self, expired_token: str) -> bool:
+        """
+        Login again after the server rejected `expired_token`, refreshing the session in place.
+        If another thread already refreshed the token, the login is skipped.
 
-def generate_session(phone_number: str, password: str, ssl_verify: bool = True) -> UserSession:
-    """
-    Login to AlgoTest.in with the user account and start a session
+        :param expired_token: the auth token rejected by the server
+        :return: True if a valid token is now available, False if the session cannot login again
+        """
+        if self.login_func is None:
+            return False
 
-    :param phone_number: user phone number
-    :param password: user password
-    :return: UserSession
-    """
-    req_session = requests.Session()
-    req_session.verify = ssl_verify
+        with self._login_lock:
+            if self.auth_token != expired_token:
+                return True
+
+            logger.info(f'Session expired for user {self.user_id}, logging in again')
+            self.login_func(self)
+            return True
+
+    def warm_up(self, urls: Optional[Iterable[str]] = None, connections: int = 1) -> float:
+        """
+        Open connections to the API hosts ahead of time, i.e. before market open,
+        so that the first order does not pay the DNS, TCP and TLS setup.
+
+        :param urls: [Optional] urls of the hosts to connect to, the orders API host if not provided
+        :param connections: number of connections to open for each host
+        :return: time (seconds) spent warming up
+        """
+        if urls is None:
+            urls = [Config.order_base_url]
+        return warm_up(self.request_session, urls, connections=connections, timeout=self.connect_timeout)
+
+
+_public_session_lock = threading.Lock()
+_public_session: Union[UserSession, None] = None
+
+
+def get_public_session() -> UserSession:
+    """ The unauthenticated session shared by all the API clients that do not need a login, sharing its connection pool """
+    global _public_session
+    with _public_session_lock:
+        if _public_session is None:
+            _public_session = UserSession('', '', create_request_session(), {})
+        return _public_session
+
+
+class SessionStore:
+
+    def __init__(self, path: str, encryption_key: Union[str, bytes]):
+        """
+        Encrypted on-disk store of a logged in session (auth token, CSRF header and cookies),
+        to reuse it across restarts without logging in again.
+
+        Requires the `cryptography` package: `pip install openbroker[session-store]`.
+
+        :param path: path of the file where the session is stored
+        :param encryption_key: a Fernet key, as generated by `SessionStore.generate_key()`
+        """
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            raise ImportError(
+                'SessionStore requires the cryptography package. Install it with `pip install openbroker[session-store]`'
+            )
+
+        self.path = path
+        self.__fernet = Fernet(encryption_key)
+
+    @staticmethod
+    def generate_key() -> bytes:
+        """ Generate a new encryption key. Store it securely, i.e. in an environment variable. """
+        from cryptography.fernet import Fernet
+        return Fernet.generate_key()
+
+    def save(self, phone_number: str, session: UserSession):
+        data = {
+            'account': _account_hash(phone_number),
+            'user_id': session.user_id,
+            'auth_token': session.auth_token,
+            'request_headers': session.request_headers,
+            'cookies': [
+                {
+                    'name': cookie.name,
+                    'value': cookie.value,
+                    'domain': cookie.domain,
+                    'path': cookie.path,
+                    'expires': cookie.expires,
+                    'secure': cookie.secure
+                }
+                for cookie in session.request_session.cookies
+            ]
+        }
+
+        # write and rename, to never leave a truncated file behind
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.__fernet.encrypt(json.dumps(data).encode()))
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def load(self, phone_number: str) -> Union[Dict, None]:
+        """ Load the stored session data of the account, None if not available """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(self.__fernet.decrypt(f.read()))
+        except Exception:
+            logger.warning(f'Ignoring unreadable session file {self.path}')
+            return None
+
+        if data.get('account') != _account_hash(phone_number):
+            return None
+        return data
 
-    response = req_session.post(
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _account_hash(phone_number: str) -> str:
+    return hashlib.sha256(phone_number.encode()).hexdigest()
+
+
+def _token_expiry(token: str) -> Union[float, None]:
+    """ Read the expiry timestamp of a JWT without verifying it, None if not available """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return None
+
+
+def _login(phone_number: str, password: str, session: UserSession):
+    """ Post the user credentials to /login, refreshing the session token, headers and cookies in place """
+    response = session.request_session.post(
         f"{Config.base_url}/login",
         json={
             'phoneNumber': phone_number,
@@ -40,15 +178,85 @@ def generate_session(phone_number: str, password: str, ssl_verify: bool = True)
     response.raise_for_status()
 
     # fetch the access token in UserSession
-    access_token_cookie = req_session.cookies.get('access_token_cookie')
+    access_token_cookie = session.request_session.cookies.get('access_token_cookie')
     if access_token_cookie is None:
         raise Exception('Error fetching access JWT cookie while logging in')
-    
-    headers = {'X-CSRF-TOKEN-ACCESS': req_session.cookies.get('csrf_access_token')}
 
-    return UserSession(
-        user_id=response.json()['_id'],
-        auth_token=access_token_cookie,
+    session.user_id = response.json()['_id']
+    session.auth_token = access_token_cookie
+    session.request_headers['X-CSRF-TOKEN-ACCESS'] = session.request_session.cookies.get('csrf_access_token')
+
+
+def _restore_session(data: Dict, session: UserSession, min_validity: float) -> bool:
+    """ Restore the stored session data, if the token is still valid for at least `min_validity` seconds """
+    expiry = _token_expiry(data['auth_token'])
+    if expiry is not None and expiry - time.time() < min_validity:
+        return False
+
+    for cookie in data['cookies']:
+        session.request_session.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie['domain'],
+            path=cookie['path'],
+            expires=cookie['expires'],
+            secure=cookie['secure']
+        )
+
+    session.user_id = data['user_id']
+    session.auth_token = data['auth_token']
+    session.request_headers.update(data['request_headers'])
+    return True
+
+
+def generate_session(
+        phone_number: str,
+        password: str,
+        ssl_verify: bool = True,
+        session_store: Optional[SessionStore] = None,
+        min_validity: float = 60.,
+        transport: Optional[TransportConfig] = None,
+        response_cache: Optional[ResponseCache] = None,
+        metrics: Optional[MetricsHook] = None
+) -> UserSession:
+    """
+    Login to AlgoTest.in with the user account and start a session
+
+    If a session store is provided, the stored session is reused when its token is still valid, without
+    contacting the login endpoint. In any case, the session logs in again when the server rejects the token.
+
+    :param phone_number: user phone number
+    :param password: user password
+    :param ssl_verify: verify the SSL certificates
+    :param session_store: [Optional] encrypted store to reuse the session across restarts
+    :param min_validity: min remaining validity (seconds) of a stored token to be reused
+    :param transport: [Optional] HTTP transport settings (connection pool size, TCP options, HTTP/2)
+    :param response_cache: [Optional] cache of the responses of read-mostly endpoints, shared by the API clients
+    :param metrics: [Optional] hook called for every REST request and websocket frame of the session
+    :return: UserSession
+    """
+    req_session = create_request_session(transport, ssl_verify=ssl_verify)
+
+    def login(session: UserSession):
+        _login(phone_number, password, session)
+        if session_store is not None:
+            session_store.save(phone_number, session)
+
+    session = UserSession(
+        user_id='',
+        auth_token='',
         request_session=req_session,
-        request_headers=headers
+        request_headers={},
+        response_cache=response_cache,
+        metrics=metrics or NOOP_METRICS,
+        login_func=login
     )
+
+    if session_store is not None:
+        stored_data = session_store.load(phone_number)
+        if stored_data is not None and _restore_session(stored_data, session, min_validity):
+            logger.info(f'Reusing stored session for user {session.user_id}')
+            return session
+
+    login(session)
+    return session
@@ -0,0 +1,184 @@
+from typing import Dict, Hashable, List, Optional
+from dataclasses import replace
+import threading
+import uuid
+
+from .constant.order import OrderStatus, TERMINAL_ORDER_STATUSES
+from .datatype.instrument import Instrument
+from .datatype.order import PlaceOrderRequestParams, PlaceResponse
+from .entity.order import Order
+from .utils import is_older
+
+
+def slice_quantity(quantity: int, lot_size: int, max_qty_in_order: int) -> List[int]:
+    """
+    Split a quantity into lot-aligned child quantities within the freeze limit, the largest first
+
+    :param quantity: total quantity, a multiple of the lot size
+    :param lot_size: lot size of the instrument
+    :param max_qty_in_order: max quantity of a single order, no limit if not positive
+    :return: quantity of each child order
+    """
+    if quantity <= 0:
+        raise ValueError(f'Invalid quantity {quantity}')
+    if lot_size <= 0:
+        raise ValueError(f'Invalid lot size {lot_size}')
+    if quantity % lot_size:
+        raise ValueError(f'Quantity {quantity} is not a multiple of the lot size {lot_size}')
+    if max_qty_in_order <= 0:
+        return [quantity]
+
+    # largest lot-aligned quantity within the freeze limit
+    max_child_quantity = max_qty_in_order - max_qty_in_order % lot_size
+    if max_child_quantity <= 0:
+        raise ValueError(f'Max quantity in order {max_qty_in_order} is smaller than the lot size {lot_size}')
+
+    children, remainder = divmod(quantity, max_child_quantity)
+    return [max_child_quantity] * children + ([remainder] if remainder else [])
+
+
+def slice_order(request: PlaceOrderRequestParams, instrument: Instrument) -> List[PlaceOrderRequestParams]:
+    """ Child place requests of a parent request, split with `slice_quantity` """
+    return [
+        replace(request, quantity=quantity, tags=dict(request.tags))
+        for quantity in slice_quantity(request.quantity, instrument.lot_size, instrument.max_qty_in_order)
+    ]
+
+
+class SlicedOrder:
+
+    def __init__(self, request: PlaceOrderRequestParams, child_requests: List[PlaceOrderRequestParams]):
+        """
+        A parent order placed as lot-aligned child orders, aggregating the fills of the children from their updates.
+        Child updates are applied by the websocket thread, the state can be read from any thread.
+
+        :param request: the parent place request
+        :param child_requests: the child place requests
+        """
+        self.parent_id = uuid.uuid4()
+        self.request = request
+        self.child_requests = child_requests
+
+        self.__lock = threading.Lock()
+        self.__done_event = threading.Event()
+        self.__responses: List[Optional[PlaceResponse]] = [None] * len(child_requests)
+        self.__errors: List[Exception] = []
+        # last update of each placed child, by order id
+        self.__children: Dict[Hashable, Optional[Order]] = {}
+        self.__placing = True
+
+    @property
+    def quantity(self) -> int:
+        return self.request.quantity
+
+    @property
+    def child_order_ids(self) -> List[Hashable]:
+        """ Order ids of the children placed successfully """
+        with self.__lock:
+            return list(self.__children)
+
+    @property
+    def responses(self) -> List[Optional[PlaceResponse]]:
+        """ Place response of each child request, None if its batch failed """
+        with self.__lock:
+            return list(self.__responses)
+
+    @property
+    def errors(self) -> List[Exception]:
+        """ Errors of the place requests of the failed batches """
+        with self.__lock:
+            return list(self.__errors)
+
+    @property
+    def filled_quantity(self) -> int:
+        with self.__lock:
+            return sum(order.filled_quantity for order in self.__children.values() if order is not None)
+
+    @property
+    def pending_quantity(self) -> int:
+        """ Quantity of the children placed and not terminal yet """
+        with self.__lock:
+            return sum(
+                request.quantity - (order.filled_quantity if order is not None else 0)
+                for request, response, order in self.__placed()
+                if order is None or order.status not in TERMINAL_ORDER_STATUSES
+            )
+
+    @property
+    def average_price(self) -> float:
+        """ Average fill price of the parent, weighted by the filled quantity of each child """
+        with self.__lock:
+            filled = [order for order in self.__children.values() if order is not None and order.filled_quantity]
+            filled_quantity = sum(order.filled_quantity for order in filled)
+            if not filled_quantity:
+                return 0.
+            return sum(order.filled_quantity * order.average_price for order in filled) / filled_quantity
+
+    @property
+    def child_statuses(self) -> Dict[Hashable, Optional[OrderStatus]]:
+        """ Last known status of each placed child, None if no update was received yet """
+        with self.__lock:
+            return {order_id: order.status if order is not None else None for order_id, order in self.__children.items()}
+
+    @property
+    def is_done(self) -> bool:
+        """ Every child was placed and is completed, rejected or canceled, or failed to be placed """
+        return self.__done_event.is_set()
+
+    @property
+    def is_filled(self) -> bool:
+        return self.filled_quantity >= self.quantity
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every child is completed, rejected or canceled
+
+        :param timeout: max time (seconds) to wait, None to wait indefinitely
+        :return: True if done, False if the timeout expired
+        """
+        return self.__done_event.wait(timeout)
+
+    def on_placed(self, index: int, responses: List[PlaceResponse]):
+        """ Record the place responses of the batch of children starting at `index` """
+        with self.__lock:
+            for offset, response in enumerate(responses):
+                self.__responses[index + offset] = response
+                if response.success and response.order_id:
+                    # an update may have been applied before the response
+                    self.__children.setdefault(response.order_id, None)
+
+    def on_failed(self, exc: Exception):
+        with self.__lock:
+            self.__errors.append(exc)
+
+    def on_placing_done(self):
+        with self.__lock:
+            self.__placing = False
+            self.__check_done()
+
+    def on_child_update(self, order: Order):
+        with self.__lock:
+            known = self.__children.get(order.order_id)
+            if known is not None and is_older(order.updated_at, known.updated_at):
+                return
+            self.__children[order.order_id] = order
+            self.__check_done()
+
+    def __placed(self):
+        orders_by_id = self.__children
+        for request, response in zip(self.child_requests, self.__responses):
+            if response is not None and response.success and response.order_id:
+                yield request, response, orders_by_id.get(response.order_id)
+
+    def __check_done(self):
+        if self.__placing:
+            return
+        if all(order is not None and order.status in TERMINAL_ORDER_STATUSES for order in self.__children.values()):
+            self.__done_event.set()
+
+    def __repr__(self):
+        return (
+            f'SlicedOrder(parent_id={self.parent_id}, symbol={self.request.symbol}, quantity={self.quantity}, '
+            f'children={len(self.child_requests)}, filled_quantity={self.filled_quantity}, '
+            f'average_price={self.average_price})'
+        )
@@ -0,0 +1,174 @@
+from typing import List, Tuple, Union, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+import socket
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransportConfig:
+    """
+    Dataclass representing the HTTP transport settings of a session.
+
+    Attributes:
+        pool_connections (int): Number of hosts with a connection pool.
+        pool_maxsize (int): Max number of connections kept alive for each host.
+        tcp_nodelay (bool): Disable Nagle's algorithm, sending small requests right away.
+        tcp_keepalive (bool): Send TCP keep-alive probes, preventing idle connections from being dropped.
+        keepalive_idle (int): Idle time (seconds) before the first keep-alive probe.
+        keepalive_interval (int): Time (seconds) between keep-alive probes.
+        http2 (bool): Use HTTP/2 through the `httpx` package (`pip install httpx[http2]`).
+    """
+    pool_connections: int = 4
+    pool_maxsize: int = 16
+    tcp_nodelay: bool = True
+    tcp_keepalive: bool = True
+    keepalive_idle: int = 30
+    keepalive_interval: int = 10
+    http2: bool = False
+
+    def socket_options(self) -> List[Tuple[int, int, int]]:
+        options = [opt for opt in HTTPConnection.default_socket_options if opt[1] != socket.TCP_NODELAY]
+        if self.tcp_nodelay:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+
+        if self.tcp_keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            # platform specific options
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+            if hasattr(socket, 'TCP_KEEPINTVL'):
+                options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keepalive_interval))
+
+        return options
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, transport: TransportConfig):
+        self.__socket_options = transport.socket_options()
+        super().__init__(pool_connections=transport.pool_connections, pool_maxsize=transport.pool_maxsize)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.__socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class Http2Session:
+
+    def __init__(self, transport: TransportConfig, verify: bool = True):
+        """
+        Minimal `requests.Session` replacement sending requests over HTTP/2 with `httpx`.
+        Cookies are stored in a `requests` cookie jar, so the session is interchangeable with `requests.Session`.
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError('HTTP/2 transport requires the httpx package. Install it with `pip install httpx[http2]`')
+
+        self.__httpx = httpx
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.__client = httpx.Client(
+            http2=True,
+            verify=verify,
+            cookies=self.cookies,
+            limits=httpx.Limits(
+                max_connections=transport.pool_connections * transport.pool_maxsize,
+                max_keepalive_connections=transport.pool_maxsize
+            )
+        )
+
+    def request(self, method: str, url: str, timeout: Union[float, Tuple[float, float], None] = None, **kwargs):
+        httpx = self.__httpx
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+
+        # raise the same exceptions of requests, expected by the API clients
+        try:
+            return self.__client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.ConnectTimeout as exc:
+            raise requests.exceptions.ConnectTimeout(str(exc)) from exc
+        except httpx.TimeoutException as exc:
+            raise requests.exceptions.ReadTimeout(str(exc)) from exc
+        except httpx.TransportError as exc:
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        self.__client.close()
+
+
+def create_request_session(
+        transport: Union[TransportConfig, None] = None,
+        ssl_verify: bool = True
+) -> Union[requests.Session, Http2Session]:
+    """
+    Create the HTTP session used by the API clients, tuned according to the transport settings
+
+    :param transport: [Optional] transport settings, defaults of `TransportConfig` if not provided
+    :param ssl_verify: verify the SSL certificates
+    :return: a requests.Session, or an Http2Session if HTTP/2 is enabled
+    """
+    transport = transport or TransportConfig()
+
+    if transport.http2:
+        return Http2Session(transport, verify=ssl_verify)
+
+    session = requests.Session()
+    session.verify = ssl_verify
+    adapter = TunedHTTPAdapter(transport)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def warm_up(
+        request_session: Union[requests.Session, Http2Session],
+        urls: Iterable[str],
+        connections: int = 1,
+        timeout: float = 5.
+) -> float:
+    """
+    Open connections to the hosts of the urls ahead of time (DNS resolution, TCP and TLS handshakes),
+    keeping them alive in the session pool for the following requests.
+
+    :param request_session: the session to warm up
+    :param urls: urls of the hosts to connect to, only scheme and host are used
+    :param connections: number of connections to open for each host
+    :param timeout: max time (seconds) to wait for each connection
+    :return: time (seconds) spent warming up
+    """
+    hosts = {f'{urlsplit(url).scheme}://{urlsplit(url).netloc}/' for url in urls}
+    started_at = time.perf_counter()
+
+    def touch(host_url: str):
+        # noinspection PyBroadException
+        try:
+            # any response, even an error status, leaves an open connection in the pool
+            request_session.head(host_url, timeout=(timeout, timeout))
+        except Exception as exc:
+            logger.warning(f'Failed to warm up connection to {host_url}: {exc}')
+
+    requests_to_send = [host for host in hosts for _ in range(connections)]
+    with ThreadPoolExecutor(max_workers=max(1, len(requests_to_send))) as executor:
+        list(executor.map(touch, requests_to_send))
+
+    elapsed = time.perf_counter() - started_at
+    logger.info(f'Warmed up {connections} connection(s) to {sorted(hosts)} in {elapsed:.3f}s')
+    return elapsed
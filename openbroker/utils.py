@@ -1,7 +1,66 @@
+from typing import Optional, Union
+import datetime
+import re
+
+# timezone of the timestamps sent without an offset by the AlgoTest servers (India has no daylight saving time)
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30), 'IST')
+
+# ISO 8601 timestamp, with a fraction of any length and an offset with or without colon
+_TIMESTAMP_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?'
+    r'\s*(Z|[+-]\d{2}(?::?\d{2})?)?$',
+    re.IGNORECASE
+)
+
+
 def str_to_bool(value: str):
     if value.lower() in ['true', '1']:
         return True
     elif value.lower() in ['false', '0']:
         return False
     else:
-        raise ValueError(f'Cannot parse "{value}" into bool')
\ No newline at end of file
+        raise ValueError(f'Cannot parse "{value}" into bool')
+
+
+def parse_timestamp(value: Union[str, datetime.datetime, None]) -> Union[datetime.datetime, None]:
+    """
+    Parse an ISO 8601 timestamp into a timezone aware datetime. Timestamps without a timezone are in IST.
+    Unlike `datetime.fromisoformat` before Python 3.11, fractions of any length and `+0530` offsets are accepted.
+    """
+    if value is None or value == '':
+        return None
+
+    if not isinstance(value, datetime.datetime):
+        match = _TIMESTAMP_RE.match(value.strip())
+        if match is None:
+            raise ValueError(f'Invalid timestamp "{value}"')
+        year, month, day, hour, minute, second, fraction, offset = match.groups()
+
+        tzinfo = None
+        if offset is not None:
+            if offset.upper() == 'Z':
+                tzinfo = datetime.timezone.utc
+            else:
+                sign = -1 if offset[0] == '-' else 1
+                digits = offset[1:].replace(':', '')
+                tzinfo = datetime.timezone(
+                    sign * datetime.timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+                )
+
+        value = datetime.datetime(
+            int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+            # microseconds: longer fractions are truncated
+            int((fraction or '0')[:6].ljust(6, '0')),
+            tzinfo=tzinfo
+        )
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=IST)
+    return value
+
+
+def is_older(updated_at: Optional[datetime.datetime], other: Optional[datetime.datetime]) -> bool:
+    """ True if the update time `updated_at` is before `other`, an unknown update time being older than any other """
+    if updated_at is None:
+        return other is not None
+    return other is not None and updated_at < other